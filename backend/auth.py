@@ -1,25 +1,39 @@
-from datetime import datetime, timedelta
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
 from typing import Optional
 from pathlib import Path
 from uuid import uuid4
+import hashlib
+import hmac
+import secrets
+import threading
+import time
 
 from fastapi import Depends, HTTPException, status, Header
+from fastapi.concurrency import run_in_threadpool
 from fastapi.security import OAuth2PasswordBearer
 from jose import JWTError, jwt
-from passlib.context import CryptContext
-from sqlalchemy.orm import Session
+from sqlalchemy import event, func, inspect
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session, selectinload
 
 from config import (
     SECRET_KEY,
     ALGORITHM,
     ACCESS_TOKEN_EXPIRE_MINUTES,
+    REFRESH_TOKEN_EXPIRE_DAYS,
     FIREBASE_CREDENTIALS_PATH,
     FIREBASE_PROJECT_ID,
     FIREBASE_REQUIRE_EMAIL_VERIFIED,
     FIREBASE_REQUIRE_EMAIL_CODE,
+    FIREBASE_KEY_REFRESH_SECONDS,
+    PASSWORD_HASH_WORKERS,
+    PASSWORD_HASH_QUEUE_SIZE,
+    PASSWORD_HASH_RETRY_AFTER,
 )
 from database import SessionLocal
-from models import User, Role, EmailOTP
+from models import User, Role, EmailOTP, RefreshToken
+from password_hashing import PasswordHasher, PasswordHasherBusy
 
 try:
     import firebase_admin
@@ -28,7 +42,12 @@ except Exception:  # pragma: no cover - optional dependency
     firebase_admin = None
     fb_auth = None
 
-pwd_context = CryptContext(schemes=["pbkdf2_sha256"], deprecated="auto")
+password_hasher = PasswordHasher(
+    workers=PASSWORD_HASH_WORKERS,
+    queue_size=PASSWORD_HASH_QUEUE_SIZE,
+    retry_after=PASSWORD_HASH_RETRY_AFTER,
+)
+USERNAME_ALLOCATION_ATTEMPTS = 5
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/auth/token")
 
 firebase_app = None
@@ -49,6 +68,287 @@ if firebase_admin and FIREBASE_CREDENTIALS_PATH:
         firebase_error = exc
 
 
+def _fetch_firebase_signing_keys() -> None:
+    # verify_id_token downloads Google's public certificates through a
+    # cache-control aware session; fetching them ahead of time keeps that
+    # download off the request path.
+    from firebase_admin import _token_gen
+
+    verifier = fb_auth._get_client(firebase_app)._token_verifier
+    verifier.request(url=_token_gen.ID_TOKEN_CERT_URI)
+
+
+def start_firebase_key_prefetch(interval_seconds: float = FIREBASE_KEY_REFRESH_SECONDS) -> None:
+    if not firebase_app or not fb_auth:
+        return
+
+    def run() -> None:
+        while True:
+            try:
+                _fetch_firebase_signing_keys()
+            except Exception:  # pragma: no cover - network or SDK internals
+                pass
+            time.sleep(interval_seconds)
+
+    threading.Thread(target=run, name="firebase-key-prefetch", daemon=True).start()
+
+
+class RoleRegistry:
+    """Process-wide mapping between role names and role bits (``1 << roles.id``).
+
+    Role commits in this process clear the map. Roles created by another
+    worker are picked up when a lookup misses, i.e. an unknown name or a mask
+    bit with no known role; such reloads happen at most once per
+    ``miss_reload_seconds``.
+    """
+
+    def __init__(self, miss_reload_seconds: float = 5.0) -> None:
+        self.miss_reload_seconds = miss_reload_seconds
+        self.bits_by_name: dict[str, int] | None = None
+        self.loaded_at = 0.0
+        self.lock = threading.Lock()
+
+    def _load(self) -> dict[str, int]:
+        db = SessionLocal()
+        try:
+            self.bits_by_name = {name: 1 << role_id for role_id, name in db.query(Role.id, Role.name).all()}
+        finally:
+            db.close()
+        self.loaded_at = time.monotonic()
+        return self.bits_by_name
+
+    def _bits(self) -> dict[str, int]:
+        bits = self.bits_by_name
+        if bits is not None:
+            return bits
+        with self.lock:
+            if self.bits_by_name is None:
+                return self._load()
+            return self.bits_by_name
+
+    def _reload_after_miss(self) -> dict[str, int]:
+        with self.lock:
+            if self.bits_by_name is None or time.monotonic() - self.loaded_at >= self.miss_reload_seconds:
+                return self._load()
+            return self.bits_by_name
+
+    def bit(self, name: str) -> int:
+        bit = self._bits().get(name)
+        if bit is None:
+            bit = self._reload_after_miss().get(name, 0)
+        return bit
+
+    def names(self, mask: int) -> frozenset[str]:
+        bits = self._bits()
+        if mask & ~sum(bits.values()):
+            bits = self._reload_after_miss()
+        return frozenset(name for name, bit in bits.items() if mask & bit)
+
+    def clear(self) -> None:
+        self.bits_by_name = None
+
+
+role_registry = RoleRegistry()
+
+
+def role_mask_for(user: User) -> int:
+    mask = 0
+    for role in user.roles:
+        mask |= 1 << role.id
+    return mask
+
+
+class AuthUser:
+    """Detached snapshot of a user's identity and role bitmask.
+
+    Returned by JWT authentication instead of the ORM row so role checks
+    are integer operations that never touch the ``user_roles`` relationship.
+    """
+
+    __slots__ = ("id", "email", "username", "is_active", "role_mask", "role_version")
+
+    def __init__(
+        self,
+        id: int,
+        email: str,
+        username: str,
+        is_active: bool,
+        role_mask: int,
+        role_version: int,
+    ):
+        self.id = id
+        self.email = email
+        self.username = username
+        self.is_active = is_active
+        self.role_mask = role_mask
+        self.role_version = role_version
+
+    @classmethod
+    def from_user(cls, user: User) -> "AuthUser":
+        return cls(
+            id=user.id,
+            email=user.email,
+            username=user.username,
+            is_active=bool(user.is_active),
+            role_mask=role_mask_for(user),
+            role_version=user.role_version or 0,
+        )
+
+    @property
+    def role_names(self) -> frozenset[str]:
+        return role_registry.names(self.role_mask)
+
+
+class UserIdentityCache:
+    """Thread-safe TTL + LRU cache of AuthUser snapshots keyed by user id."""
+
+    def __init__(self, max_entries: int = 10000, ttl_seconds: float = 60.0) -> None:
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.entries: OrderedDict[int, tuple[float, AuthUser]] = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, user_id: int) -> Optional[AuthUser]:
+        with self.lock:
+            entry = self.entries.get(user_id)
+            if not entry:
+                return None
+            stored_at, identity = entry
+            if time.monotonic() - stored_at > self.ttl_seconds:
+                del self.entries[user_id]
+                return None
+            self.entries.move_to_end(user_id)
+            return identity
+
+    def set(self, identity: AuthUser) -> None:
+        with self.lock:
+            self.entries[identity.id] = (time.monotonic(), identity)
+            self.entries.move_to_end(identity.id)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def invalidate(self, user_id: int) -> None:
+        with self.lock:
+            self.entries.pop(user_id, None)
+
+    def clear(self) -> None:
+        with self.lock:
+            self.entries.clear()
+
+
+user_identity_cache = UserIdentityCache()
+
+
+class FirebaseTokenCache:
+    """Bounded LRU of verified Firebase ID tokens, keyed by SHA-256 digest.
+
+    Each entry holds the resolved user id until the token's ``exp``, so a
+    repeat request skips signature verification and the email-code lookup.
+    """
+
+    def __init__(self, max_entries: int = 10000) -> None:
+        self.max_entries = max_entries
+        self.entries: OrderedDict[str, tuple[float, int, str]] = OrderedDict()
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def digest(token: str) -> str:
+        return hashlib.sha256(token.encode("utf-8")).hexdigest()
+
+    def get(self, token_digest: str) -> Optional[int]:
+        with self.lock:
+            entry = self.entries.get(token_digest)
+            if not entry:
+                return None
+            expires_at, user_id, _email = entry
+            if time.time() >= expires_at:
+                del self.entries[token_digest]
+                return None
+            self.entries.move_to_end(token_digest)
+            return user_id
+
+    def set(self, token_digest: str, expires_at: float, user_id: int, email: str) -> None:
+        with self.lock:
+            self.entries[token_digest] = (expires_at, user_id, email)
+            self.entries.move_to_end(token_digest)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def discard(self, token_digest: str) -> None:
+        with self.lock:
+            self.entries.pop(token_digest, None)
+
+    def invalidate(self, user_ids: "set[int]", emails: "set[str]") -> None:
+        with self.lock:
+            stale = [
+                token_digest
+                for token_digest, (_expires_at, user_id, email) in self.entries.items()
+                if user_id in user_ids or email in emails
+            ]
+            for token_digest in stale:
+                del self.entries[token_digest]
+
+    def clear(self) -> None:
+        with self.lock:
+            self.entries.clear()
+
+
+firebase_token_cache = FirebaseTokenCache()
+
+
+@event.listens_for(Session, "before_flush")
+def _bump_role_versions(session: Session, flush_context, instances) -> None:
+    # Access tokens carry the role version they were issued with; bumping it
+    # on every role change makes the embedded role claims stale.
+    for instance in session.dirty:
+        if isinstance(instance, User) and inspect(instance).attrs.roles.history.has_changes():
+            instance.role_version = (instance.role_version or 0) + 1
+
+
+@event.listens_for(Session, "after_flush")
+def _track_identity_writes(session: Session, flush_context) -> None:
+    for instance in (*session.new, *session.dirty, *session.deleted):
+        if isinstance(instance, Role):
+            session.info["roles_dirty"] = True
+        elif isinstance(instance, User) and instance not in session.new:
+            session.info.setdefault("dirty_user_ids", set()).add(instance.id)
+        elif isinstance(instance, EmailOTP) and instance not in session.new:
+            session.info.setdefault("dirty_otp_emails", set()).add(instance.email)
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_identity_cache(session: Session) -> None:
+    dirty_user_ids = session.info.pop("dirty_user_ids", set())
+    dirty_otp_emails = session.info.pop("dirty_otp_emails", set())
+    if dirty_user_ids or dirty_otp_emails:
+        firebase_token_cache.invalidate(dirty_user_ids, dirty_otp_emails)
+    if session.info.pop("roles_dirty", False):
+        role_registry.clear()
+        user_identity_cache.clear()
+        return
+    for user_id in dirty_user_ids:
+        user_identity_cache.invalidate(user_id)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_identity_writes(session: Session) -> None:
+    session.info.pop("roles_dirty", None)
+    session.info.pop("dirty_user_ids", None)
+    session.info.pop("dirty_otp_emails", None)
+
+
+def user_role_names(user: User | AuthUser) -> frozenset[str]:
+    if isinstance(user, AuthUser):
+        return user.role_names
+    return frozenset(role.name for role in user.roles)
+
+
+def has_role(user: User | AuthUser, role_name: str) -> bool:
+    if isinstance(user, AuthUser):
+        return bool(user.role_mask & role_registry.bit(role_name))
+    return any(role.name == role_name for role in user.roles)
+
+
 def get_db():
     db = SessionLocal()
     try:
@@ -57,12 +357,35 @@ def get_db():
         db.close()
 
 
-def verify_password(plain_password: str, hashed_password: str) -> bool:
-    return pwd_context.verify(plain_password, hashed_password)
+def _hasher_busy(exc: PasswordHasherBusy) -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        detail="Too many sign-in attempts, try again shortly",
+        headers={"Retry-After": str(exc.retry_after)},
+    )
 
 
 def get_password_hash(password: str) -> str:
-    return pwd_context.hash(password)
+    # For sync dependencies already on the threadpool: PBKDF2 still runs in
+    # the hasher pool, and a full queue answers 503 like the async paths.
+    try:
+        return password_hasher.hash_sync(password)
+    except PasswordHasherBusy as exc:
+        raise _hasher_busy(exc) from None
+
+
+async def hash_password_async(password: str) -> str:
+    try:
+        return await password_hasher.hash(password)
+    except PasswordHasherBusy as exc:
+        raise _hasher_busy(exc) from None
+
+
+async def verify_password_async(plain_password: str, hashed_password: str) -> bool:
+    try:
+        return await password_hasher.verify(plain_password, hashed_password)
+    except PasswordHasherBusy as exc:
+        raise _hasher_busy(exc) from None
 
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -> str:
@@ -72,34 +395,166 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -
     return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
 
 
+def create_user_access_token(user: User) -> str:
+    return create_access_token(
+        {
+            "sub": str(user.id),
+            "rm": role_mask_for(user),
+            "rv": user.role_version or 0,
+        }
+    )
+
+
+def _refresh_token_hash(token: str) -> str:
+    return hmac.new(SECRET_KEY.encode("utf-8"), token.encode("utf-8"), hashlib.sha256).hexdigest()
+
+
+def issue_refresh_token(db: Session, user_id: int, family_id: str | None = None) -> str:
+    token = secrets.token_urlsafe(32)
+    db.add(
+        RefreshToken(
+            user_id=user_id,
+            token_hash=_refresh_token_hash(token),
+            family_id=family_id or uuid4().hex,
+            expires_at=datetime.now(timezone.utc) + timedelta(days=REFRESH_TOKEN_EXPIRE_DAYS),
+        )
+    )
+    db.commit()
+    return token
+
+
+def rotate_refresh_token(db: Session, token: str) -> tuple[User, str]:
+    """Exchange a refresh token for a new one in the same family.
+
+    Presenting an already-rotated token revokes the whole family, since it
+    means the token was copied.
+    """
+    invalid = HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail="Invalid refresh token",
+    )
+    record = (
+        db.query(RefreshToken)
+        .filter(RefreshToken.token_hash == _refresh_token_hash(token))
+        .with_for_update()
+        .first()
+    )
+    if not record:
+        raise invalid
+    now = datetime.now(timezone.utc)
+    if record.revoked_at is not None:
+        (
+            db.query(RefreshToken)
+            .filter(RefreshToken.family_id == record.family_id, RefreshToken.revoked_at.is_(None))
+            .update({RefreshToken.revoked_at: now}, synchronize_session=False)
+        )
+        db.commit()
+        raise invalid
+    expires_at = record.expires_at
+    if expires_at.tzinfo is None:
+        expires_at = expires_at.replace(tzinfo=timezone.utc)
+    user = (
+        db.query(User)
+        .options(selectinload(User.roles))
+        .filter(User.id == record.user_id)
+        .first()
+    )
+    if expires_at <= now or not user or not user.is_active:
+        raise invalid
+    record.revoked_at = now
+    return user, issue_refresh_token(db, user.id, record.family_id)
+
+
+def allocate_username(db: Session, base: str, exclude: "set[str]" = frozenset()) -> str:
+    """Return ``base`` or ``base<N>`` with the smallest free ``N``.
+
+    Existing suffixes come from a single range scan on the username index
+    instead of probing candidates one at a time. LIKE is avoided because it
+    cannot use a plain btree under PostgreSQL's non-C collations and is
+    case-insensitive on SQLite.
+    """
+    rows = db.query(User.username).filter(
+        User.username >= base,
+        User.username < base + "\U0010ffff",
+    )
+    taken = set()
+    for username in (*(row[0] for row in rows), *exclude):
+        if not username.startswith(base):
+            continue
+        suffix = username[len(base):]
+        if not suffix:
+            taken.add(0)
+        elif suffix.isascii() and suffix.isdigit() and suffix[0] != "0":
+            taken.add(int(suffix))
+    counter = 0
+    while counter in taken:
+        counter += 1
+    return f"{base}{counter}" if counter else base
+
+
+def add_user_with_unique_username(db: Session, user: User, base_username: str) -> None:
+    """Add ``user`` under a free username derived from ``base_username``.
+
+    A concurrent signup can claim the same name between allocation and
+    insert; the unique index rejects it and allocation is retried.
+    """
+    exclude: set[str] = set()
+    for _ in range(USERNAME_ALLOCATION_ATTEMPTS):
+        user.username = allocate_username(db, base_username, exclude)
+        try:
+            with db.begin_nested():
+                db.add(user)
+        except IntegrityError:
+            # Only a clash on the username is retried; a duplicate email from
+            # a concurrent signup is the caller's to report.
+            if db.query(User.id).filter(User.username == user.username).first() is None:
+                raise
+            exclude.add(user.username)
+            continue
+        return
+    raise HTTPException(status_code=409, detail="Could not allocate a username, try again")
+
+
 def get_user_by_username_or_email(db: Session, username: str) -> Optional[User]:
     candidate = username.strip()
     if not candidate:
         return None
-    email_candidate = candidate.lower()
-    return (
+    normalized = candidate.lower()
+    # SQL lower() only folds ASCII on SQLite and under PostgreSQL's C ctype,
+    # so the exact spellings are matched too (through the unique indexes).
+    users = (
         db.query(User)
         .filter(
             (User.username == candidate)
-            | (User.email == candidate)
-            | (User.email == email_candidate)
+            | (User.email == normalized)
+            | (func.lower(User.username) == normalized)
+            | (func.lower(User.email) == normalized)
         )
-        .first()
+        .order_by(User.id)
+        .all()
     )
+    if not users:
+        return None
+    # Usernames differing only in case may coexist; prefer the exact spelling,
+    # then the oldest account.
+    for user in users:
+        if user.username == candidate or user.email.lower() == normalized:
+            return user
+    return users[0]
 
 
-def authenticate_user(db: Session, username: str, password: str) -> Optional[User]:
+async def authenticate_user_async(db: Session, username: str, password: str) -> Optional[User]:
     if not username or not password:
         return None
-    user = get_user_by_username_or_email(db, username)
+    user = await run_in_threadpool(get_user_by_username_or_email, db, username)
     if not user:
         return None
-    if not verify_password(password, user.hashed_password):
+    if not await verify_password_async(password, user.hashed_password):
         return None
     return user
 
 
-def _get_user_from_jwt(db: Session, token: str) -> Optional[User]:
+def _get_user_from_jwt(db: Session, token: str) -> Optional[AuthUser]:
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         user_id: Optional[str] = payload.get("sub")
@@ -107,16 +562,75 @@ def _get_user_from_jwt(db: Session, token: str) -> Optional[User]:
             return None
     except JWTError:
         return None
-    return db.query(User).filter(User.id == int(user_id)).first()
+    identity = user_identity_cache.get(int(user_id))
+    if identity:
+        return identity
+    role_mask = payload.get("rm")
+    role_version = payload.get("rv")
+    if isinstance(role_mask, int) and isinstance(role_version, int):
+        # Trust the token's role claims when its role version is current,
+        # which avoids loading the roles relationship.
+        row = (
+            db.query(User.id, User.email, User.username, User.is_active, User.role_version)
+            .filter(User.id == int(user_id))
+            .first()
+        )
+        if not row:
+            return None
+        if (row.role_version or 0) == role_version:
+            identity = AuthUser(
+                id=row.id,
+                email=row.email,
+                username=row.username,
+                is_active=bool(row.is_active),
+                role_mask=role_mask,
+                role_version=role_version,
+            )
+            user_identity_cache.set(identity)
+            return identity
+    return _load_identity(db, int(user_id))
+
+
+def _load_identity(db: Session, user_id: int) -> Optional[AuthUser]:
+    user = (
+        db.query(User)
+        .options(selectinload(User.roles))
+        .filter(User.id == user_id)
+        .first()
+    )
+    if not user:
+        return None
+    identity = AuthUser.from_user(user)
+    user_identity_cache.set(identity)
+    return identity
 
 
-def _get_user_from_firebase(db: Session, token: str) -> Optional[User]:
+def _get_user_from_firebase(db: Session, token: str) -> Optional[AuthUser]:
     if not firebase_app or not fb_auth:
         return None
+    token_digest = firebase_token_cache.digest(token)
+    cached_user_id = firebase_token_cache.get(token_digest)
+    if cached_user_id is not None:
+        identity = user_identity_cache.get(cached_user_id) or _load_identity(db, cached_user_id)
+        if identity:
+            return identity
+        firebase_token_cache.discard(token_digest)
     try:
         decoded = fb_auth.verify_id_token(token, app=firebase_app)
     except Exception:
         return None
+    user = _resolve_firebase_user(db, decoded)
+    if not user:
+        return None
+    identity = AuthUser.from_user(user)
+    user_identity_cache.set(identity)
+    expires_at = decoded.get("exp")
+    if isinstance(expires_at, (int, float)):
+        firebase_token_cache.set(token_digest, float(expires_at), user.id, user.email)
+    return identity
+
+
+def _resolve_firebase_user(db: Session, decoded: dict) -> Optional[User]:
     email = decoded.get("email")
     if not email:
         return None
@@ -131,30 +645,28 @@ def _get_user_from_firebase(db: Session, token: str) -> Optional[User]:
         if not verified:
             raise HTTPException(status_code=403, detail="Email code required")
 
-    user = db.query(User).filter(User.email == email).first()
+    user = (
+        db.query(User)
+        .options(selectinload(User.roles))
+        .filter(User.email == email)
+        .first()
+    )
     if user:
         return user
 
     base_username = (decoded.get("name") or email.split("@")[0] or "user").strip()
-    candidate = base_username
-    counter = 1
-    while db.query(User).filter(User.username == candidate).first():
-        candidate = f"{base_username}{counter}"
-        counter += 1
-
     user = User(
         email=email,
-        username=candidate,
         hashed_password=get_password_hash(uuid4().hex),
     )
+    add_user_with_unique_username(db, user, base_username)
     user.roles = [get_or_create_role(db, "user")]
-    db.add(user)
     db.commit()
     db.refresh(user)
     return user
 
 
-def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)) -> User:
+def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)) -> User | AuthUser:
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
@@ -172,7 +684,7 @@ def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(
 def get_optional_user(
     authorization: Optional[str] = Header(default=None),
     db: Session = Depends(get_db),
-) -> Optional[User]:
+) -> Optional[User | AuthUser]:
     if not authorization:
         return None
     parts = authorization.split()
@@ -185,12 +697,12 @@ def get_optional_user(
     return _get_user_from_firebase(db, token)
 
 
-def create_firebase_custom_token_for_user(user: User) -> Optional[str]:
+def create_firebase_custom_token_for_user(user: User | AuthUser) -> Optional[str]:
     if not firebase_app or not fb_auth:
         return None
     claims = {
         "app_user_id": user.id,
-        "roles": [role.name for role in user.roles],
+        "roles": sorted(user_role_names(user)),
     }
     token = fb_auth.create_custom_token(
         uid=f"app-user-{user.id}",
@@ -0,0 +1,71 @@
+"""Bytes and server CPU saved by conditional GETs (If-None-Match -> 304).
+
+Each endpoint is requested ``--requests`` times with and without the ETag
+from the previous response. CPU is ``time.process_time`` per request, which
+includes the in-process test client on both sides of the comparison.
+"""
+
+import argparse
+import time
+
+import common
+
+
+def measure(client, path: str, headers: dict, requests: int) -> tuple[int, float, int, float]:
+    first = client.get(path, headers=headers)
+    assert first.status_code == 200, (path, first.status_code)
+    etag = first.headers["etag"]
+
+    def run(extra: dict, expected: int) -> tuple[int, float]:
+        size = 0
+        started = time.process_time()
+        for _ in range(requests):
+            response = client.get(path, headers={**headers, **extra})
+            assert response.status_code == expected, (path, response.status_code)
+            size = len(response.content)
+        return size, (time.process_time() - started) / requests * 1e6
+
+    full_bytes, full_cpu = run({}, 200)
+    cached_bytes, cached_cpu = run({"If-None-Match": etag}, 304)
+    return full_bytes, full_cpu, cached_bytes, cached_cpu
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--requests", type=int, default=500)
+    args = parser.parse_args()
+
+    common.setup_environment()
+    from fastapi.testclient import TestClient
+
+    import main as app_main
+
+    with TestClient(app_main.app) as client:
+        login = client.post(
+            "/auth/login",
+            json={"username": app_main.TEACHER_USERNAME, "password": app_main.TEACHER_PASSWORD},
+        )
+        headers = {"Authorization": f"Bearer {login.json()['access_token']}"}
+        course = client.get("/courses", headers=headers).json()[0]
+        paths = [
+            "/courses",
+            f"/courses/{course['id']}",
+            f"/courses/{course['id']}/ratings",
+            f"/teachers/{course['instructor']}/ratings",
+            f"/lessons/{course['lessons'][0]['id']}",
+        ]
+        rows = []
+        for path in paths:
+            full_bytes, full_cpu, cached_bytes, cached_cpu = measure(client, path, headers, args.requests)
+            rows.append(
+                [path, full_bytes, cached_bytes, full_bytes - cached_bytes, full_cpu, cached_cpu, full_cpu - cached_cpu]
+            )
+    print(f"{args.requests} requests per endpoint and variant")
+    common.print_table(
+        ["endpoint", "200 bytes", "304 bytes", "bytes saved", "200 CPU us", "304 CPU us", "CPU us saved"],
+        rows,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+"""Course search and suggest latency over synthetic catalogs.
+
+Builds SearchIndex and PrefixSuggester with the same field weights as
+/courses/search for each catalog size and reports p50/p95/p99 per query
+shape. Terms follow a Zipf-like distribution so common words have long
+posting lists. Only the in-memory index is timed; the endpoint adds one
+primary-key fetch of the returned page.
+"""
+
+import argparse
+import random
+import string
+import time
+
+import common
+
+
+def build_vocabulary(rng: random.Random, size: int) -> list[str]:
+    words = set()
+    while len(words) < size:
+        words.add("".join(rng.choices(string.ascii_lowercase, k=rng.randint(4, 10))))
+    return sorted(words)
+
+
+def generate_courses(rng: random.Random, count: int, vocabulary: list[str]) -> list[dict]:
+    weights = [1 / rank for rank in range(1, len(vocabulary) + 1)]
+    instructors = [" ".join(rng.choices(vocabulary, k=2)).title() for _ in range(500)]
+    categories = [f"Category {index}" for index in range(12)]
+    levels = ["Beginner", "Intermediate", "Advanced"]
+
+    def words(amount: int) -> str:
+        return " ".join(rng.choices(vocabulary, weights=weights, k=amount))
+
+    return [
+        {
+            "id": f"course-{index}",
+            "title": words(rng.randint(4, 8)),
+            "instructor": rng.choice(instructors),
+            "topics": " ".join(words(2) for _ in range(5)),
+            "summary": words(rng.randint(20, 40)),
+            "category": rng.choice(categories),
+            "level": rng.choice(levels),
+        }
+        for index in range(count)
+    ]
+
+
+def generate_queries(rng: random.Random, courses: list[dict], count: int) -> dict[str, list[tuple[str, dict]]]:
+    samples = rng.choices(courses, k=count)
+    queries: dict[str, list[tuple[str, dict]]] = {
+        "one term": [],
+        "two terms": [],
+        "prefix (3 chars)": [],
+        "term + prefix + filter": [],
+    }
+    for course in samples:
+        title = course["title"].split()
+        summary = course["summary"].split()
+        queries["one term"].append((rng.choice(title), {}))
+        queries["two terms"].append((f"{rng.choice(title)} {rng.choice(summary)}", {}))
+        queries["prefix (3 chars)"].append((rng.choice(title)[:3], {}))
+        queries["term + prefix + filter"].append(
+            (f"{rng.choice(title)} {rng.choice(summary)[:3]}", {"category": course["category"]})
+        )
+    return queries
+
+
+def time_calls(call, arguments: list) -> list[float]:
+    samples = []
+    for argument in arguments:
+        started = time.perf_counter()
+        call(*argument)
+        samples.append((time.perf_counter() - started) * 1000)
+    return samples
+
+
+def summarize(samples: list[float]) -> list[float]:
+    return [
+        common.percentile(samples, 0.50),
+        common.percentile(samples, 0.95),
+        common.percentile(samples, 0.99),
+        max(samples),
+    ]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", default="10000,100000", help="comma-separated catalog sizes")
+    parser.add_argument("--queries", type=int, default=300, help="queries per shape")
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    common.setup_environment()
+    from main import COURSE_SEARCH_FIELDS
+    from search_index import PrefixSuggester, SearchIndex
+
+    rng = random.Random(args.seed)
+    vocabulary = build_vocabulary(rng, 20000)
+    rows = []
+    for size in (int(value) for value in args.sizes.split(",")):
+        courses = generate_courses(rng, size, vocabulary)
+        index = SearchIndex(COURSE_SEARCH_FIELDS)
+        suggester = PrefixSuggester()
+        started = time.perf_counter()
+        for course in courses:
+            index.upsert(
+                course["id"],
+                course,
+                {"category": course["category"], "level": course["level"]},
+                version=1,
+            )
+        suggester.upsert_many([(course["id"], course["title"], course["instructor"]) for course in courses])
+        build_seconds = time.perf_counter() - started
+        print(f"{size:,} courses indexed in {build_seconds:.1f}s, {len(index.postings):,} distinct terms")
+
+        for shape, queries in generate_queries(rng, courses, args.queries).items():
+            samples = time_calls(lambda query, filters: index.search(query, filters=filters), queries)
+            rows.append([size, f"search: {shape}", *summarize(samples)])
+        prefixes = [(course["title"][: rng.randint(2, 6)],) for course in rng.choices(courses, k=args.queries)]
+        rows.append([size, "suggest", *summarize(time_calls(suggester.suggest, prefixes))])
+
+    common.print_table(["courses", "query", "p50 ms", "p95 ms", "p99 ms", "max ms"], rows)
+
+
+if __name__ == "__main__":
+    main()
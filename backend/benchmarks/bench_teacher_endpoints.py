@@ -0,0 +1,96 @@
+"""Requests/sec on teacher endpoints with and without role claims in the token.
+
+Three modes per endpoint:
+
+* ``identity cached`` - the per-process identity cache is warm.
+* ``token claims`` - the cache is cleared before every request, so auth
+  rebuilds the identity from the token's role bitmask with one column query.
+* ``role load`` - as above, but the token's role version is stale, so auth
+  falls back to loading the user's roles relationship.
+
+Requests are sequential through the in-process test client; compare the
+modes with each other rather than reading the absolute numbers as server
+throughput.
+"""
+
+import argparse
+import time
+
+import common
+
+
+def run(client, path: str, headers: dict, requests: int, before_request, statements: list) -> tuple[float, float]:
+    client.get(path, headers=headers)
+    statements.clear()
+    started = time.perf_counter()
+    for _ in range(requests):
+        before_request()
+        response = client.get(path, headers=headers)
+        assert response.status_code == 200, (path, response.status_code)
+    elapsed = time.perf_counter() - started
+    return requests / elapsed, len(statements) / requests
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--requests", type=int, default=500)
+    args = parser.parse_args()
+
+    common.setup_environment()
+    from fastapi.testclient import TestClient
+    from sqlalchemy import event
+
+    import auth
+    import main as app_main
+    from auth import create_user_access_token
+    from database import SessionLocal
+    from models import User
+
+    statements: list[str] = []
+    event.listen(app_main.engine, "before_cursor_execute", lambda *args: statements.append(args[2]))
+
+    with TestClient(app_main.app) as client:
+        app_main.email_outbox_worker.stop()
+        app_main.course_search_sync.stop()
+        db = SessionLocal()
+        try:
+            teacher = db.query(User).filter(User.username == app_main.TEACHER_USERNAME).one()
+            stale_token = create_user_access_token(teacher)
+            # Any role change bumps role_version; the older token then
+            # carries claims that auth no longer trusts.
+            teacher.role_version = (teacher.role_version or 0) + 1
+            db.commit()
+            current = {"Authorization": f"Bearer {create_user_access_token(teacher)}"}
+            stale = {"Authorization": f"Bearer {stale_token}"}
+        finally:
+            db.close()
+
+        lesson_id = client.get("/courses", headers=current).json()[0]["lessons"][0]["id"]
+        assignment = client.post(
+            f"/lessons/{lesson_id}/assignments",
+            json={"title": "Benchmark assignment", "max_rating": 5},
+            headers=current,
+        ).json()
+        paths = [
+            f"/lessons/{lesson_id}",
+            f"/lessons/{lesson_id}/assignments",
+            f"/assignments/{assignment['id']}/submissions",
+            f"/lessons/{lesson_id}/private-chats",
+        ]
+        modes = [
+            ("identity cached", current, lambda: None),
+            ("token claims", current, auth.user_identity_cache.clear),
+            ("role load", stale, auth.user_identity_cache.clear),
+        ]
+        rows = []
+        for path in paths:
+            for mode, headers, before_request in modes:
+                rate, queries = run(client, path, headers, args.requests, before_request, statements)
+                rows.append([path, mode, rate, queries])
+
+    print(f"{args.requests} sequential requests per endpoint and mode")
+    common.print_table(["endpoint", "mode", "req/s", "queries/req"], rows)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""Username allocation when many users share a base name.
+
+Seeds ``--users`` accounts named ``user``, ``user1`` ... and times
+allocate_username (one range query) against the previous approach of
+probing ``user<N>`` candidates one SELECT at a time, then times a run of
+real signups through add_user_with_unique_username.
+"""
+
+import argparse
+import time
+
+import common
+
+
+def legacy_allocate(db, base: str) -> str:
+    from models import User
+
+    candidate, counter = base, 0
+    while db.query(User.id).filter(User.username == candidate).first():
+        counter += 1
+        candidate = f"{base}{counter}"
+    return candidate
+
+
+def timed(call, repeat: int, statements: list) -> tuple[float, float, str]:
+    statements.clear()
+    started = time.perf_counter()
+    for _ in range(repeat):
+        result = call()
+    elapsed = time.perf_counter() - started
+    return elapsed / repeat * 1000, len(statements) / repeat, result
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--users", type=int, default=10000)
+    parser.add_argument("--base", default="user")
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--signups", type=int, default=200)
+    args = parser.parse_args()
+
+    common.setup_environment()
+    from sqlalchemy import event, insert
+
+    from auth import add_user_with_unique_username, allocate_username
+    from database import Base, SessionLocal, engine
+    from models import User
+
+    Base.metadata.create_all(bind=engine)
+    with engine.begin() as connection:
+        connection.execute(
+            insert(User),
+            [
+                {
+                    "email": f"{args.base}{index}@bench.example.com",
+                    "username": f"{args.base}{index}" if index else args.base,
+                    "hashed_password": "x",
+                }
+                for index in range(args.users)
+            ],
+        )
+
+    statements: list[str] = []
+    event.listen(engine, "before_cursor_execute", lambda *event_args: statements.append(event_args[2]))
+    db = SessionLocal()
+    try:
+        rows = []
+        for label, call, repeat in (
+            ("allocate_username", lambda: allocate_username(db, args.base), args.repeat),
+            ("one SELECT per candidate", lambda: legacy_allocate(db, args.base), max(1, args.repeat // 10)),
+        ):
+            ms, queries, result = timed(call, repeat, statements)
+            rows.append([label, ms, queries, result])
+        print(f"{args.users:,} users share the base name {args.base!r}")
+        common.print_table(["allocator", "ms per call", "queries per call", "result"], rows)
+
+        statements.clear()
+        started = time.perf_counter()
+        for index in range(args.signups):
+            user = User(email=f"signup{index}@bench.example.com", hashed_password="x")
+            add_user_with_unique_username(db, user, args.base)
+            db.commit()
+        elapsed = time.perf_counter() - started
+        print(
+            f"{args.signups} signups: {elapsed / args.signups * 1000:.2f} ms and "
+            f"{len(statements) / args.signups:.1f} statements each, last username {user.username!r}"
+        )
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
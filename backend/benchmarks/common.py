@@ -0,0 +1,87 @@
+"""Shared setup for the benchmark and load scripts in this directory.
+
+Run the scripts from the backend directory, e.g.
+``python benchmarks/bench_etags.py``. They use a throwaway SQLite database
+unless ``BENCH_DATABASE_URL`` points somewhere else.
+"""
+
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parents[1]
+
+
+def setup_environment() -> str:
+    url = os.getenv("BENCH_DATABASE_URL") or f"sqlite:///{tempfile.mkdtemp(prefix='bench-')}/bench.db"
+    os.environ["DATABASE_URL"] = url
+    # Benchmarks register users through the API without mailing codes.
+    os.environ["FIREBASE_REQUIRE_EMAIL_CODE"] = "false"
+    sys.path.insert(0, str(BACKEND_DIR))
+    import config
+
+    if config.DATABASE_URL != url:
+        raise SystemExit("backend/.env overrides DATABASE_URL; refusing to benchmark against it")
+    return url
+
+
+@contextmanager
+def run_server(startup_timeout: float = 60.0):
+    """Run the app under uvicorn in a subprocess and yield its base URL.
+
+    Call ``setup_environment`` first; the server inherits its environment.
+    """
+    import requests
+
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        port = probe.getsockname()[1]
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+        cwd=BACKEND_DIR,
+    )
+    base_url = f"http://127.0.0.1:{port}"
+    try:
+        deadline = time.monotonic() + startup_timeout
+        while True:
+            if process.poll() is not None:
+                raise SystemExit("uvicorn exited during startup")
+            try:
+                requests.get(base_url, timeout=1)
+                break
+            except requests.ConnectionError:
+                if time.monotonic() > deadline:
+                    raise SystemExit("uvicorn did not start in time")
+                time.sleep(0.2)
+        yield base_url
+    finally:
+        process.terminate()
+        process.wait(timeout=30)
+
+
+def percentile(samples: list[float], fraction: float) -> float:
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, round(fraction * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def print_table(headers: list[str], rows: list[list]) -> None:
+    cells = [headers, *[[format_cell(value) for value in row] for row in rows]]
+    widths = [max(len(row[column]) for row in cells) for column in range(len(headers))]
+    for index, row in enumerate(cells):
+        print("  ".join(value.rjust(width) for value, width in zip(row, widths)))
+        if index == 0:
+            print("  ".join("-" * width for width in widths))
+
+
+def format_cell(value) -> str:
+    if isinstance(value, float):
+        return f"{value:,.2f}"
+    if isinstance(value, int):
+        return f"{value:,}"
+    return str(value)
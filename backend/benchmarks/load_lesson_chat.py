@@ -0,0 +1,112 @@
+"""Database queries spent by lesson chat readers: polling vs the WebSocket.
+
+``--clients`` students watch one lesson while a teacher posts
+``--messages`` messages. Polling readers call an endpoint
+``--polls-per-message`` times per message (a 2 s poll against a message
+every 10 s is 5). WebSocket readers connect to /ws/lessons/{id}/messages
+once and receive pushed events. Reader queries are counted separately
+from the writer's own queries.
+"""
+
+import argparse
+import json
+
+import common
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--clients", type=int, default=30)
+    parser.add_argument("--messages", type=int, default=20)
+    parser.add_argument("--polls-per-message", type=int, default=5)
+    args = parser.parse_args()
+
+    common.setup_environment()
+    from fastapi.testclient import TestClient
+    from sqlalchemy import event
+
+    import main as app_main
+    from auth import create_user_access_token
+    from database import SessionLocal
+    from models import CourseLesson, CoursePurchase, User
+
+    statements: list[str] = []
+    event.listen(app_main.engine, "before_cursor_execute", lambda *event_args: statements.append(event_args[2]))
+
+    with TestClient(app_main.app) as client:
+        app_main.email_outbox_worker.stop()
+        app_main.course_search_sync.stop()
+        db = SessionLocal()
+        try:
+            teacher = db.query(User).filter(User.username == app_main.TEACHER_USERNAME).one()
+            lesson = db.query(CourseLesson).order_by(CourseLesson.id).first()
+            lesson_id = lesson.id
+            writer = {"Authorization": f"Bearer {create_user_access_token(teacher)}"}
+            tokens = []
+            for index in range(args.clients):
+                student = User(email=f"reader{index}@bench.example.com", username=f"reader{index}", hashed_password="x")
+                db.add(student)
+                db.flush()
+                db.add(CoursePurchase(user_id=student.id, course_id=lesson.course_id))
+                tokens.append(create_user_access_token(student))
+            db.commit()
+        finally:
+            db.close()
+        readers = [{"Authorization": f"Bearer {token}"} for token in tokens]
+
+        def post(round_index: int) -> int:
+            before = len(statements)
+            response = client.post(f"/lessons/{lesson_id}/messages", json={"content": f"message {round_index}"}, headers=writer)
+            assert response.status_code == 200, response.text
+            return len(statements) - before
+
+        rows = []
+        for mode in ("full list", "changes feed"):
+            watermarks = [0] * args.clients
+            reader_queries = writer_queries = 0
+            for round_index in range(args.messages):
+                writer_queries += post(round_index)
+                before = len(statements)
+                for _ in range(args.polls_per_message):
+                    for index, headers in enumerate(readers):
+                        if mode == "full list":
+                            response = client.get(f"/lessons/{lesson_id}/messages", headers=headers)
+                        else:
+                            response = client.get(
+                                f"/lessons/{lesson_id}/messages/changes",
+                                params={"since": watermarks[index]},
+                                headers=headers,
+                            )
+                            watermarks[index] = response.json()["watermark"]
+                        assert response.status_code == 200, response.text
+                reader_queries += len(statements) - before
+            rows.append([f"polling: {mode}", reader_queries, reader_queries / args.messages, writer_queries / args.messages])
+
+        before = len(statements)
+        sockets = [client.websocket_connect(f"/ws/lessons/{lesson_id}/messages?token={token}") for token in tokens]
+        for socket in sockets:
+            socket.__enter__()
+            assert socket.receive_json()["event"] == "connected"
+        connect_queries = len(statements) - before
+        reader_queries = writer_queries = delivered = 0
+        for round_index in range(args.messages):
+            before = len(statements)
+            writer_queries += post(round_index)
+            for socket in sockets:
+                delivered += json.loads(socket.receive_text())["event"] == "message_created"
+            reader_queries += len(statements) - before
+        reader_queries -= writer_queries
+        for socket in sockets:
+            socket.__exit__(None, None, None)
+        assert delivered == args.clients * args.messages
+        rows.append(["websocket (after connect)", reader_queries, reader_queries / args.messages, writer_queries / args.messages])
+
+    print(
+        f"{args.clients} readers, {args.messages} messages, {args.polls_per_message} polls per message; "
+        f"WebSocket connects cost {connect_queries} queries in total"
+    )
+    common.print_table(["readers", "reader queries", "per message", "writer queries per message"], rows)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""Latency of non-auth endpoints during a login storm.
+
+Starts the app under uvicorn and probes ``--probe-path`` sequentially,
+first on an idle server and then while ``--clients`` threads log in as
+fast as they can. Password hashing runs on the PASSWORD_HASH_WORKERS
+process pool, so probe latency should stay close to the idle baseline.
+Logins beyond the pool's queue are answered with 503 + Retry-After.
+"""
+
+import argparse
+import threading
+import time
+from collections import Counter
+
+import common
+
+
+def probe(session, url: str, count: int) -> list[float]:
+    samples = []
+    for _ in range(count):
+        started = time.perf_counter()
+        response = session.get(url, timeout=30)
+        response.raise_for_status()
+        samples.append((time.perf_counter() - started) * 1000)
+    return samples
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--clients", type=int, default=32, help="concurrent login threads")
+    parser.add_argument("--probes", type=int, default=300)
+    parser.add_argument("--probe-path", default="/courses/categories")
+    args = parser.parse_args()
+
+    common.setup_environment()
+    import requests
+
+    from config import TEACHER_PASSWORD, TEACHER_USERNAME
+
+    with common.run_server() as base_url:
+        probe_session = requests.Session()
+        probe_url = base_url + args.probe_path
+        probe(probe_session, probe_url, 20)
+        idle = probe(probe_session, probe_url, args.probes)
+
+        statuses: Counter = Counter()
+        lock = threading.Lock()
+        stop = threading.Event()
+
+        def storm() -> None:
+            session = requests.Session()
+            credentials = {"username": TEACHER_USERNAME, "password": TEACHER_PASSWORD}
+            while not stop.is_set():
+                status = session.post(f"{base_url}/auth/login", json=credentials, timeout=60).status_code
+                with lock:
+                    statuses[status] += 1
+
+        threads = [threading.Thread(target=storm, daemon=True) for _ in range(args.clients)]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        time.sleep(1.0)
+        during = probe(probe_session, probe_url, args.probes)
+        stop.set()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+    rows = [
+        [label, common.percentile(samples, 0.50), common.percentile(samples, 0.95), common.percentile(samples, 0.99), max(samples)]
+        for label, samples in (("idle", idle), (f"{args.clients} clients logging in", during))
+    ]
+    print(f"GET {args.probe_path}, {args.probes} sequential probes per phase")
+    common.print_table(["phase", "p50 ms", "p95 ms", "p99 ms", "max ms"], rows)
+    total = sum(statuses.values())
+    print(f"logins: {total} in {elapsed:.1f}s ({total / elapsed:.1f}/s), status counts {dict(statuses)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+"""Fan-out of one lesson's events to thousands of sockets.
+
+Connects ``--sockets`` fake WebSockets to a PrivateChatSocketHub on one
+lesson. Most acknowledge each frame after a small random delay; ``--stalled``
+never finish a send, like a dead mobile connection. The script broadcasts
+``--broadcasts`` events and reports how long the publisher is blocked per
+broadcast, how long until every healthy socket has each event, the peak
+queue depth, and what happened to the stalled sockets.
+"""
+
+import argparse
+import asyncio
+import random
+import time
+
+import common
+
+
+class FakeSocket:
+    def __init__(self, delay: float | None) -> None:
+        self.delay = delay
+        self.received = 0
+        self.close_code: int | None = None
+        self.arrivals: list[float] = []
+
+    async def accept(self) -> None:
+        pass
+
+    async def send_text(self, text: str) -> None:
+        if self.delay is None:
+            await asyncio.Event().wait()
+        await asyncio.sleep(self.delay)
+        self.received += 1
+        self.arrivals.append(time.perf_counter())
+
+    async def close(self, code: int = 1000) -> None:
+        self.close_code = code
+
+
+def summarize(samples: list[float]) -> list[float]:
+    return [common.percentile(samples, 0.50), common.percentile(samples, 0.99), max(samples)]
+
+
+async def run(args) -> None:
+    from event_bus import InProcessEventBus
+    from main import PrivateChatSocketHub
+
+    rng = random.Random(1)
+    hub = PrivateChatSocketHub("lesson_messages", InProcessEventBus(), queue_size=args.queue_size)
+    healthy = [FakeSocket(rng.uniform(0, args.max_delay_ms / 1000)) for _ in range(args.sockets - args.stalled)]
+    stalled = [FakeSocket(None) for _ in range(args.stalled)]
+    for socket in [*healthy, *stalled]:
+        await hub.connect(1, socket)
+
+    publish_ms = []
+    sent_at = []
+    peak_depth = 0
+    for index in range(args.broadcasts):
+        payload = {"event": "message_created", "lesson_id": 1, "message": {"id": index, "content": "x" * 200}}
+        started = time.perf_counter()
+        await hub.broadcast(1, payload)
+        publish_ms.append((time.perf_counter() - started) * 1000)
+        sent_at.append(started)
+        peak_depth = max(peak_depth, hub.stats()["max_queue_depth"])
+        await asyncio.sleep(args.interval_ms / 1000)
+
+    deadline = time.perf_counter() + 30
+    while any(socket.received < args.broadcasts for socket in healthy) and time.perf_counter() < deadline:
+        await asyncio.sleep(0.05)
+
+    delivery_ms = [
+        (max(socket.arrivals[index] for socket in healthy) - sent_at[index]) * 1000
+        for index in range(args.broadcasts)
+    ]
+    stats = hub.stats()
+    for socket in healthy:
+        hub.disconnect(1, socket)
+    await asyncio.sleep(0)
+
+    print(
+        f"{args.sockets:,} sockets ({args.stalled} stalled), {args.broadcasts} broadcasts "
+        f"every {args.interval_ms} ms, queue size {args.queue_size}"
+    )
+    common.print_table(
+        ["measure", "p50 ms", "p99 ms", "max ms"],
+        [
+            ["publisher blocked per broadcast", *summarize(publish_ms)],
+            ["until all healthy sockets have it", *summarize(delivery_ms)],
+        ],
+    )
+    complete = sum(socket.received == args.broadcasts for socket in healthy)
+    print(f"healthy sockets with every event: {complete:,}/{len(healthy):,}")
+    print(f"stalled sockets closed with 1013: {sum(socket.close_code == 1013 for socket in stalled)}/{len(stalled)}")
+    print(f"peak queue depth {peak_depth}, hub stats {stats}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sockets", type=int, default=5000)
+    parser.add_argument("--stalled", type=int, default=10)
+    parser.add_argument("--broadcasts", type=int, default=300)
+    parser.add_argument("--interval-ms", type=float, default=20.0)
+    parser.add_argument("--max-delay-ms", type=float, default=5.0)
+    parser.add_argument("--queue-size", type=int, default=256)
+    args = parser.parse_args()
+
+    common.setup_environment()
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -13,6 +13,7 @@ DATABASE_URL = os.getenv(
 SECRET_KEY = os.getenv("SECRET_KEY", "change-me")
 ALGORITHM = os.getenv("ALGORITHM", "HS256")
 ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", "60"))
+REFRESH_TOKEN_EXPIRE_DAYS = int(os.getenv("REFRESH_TOKEN_EXPIRE_DAYS", "30"))
 ADMIN_EMAIL = os.getenv("ADMIN_EMAIL", "admin@example.com")
 ADMIN_USERNAME = os.getenv("ADMIN_USERNAME", "admin")
 ADMIN_PASSWORD = os.getenv("ADMIN_PASSWORD", "admin12345")
@@ -21,11 +22,16 @@ TEACHER_EMAIL = os.getenv("TEACHER_EMAIL", "teacher@example.com")
 TEACHER_USERNAME = os.getenv("TEACHER_USERNAME", "teacher")
 TEACHER_PASSWORD = os.getenv("TEACHER_PASSWORD", "teacher12345")
 TEACHER_ROLES = os.getenv("TEACHER_ROLES", "teacher")
+REALTIME_BROKER = os.getenv("REALTIME_BROKER", "memory").lower()
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", str(max(1, (os.cpu_count() or 2) // 2))))
+PASSWORD_HASH_QUEUE_SIZE = int(os.getenv("PASSWORD_HASH_QUEUE_SIZE", "32"))
+PASSWORD_HASH_RETRY_AFTER = int(os.getenv("PASSWORD_HASH_RETRY_AFTER", "2"))
 
 FIREBASE_CREDENTIALS_PATH = os.getenv("FIREBASE_CREDENTIALS_PATH")
 FIREBASE_PROJECT_ID = os.getenv("FIREBASE_PROJECT_ID")
 FIREBASE_REQUIRE_EMAIL_VERIFIED = os.getenv("FIREBASE_REQUIRE_EMAIL_VERIFIED", "true").lower() == "true"
 FIREBASE_REQUIRE_EMAIL_CODE = os.getenv("FIREBASE_REQUIRE_EMAIL_CODE", "true").lower() == "true"
+FIREBASE_KEY_REFRESH_SECONDS = int(os.getenv("FIREBASE_KEY_REFRESH_SECONDS", "3600"))
 
 SMTP_HOST = os.getenv("SMTP_HOST")
 SMTP_PORT = int(os.getenv("SMTP_PORT", "587"))
@@ -1,13 +1,47 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, inspect, text
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from sqlalchemy.orm import sessionmaker, declarative_base
+from sqlalchemy.pool import StaticPool
+from sqlalchemy.schema import CreateIndex
 
 from config import DATABASE_URL
 
 engine = create_engine(
     DATABASE_URL,
     connect_args={"check_same_thread": False} if DATABASE_URL.startswith("sqlite") else {},
+    # An in-memory SQLite database lives in one connection, so all sessions share it.
+    **({"poolclass": StaticPool} if DATABASE_URL in ("sqlite://", "sqlite:///:memory:") else {}),
 )
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 Base = declarative_base()
+
+
+def add_missing_columns(table_name: str, columns: dict[str, str]) -> None:
+    # create_all() never alters existing tables, so columns added to a model
+    # after its table was created are added here.
+    existing = {column["name"] for column in inspect(engine).get_columns(table_name)}
+    missing = {name: ddl for name, ddl in columns.items() if name not in existing}
+    if not missing:
+        return
+    with engine.begin() as connection:
+        for name, ddl in missing.items():
+            connection.execute(text(f"ALTER TABLE {table_name} ADD COLUMN {name} {ddl}"))
+
+
+def create_missing_indexes(table) -> None:
+    # IF NOT EXISTS rather than checkfirst: reflection does not report
+    # expression indexes such as lower(username) on every dialect.
+    with engine.begin() as connection:
+        for index in table.indexes:
+            connection.execute(CreateIndex(index, if_not_exists=True))
+
+
+def insert_if_missing(db, model, **values) -> None:
+    # INSERT ... ON CONFLICT DO NOTHING: when two requests create the same row
+    # at once, the loser keeps going instead of failing on the unique key, and
+    # both can then lock the row with SELECT ... FOR UPDATE.
+    insert = postgresql_insert if db.get_bind().dialect.name == "postgresql" else sqlite_insert
+    db.execute(insert(model).values(**values).on_conflict_do_nothing())
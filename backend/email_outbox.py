@@ -0,0 +1,240 @@
+import smtplib
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from email.message import EmailMessage
+
+import requests
+from sqlalchemy.orm import Session
+
+from config import (
+    SMTP_HOST,
+    SMTP_PORT,
+    SMTP_USER,
+    SMTP_PASSWORD,
+    SMTP_FROM,
+    SMTP_TLS,
+    RESEND_API_KEY,
+    RESEND_FROM,
+)
+from database import SessionLocal, engine
+from models import EmailOutbox
+
+OUTBOX_PENDING = "pending"
+OUTBOX_SENDING = "sending"
+OUTBOX_SENT = "sent"
+OUTBOX_FAILED = "failed"
+
+
+class EmailConfigurationError(Exception):
+    pass
+
+
+class EmailTransport:
+    """Sends outbox messages through Resend or SMTP, keeping connections open.
+
+    The SMTP connection is reused across messages and closed after
+    ``idle_seconds`` without sends; Resend calls share one HTTP session.
+    """
+
+    def __init__(self, timeout: float = 10.0, idle_seconds: float = 60.0) -> None:
+        self.timeout = timeout
+        self.idle_seconds = idle_seconds
+        self._smtp: smtplib.SMTP | None = None
+        self._last_used = 0.0
+        self._http = requests.Session()
+
+    @staticmethod
+    def check_configured() -> None:
+        if RESEND_API_KEY:
+            return
+        if not SMTP_HOST or not SMTP_FROM:
+            raise EmailConfigurationError("SMTP not configured")
+        if not SMTP_USER or not SMTP_PASSWORD:
+            raise EmailConfigurationError("SMTP credentials missing")
+
+    def send(self, recipient: str, subject: str, body: str) -> None:
+        self.check_configured()
+        if RESEND_API_KEY:
+            self._send_resend(recipient, subject, body)
+        else:
+            self._send_smtp(recipient, subject, body)
+        self._last_used = time.monotonic()
+
+    def _send_resend(self, recipient: str, subject: str, body: str) -> None:
+        resp = self._http.post(
+            "https://api.resend.com/emails",
+            headers={"Authorization": f"Bearer {RESEND_API_KEY}"},
+            json={"from": RESEND_FROM, "to": [recipient], "subject": subject, "text": body},
+            timeout=self.timeout,
+        )
+        if resp.status_code >= 300:
+            raise RuntimeError(f"Resend error: {resp.text}")
+
+    def _connect_smtp(self) -> smtplib.SMTP:
+        server = smtplib.SMTP(SMTP_HOST, SMTP_PORT, timeout=self.timeout)
+        server.ehlo()
+        if SMTP_TLS:
+            server.starttls()
+            server.ehlo()
+        server.login(SMTP_USER, SMTP_PASSWORD)
+        return server
+
+    def _send_smtp(self, recipient: str, subject: str, body: str) -> None:
+        message = EmailMessage()
+        message["From"] = SMTP_FROM
+        message["To"] = recipient
+        message["Subject"] = subject
+        message.set_content(body)
+        if self._smtp is not None:
+            try:
+                self._smtp.send_message(message)
+                return
+            except smtplib.SMTPServerDisconnected:
+                self._smtp = None
+            except smtplib.SMTPException:
+                self.close()
+                raise
+        self._smtp = self._connect_smtp()
+        try:
+            self._smtp.send_message(message)
+        except smtplib.SMTPException:
+            self.close()
+            raise
+
+    def close_if_idle(self) -> None:
+        if self._smtp is not None and time.monotonic() - self._last_used > self.idle_seconds:
+            self.close()
+
+    def close(self) -> None:
+        server, self._smtp = self._smtp, None
+        if server is not None:
+            try:
+                server.quit()
+            except Exception:
+                pass
+
+
+class EmailOutboxWorker:
+    """Background thread that delivers ``email_outbox`` rows.
+
+    Rows are claimed by setting them to ``sending`` with a lease in
+    ``next_attempt_at``, so a worker that dies mid-send is retried once the
+    lease lapses, and several processes can share the table. Failed sends
+    are retried with exponential backoff up to ``max_attempts``.
+    """
+
+    def __init__(
+        self,
+        transport: EmailTransport,
+        batch_size: int = 20,
+        poll_seconds: float = 5.0,
+        lease_seconds: float = 120.0,
+        max_attempts: int = 5,
+        backoff_seconds: float = 5.0,
+        max_backoff_seconds: float = 600.0,
+    ) -> None:
+        self.transport = transport
+        self.batch_size = batch_size
+        self.poll_seconds = poll_seconds
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.backoff_seconds = backoff_seconds
+        self.max_backoff_seconds = max_backoff_seconds
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def start(self) -> None:
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="email-outbox", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._wake.set()
+        if self._thread:
+            self._thread.join(timeout=self.transport.timeout + 5)
+            self._thread = None
+        self.transport.close()
+
+    def notify(self) -> None:
+        self._wake.set()
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            try:
+                delivered = self.run_once()
+            except Exception:  # pragma: no cover - keep the sender alive on database errors
+                delivered = 0
+            if delivered:
+                continue
+            self.transport.close_if_idle()
+            self._wake.wait(self.poll_seconds)
+            self._wake.clear()
+
+    def _claim(self, db: Session, now: datetime) -> list[EmailOutbox]:
+        query = (
+            db.query(EmailOutbox)
+            .filter(
+                EmailOutbox.status.in_((OUTBOX_PENDING, OUTBOX_SENDING)),
+                EmailOutbox.next_attempt_at <= now,
+            )
+            .order_by(EmailOutbox.next_attempt_at.asc(), EmailOutbox.id.asc())
+            .limit(self.batch_size)
+        )
+        if engine.dialect.name == "postgresql":
+            query = query.with_for_update(skip_locked=True)
+        messages = query.all()
+        for message in messages:
+            message.status = OUTBOX_SENDING
+            message.next_attempt_at = now + timedelta(seconds=self.lease_seconds)
+        db.commit()
+        return messages
+
+    def run_once(self) -> int:
+        db = SessionLocal()
+        try:
+            messages = self._claim(db, datetime.now(timezone.utc))
+            for message in messages:
+                self._deliver(db, message)
+            return len(messages)
+        finally:
+            db.close()
+
+    def _deliver(self, db: Session, message: EmailOutbox) -> None:
+        try:
+            self.transport.send(message.recipient, message.subject, message.body or "")
+        except Exception as exc:
+            message.attempts = (message.attempts or 0) + 1
+            message.last_error = str(exc)[:1000]
+            if message.attempts >= self.max_attempts or isinstance(exc, EmailConfigurationError):
+                message.status = OUTBOX_FAILED
+                message.body = None
+            else:
+                delay = min(self.backoff_seconds * 2 ** (message.attempts - 1), self.max_backoff_seconds)
+                message.status = OUTBOX_PENDING
+                message.next_attempt_at = datetime.now(timezone.utc) + timedelta(seconds=delay)
+        else:
+            message.attempts = (message.attempts or 0) + 1
+            message.status = OUTBOX_SENT
+            message.sent_at = datetime.now(timezone.utc)
+            message.last_error = None
+            # The body carries a one-time code; it is not needed once delivered.
+            message.body = None
+        db.commit()
+
+
+def enqueue_email(db: Session, recipient: str, subject: str, body: str) -> EmailOutbox:
+    message = EmailOutbox(
+        recipient=recipient,
+        subject=subject,
+        body=body,
+        status=OUTBOX_PENDING,
+        attempts=0,
+        next_attempt_at=datetime.now(timezone.utc),
+    )
+    db.add(message)
+    return message
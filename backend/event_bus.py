@@ -0,0 +1,261 @@
+import asyncio
+import threading
+import time
+from abc import ABC, abstractmethod
+from typing import Awaitable, Callable
+
+from sqlalchemy import text
+
+Handler = Callable[[str, str], Awaitable[None]]
+
+# PostgreSQL rejects NOTIFY payloads of 8000 bytes or more; larger events are
+# parked in realtime_event_payloads and announced by id.
+NOTIFY_PAYLOAD_LIMIT = 7900
+OVERFLOW_PREFIX = "@"
+OVERFLOW_RETENTION_SECONDS = 300
+
+
+class EventBus(ABC):
+    """Per-channel publish/subscribe used underneath the WebSocket hubs.
+
+    A hub subscribes to a channel while it has at least one local socket on
+    it and publishes every broadcast through the bus; delivery to local
+    sockets happens in the handler, so each worker sees the same events.
+    """
+
+    async def start(self) -> None:
+        pass
+
+    async def stop(self) -> None:
+        pass
+
+    @abstractmethod
+    async def subscribe(self, channel: str, handler: Handler) -> None:
+        ...
+
+    @abstractmethod
+    async def unsubscribe(self, channel: str) -> None:
+        ...
+
+    @abstractmethod
+    async def publish(self, channel: str, payload: str) -> None:
+        ...
+
+    def stats(self) -> dict:
+        return {}
+
+
+class InProcessEventBus(EventBus):
+    def __init__(self) -> None:
+        self.handlers: dict[str, Handler] = {}
+
+    async def subscribe(self, channel: str, handler: Handler) -> None:
+        self.handlers[channel] = handler
+
+    async def unsubscribe(self, channel: str) -> None:
+        self.handlers.pop(channel, None)
+
+    async def publish(self, channel: str, payload: str) -> None:
+        handler = self.handlers.get(channel)
+        if handler:
+            await handler(channel, payload)
+
+    def stats(self) -> dict:
+        return {"backend": "memory", "channels": len(self.handlers)}
+
+
+class PostgresEventBus(EventBus):
+    """LISTEN/NOTIFY backend for running several uvicorn workers.
+
+    One dedicated connection per process LISTENs only on channels that have
+    local sockets and is read from the event loop; LISTEN/UNLISTEN and
+    NOTIFY run on worker threads. If the listening connection drops (database
+    restart, failover) it is reopened with backoff and every channel is
+    LISTENed again; notifications sent while it was down are lost.
+    """
+
+    def __init__(self, engine, reconnect_delay: float = 1.0, max_reconnect_delay: float = 30.0) -> None:
+        self.engine = engine
+        self.reconnect_delay = reconnect_delay
+        self.max_reconnect_delay = max_reconnect_delay
+        self.handlers: dict[str, Handler] = {}
+        self.connection = None
+        self.loop: asyncio.AbstractEventLoop | None = None
+        self.reconnects = 0
+        self.last_error: str | None = None
+        self._stopping = False
+        self._reconnect_task: asyncio.Task | None = None
+        # Keeps LISTEN/UNLISTEN in call order although they run on threads.
+        self._listen_lock: asyncio.Lock | None = None
+        self._last_cleanup = 0.0
+        self._cleanup_lock = threading.Lock()
+
+    def _connect(self):
+        dialect = self.engine.dialect
+        args, kwargs = dialect.create_connect_args(self.engine.url)
+        connection = dialect.dbapi.connect(*args, **kwargs)
+        connection.autocommit = True
+        return connection
+
+    def _open(self, channels: list[str]):
+        connection = self._connect()
+        try:
+            with connection.cursor() as cursor:
+                for channel in channels:
+                    cursor.execute(f'LISTEN "{channel}"')
+        except Exception:
+            connection.close()
+            raise
+        return connection
+
+    async def start(self) -> None:
+        self.loop = asyncio.get_running_loop()
+        self._stopping = False
+        self._listen_lock = asyncio.Lock()
+        async with self._listen_lock:
+            self._attach(await asyncio.to_thread(self._open, list(self.handlers)))
+
+    def _attach(self, connection) -> None:
+        self.connection = connection
+        self.loop.add_reader(connection.fileno(), self._on_readable)
+
+    def _detach(self) -> None:
+        connection, self.connection = self.connection, None
+        if connection is None:
+            return
+        try:
+            self.loop.remove_reader(connection.fileno())
+        except Exception:
+            pass
+        try:
+            connection.close()
+        except Exception:
+            pass
+
+    async def stop(self) -> None:
+        self._stopping = True
+        if self._reconnect_task:
+            self._reconnect_task.cancel()
+            self._reconnect_task = None
+        self._detach()
+
+    def _connection_lost(self, exc: BaseException) -> None:
+        if self._stopping or (self._reconnect_task and not self._reconnect_task.done()):
+            return
+        self.last_error = str(exc)
+        self._detach()
+        self._reconnect_task = self.loop.create_task(self._reconnect())
+
+    async def _reconnect(self) -> None:
+        delay = self.reconnect_delay
+        while not self._stopping:
+            try:
+                async with self._listen_lock:
+                    self._attach(await asyncio.to_thread(self._open, list(self.handlers)))
+            except Exception as exc:
+                self.last_error = str(exc)
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, self.max_reconnect_delay)
+                continue
+            self.reconnects += 1
+            return
+
+    def _execute(self, connection, statement: str) -> None:
+        with connection.cursor() as cursor:
+            cursor.execute(statement)
+
+    async def _listen(self, statement: str) -> None:
+        if self._listen_lock is None:
+            return
+        async with self._listen_lock:
+            connection = self.connection
+            if connection is None:
+                # Reconnecting; the new connection LISTENs on current handlers.
+                return
+            try:
+                await asyncio.to_thread(self._execute, connection, statement)
+            except self.engine.dialect.dbapi.Error as exc:
+                if connection is self.connection:
+                    self._connection_lost(exc)
+
+    async def subscribe(self, channel: str, handler: Handler) -> None:
+        new = channel not in self.handlers
+        self.handlers[channel] = handler
+        if new:
+            await self._listen(f'LISTEN "{channel}"')
+
+    async def unsubscribe(self, channel: str) -> None:
+        if self.handlers.pop(channel, None) is not None:
+            await self._listen(f'UNLISTEN "{channel}"')
+
+    def _on_readable(self) -> None:
+        connection = self.connection
+        if connection is None:
+            return
+        try:
+            connection.poll()
+        except self.engine.dialect.dbapi.Error as exc:
+            self._connection_lost(exc)
+            return
+        while connection.notifies:
+            notify = connection.notifies.pop(0)
+            if notify.channel in self.handlers:
+                asyncio.create_task(self._dispatch(notify.channel, notify.payload))
+
+    def stats(self) -> dict:
+        return {
+            "backend": "postgres",
+            "channels": len(self.handlers),
+            "connected": self.connection is not None,
+            "reconnects": self.reconnects,
+            "last_error": self.last_error,
+        }
+
+    async def _dispatch(self, channel: str, payload: str) -> None:
+        if payload.startswith(OVERFLOW_PREFIX):
+            payload = await asyncio.to_thread(self._load_overflow, int(payload[len(OVERFLOW_PREFIX):]))
+            if payload is None:
+                return
+        handler = self.handlers.get(channel)
+        if handler:
+            await handler(channel, payload)
+
+    async def publish(self, channel: str, payload: str) -> None:
+        await asyncio.to_thread(self._notify, channel, payload)
+
+    def _notify(self, channel: str, payload: str) -> None:
+        with self.engine.begin() as connection:
+            if len(payload.encode("utf-8")) > NOTIFY_PAYLOAD_LIMIT:
+                payload_id = connection.execute(
+                    text("INSERT INTO realtime_event_payloads (payload) VALUES (:payload) RETURNING id"),
+                    {"payload": payload},
+                ).scalar_one()
+                payload = f"{OVERFLOW_PREFIX}{payload_id}"
+                self._cleanup_overflow(connection)
+            connection.execute(text("SELECT pg_notify(:channel, :payload)"), {"channel": channel, "payload": payload})
+
+    def _cleanup_overflow(self, connection) -> None:
+        now = time.monotonic()
+        with self._cleanup_lock:
+            if now - self._last_cleanup < OVERFLOW_RETENTION_SECONDS:
+                return
+            self._last_cleanup = now
+        connection.execute(
+            text("DELETE FROM realtime_event_payloads WHERE created_at < now() - make_interval(secs => :seconds)"),
+            {"seconds": OVERFLOW_RETENTION_SECONDS},
+        )
+
+    def _load_overflow(self, payload_id: int) -> str | None:
+        with self.engine.connect() as connection:
+            return connection.execute(
+                text("SELECT payload FROM realtime_event_payloads WHERE id = :id"),
+                {"id": payload_id},
+            ).scalar()
+
+
+def create_event_bus(backend: str, engine) -> EventBus:
+    if backend == "postgres":
+        if engine.dialect.name != "postgresql":
+            raise RuntimeError("REALTIME_BROKER=postgres requires a PostgreSQL DATABASE_URL")
+        return PostgresEventBus(engine)
+    return InProcessEventBus()
@@ -1,21 +1,26 @@
-from fastapi import FastAPI, Depends, HTTPException, Query, UploadFile, File, Request, WebSocket, WebSocketDisconnect
-from email.message import EmailMessage
+from fastapi import FastAPI, Depends, HTTPException, Query, UploadFile, File, Request, Response, WebSocket, WebSocketDisconnect
 from datetime import datetime, timedelta, timezone
+from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
 from pathlib import Path
 from uuid import uuid4
+from collections import deque
+import asyncio
+import base64
 import hashlib
 import hmac
+import json
 import secrets
-import smtplib
-import requests
+import threading
+import time
+from fastapi.concurrency import run_in_threadpool
 from fastapi.security import OAuth2PasswordRequestForm
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from anyio import from_thread
-from sqlalchemy.orm import Session
-from sqlalchemy import func
+from sqlalchemy.orm import Session, aliased, defer, selectinload
+from sqlalchemy import and_, event, func, or_, select, tuple_
+from sqlalchemy.exc import IntegrityError
 
-from database import Base, engine, SessionLocal
+from database import Base, engine, SessionLocal, add_missing_columns, create_missing_indexes, insert_if_missing
 from models import (
     User,
     CoursePurchase,
@@ -27,6 +32,8 @@ from models import (
     LessonAssignment,
     AssignmentSubmission,
     LessonMessage,
+    LessonMessageSequence,
+    LessonMessageTombstone,
     LessonMessageAttachment,
     LessonNotification,
     PrivateLessonChat,
@@ -34,18 +41,27 @@ from models import (
     PrivateLessonMessageAttachment,
     Role,
     EmailOTP,
+    EmailOutbox,
     CourseRating,
+    CourseRatingStats,
     TeacherRating,
+    TeacherRatingStats,
 )
 from schemas import (
     UserCreate,
     UserLogin,
     Token,
+    RefreshTokenRequest,
+    EmailDeliveryOut,
     UserOut,
     CourseOut,
+    CoursePage,
+    CourseSearchOut,
+    CourseSuggestionOut,
     PaymentOut,
     LessonDetailOut,
     LessonMessageOut,
+    LessonMessageChangesOut,
     PrivateChatThreadOut,
     PrivateChatRecipientOut,
     PrivateChatMessageOut,
@@ -74,29 +90,33 @@ from config import (
     TEACHER_PASSWORD,
     TEACHER_ROLES,
     SECRET_KEY,
-    SMTP_HOST,
-    SMTP_PORT,
-    SMTP_USER,
-    SMTP_PASSWORD,
-    SMTP_FROM,
-    SMTP_TLS,
     OTP_EXPIRE_MINUTES,
     FIREBASE_REQUIRE_EMAIL_CODE,
-    RESEND_API_KEY,
-    RESEND_FROM,
+    REALTIME_BROKER,
 )
 from auth import (
     get_db,
-    get_password_hash,
-    authenticate_user,
-    create_access_token,
+    authenticate_user_async,
+    hash_password_async,
+    password_hasher,
     get_current_user,
     get_or_create_role,
     get_optional_user,
     create_firebase_custom_token_for_user,
     _get_user_from_jwt,
     _get_user_from_firebase,
+    start_firebase_key_prefetch,
+    AuthUser,
+    user_role_names,
+    has_role,
+    create_user_access_token,
+    issue_refresh_token,
+    add_user_with_unique_username,
+    rotate_refresh_token,
 )
+from event_bus import EventBus, create_event_bus
+from email_outbox import EmailConfigurationError, EmailOutboxWorker, EmailTransport, enqueue_email
+from search_index import PrefixSuggester, SearchIndex
 from seed_courses import COURSE_SEED
 
 app = FastAPI(title="New Project API")
@@ -120,55 +140,332 @@ app.add_middleware(
 )
 
 Base.metadata.create_all(bind=engine)
+add_missing_columns("teacher_ratings", {"teacher_key": "VARCHAR(255)"})
+add_missing_columns("users", {"role_version": "INTEGER NOT NULL DEFAULT 0"})
+add_missing_columns(
+    "courses",
+    {
+        "price_cents": "INTEGER",
+        "old_price_cents": "INTEGER",
+        "sort_rating": "FLOAT",
+        "created_at": "TIMESTAMP WITH TIME ZONE" if engine.dialect.name == "postgresql" else "DATETIME",
+    },
+)
+create_missing_indexes(Course.__table__)
+for versioned_table in (
+    "courses",
+    "course_lessons",
+    "lesson_slides",
+    "lesson_resources",
+    "lesson_messages",
+    "course_rating_stats",
+    "teacher_rating_stats",
+):
+    add_missing_columns(versioned_table, {"version": "INTEGER NOT NULL DEFAULT 1"})
+create_missing_indexes(User.__table__)
+add_missing_columns("lesson_messages", {"change_seq": "INTEGER"})
+create_missing_indexes(LessonMessage.__table__)
+add_missing_columns("email_outbox", {"delivery_token_hash": "VARCHAR(64)"})
+create_missing_indexes(EmailOutbox.__table__)
 
 FREE_LESSON_COUNT = 2
+LESSON_MESSAGE_PAGE_SIZE = 50
+LESSON_MESSAGE_PAGE_MAX = 200
 CHAT_UPLOAD_MAX_BYTES = 30 * 1024 * 1024
 
 
-class PrivateChatSocketHub:
-    def __init__(self) -> None:
-        self.connections: dict[int, set[WebSocket]] = {}
+class SocketWriter:
+    """Outgoing queue and writer task for one WebSocket."""
+
+    def __init__(
+        self,
+        websocket: WebSocket,
+        queue_size: int,
+        user_id: int | None = None,
+        is_manager: bool = False,
+    ) -> None:
+        self.websocket = websocket
+        self.user_id = user_id
+        self.is_manager = is_manager
+        self.queue: asyncio.Queue[str] = asyncio.Queue(maxsize=queue_size)
+        self.task: asyncio.Task | None = None
+
+    async def run(self, on_failure) -> None:
+        try:
+            while True:
+                text = await self.queue.get()
+                await self.websocket.send_text(text)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            on_failure()
+
 
-    async def connect(self, chat_id: int, websocket: WebSocket) -> None:
+class PrivateChatSocketHub:
+    """Fans out JSON events to the sockets subscribed to a key.
+
+    Broadcasts go through the event bus on channel ``<name>_<key>``, which
+    this worker subscribes to only while it has sockets for that key, so
+    events reach sockets held by other workers too. Each event is encoded
+    once and put on every local socket's bounded queue, where a per-socket
+    task writes it out, so a slow client never delays the others or the
+    caller. A client whose queue is full is disconnected with 1013 (try
+    again later); it can reconnect and resync over HTTP.
+
+    Events travel as envelopes: ``{"all": payload}`` goes to every socket,
+    while a targeted envelope carries ``users`` (per user id), ``managers``
+    and ``others`` variants. The variant follows the socket's role: manager
+    sockets get ``managers`` when it is set, everyone else their ``users``
+    entry or else ``others``, so a teacher who triggers an event still
+    receives the manager payload.
+    """
+
+    def __init__(self, name: str, bus: EventBus, queue_size: int = 256) -> None:
+        self.name = name
+        self.bus = bus
+        self.queue_size = queue_size
+        self.connections: dict[int, dict[WebSocket, SocketWriter]] = {}
+        self.messages_sent = 0
+        self.slow_disconnects = 0
+
+    def channel(self, chat_id: int) -> str:
+        return f"{self.name}_{chat_id}"
+
+    async def connect(
+        self,
+        chat_id: int,
+        websocket: WebSocket,
+        user_id: int | None = None,
+        is_manager: bool = False,
+    ) -> None:
         await websocket.accept()
-        self.connections.setdefault(chat_id, set()).add(websocket)
+        writer = SocketWriter(websocket, self.queue_size, user_id, is_manager)
+        writer.task = asyncio.create_task(writer.run(lambda: self.disconnect(chat_id, websocket)))
+        sockets = self.connections.setdefault(chat_id, {})
+        sockets[websocket] = writer
+        if len(sockets) == 1:
+            await self.bus.subscribe(self.channel(chat_id), self._deliver)
 
     def disconnect(self, chat_id: int, websocket: WebSocket) -> None:
         sockets = self.connections.get(chat_id)
         if not sockets:
             return
-        sockets.discard(websocket)
+        writer = sockets.pop(websocket, None)
         if not sockets:
             self.connections.pop(chat_id, None)
+            asyncio.create_task(self._release_channel(chat_id))
+        if writer and writer.task and writer.task is not asyncio.current_task():
+            writer.task.cancel()
+
+    async def _release_channel(self, chat_id: int) -> None:
+        # A socket may have joined again before this task ran.
+        if chat_id not in self.connections:
+            await self.bus.unsubscribe(self.channel(chat_id))
+
+    async def _deliver(self, channel: str, text: str) -> None:
+        chat_id = int(channel.rsplit("_", 1)[1])
+        writers = list(self.connections.get(chat_id, {}).values())
+        if not writers:
+            return
+        envelope = json.loads(text)
+        if "all" in envelope:
+            encoded = encode_socket_payload(envelope["all"])
+            for writer in writers:
+                self._enqueue(chat_id, writer, encoded)
+            return
+        user_texts = {
+            int(user_id): encode_socket_payload(payload)
+            for user_id, payload in (envelope.get("users") or {}).items()
+        }
+        manager_text = encode_socket_payload(envelope["managers"]) if envelope.get("managers") else None
+        other_text = encode_socket_payload(envelope["others"]) if envelope.get("others") else None
+        for writer in writers:
+            if writer.is_manager and manager_text is not None:
+                encoded = manager_text
+            else:
+                encoded = user_texts.get(writer.user_id, other_text)
+            if encoded is not None:
+                self._enqueue(chat_id, writer, encoded)
+
+    def _enqueue(self, chat_id: int, writer: SocketWriter, text: str) -> None:
+        try:
+            writer.queue.put_nowait(text)
+        except asyncio.QueueFull:
+            self.slow_disconnects += 1
+            self.disconnect(chat_id, writer.websocket)
+            asyncio.create_task(self._close_slow(writer.websocket))
+            return
+        self.messages_sent += 1
+
+    @staticmethod
+    async def _close_slow(websocket: WebSocket) -> None:
+        try:
+            await websocket.close(code=1013)
+        except Exception:
+            pass
+
+    async def send(self, chat_id: int, websocket: WebSocket, payload: dict) -> None:
+        writer = self.connections.get(chat_id, {}).get(websocket)
+        if writer:
+            self._enqueue(chat_id, writer, encode_socket_payload(payload))
 
     async def broadcast(self, chat_id: int, payload: dict) -> None:
-        sockets = list(self.connections.get(chat_id, set()))
-        if not sockets:
-            return
-        stale: list[WebSocket] = []
-        for websocket in sockets:
+        await self.publish_envelope(chat_id, {"all": payload})
+
+    async def publish_envelope(self, chat_id: int, envelope: dict) -> None:
+        await self.bus.publish(self.channel(chat_id), encode_socket_payload(envelope))
+
+    def stats(self) -> dict:
+        depths = [
+            writer.queue.qsize()
+            for sockets in self.connections.values()
+            for writer in sockets.values()
+        ]
+        return {
+            "channels": len(self.connections),
+            "connections": len(depths),
+            "queued": sum(depths),
+            "max_queue_depth": max(depths, default=0),
+            "queue_size": self.queue_size,
+            "messages_sent": self.messages_sent,
+            "slow_disconnects": self.slow_disconnects,
+        }
+
+
+def encode_socket_payload(payload: dict) -> str:
+    # Same encoding as WebSocket.send_json, done once per broadcast.
+    return json.dumps(payload, separators=(",", ":"), ensure_ascii=False)
+
+
+realtime_bus = create_event_bus(REALTIME_BROKER, engine)
+private_chat_socket_hub = PrivateChatSocketHub("private_chat", realtime_bus)
+private_thread_socket_hub = PrivateChatSocketHub("private_threads", realtime_bus)
+assignment_socket_hub = PrivateChatSocketHub("assignments", realtime_bus)
+lesson_message_socket_hub = PrivateChatSocketHub("lesson_messages", realtime_bus)
+
+
+class SocketEventQueue:
+    """Thread-safe, bounded hand-off from sync handlers to the event loop.
+
+    ``put`` never blocks: it appends under a lock and wakes a loop task that
+    drains the queue into the hubs. When the queue is full the event is
+    dropped and counted; realtime is best-effort and clients can resync.
+    """
+
+    def __init__(self, capacity: int = 10000) -> None:
+        self.capacity = capacity
+        self.items: deque[tuple[PrivateChatSocketHub, int, dict]] = deque()
+        self.lock = threading.Lock()
+        self.loop: asyncio.AbstractEventLoop | None = None
+        self.wakeup: asyncio.Event | None = None
+        self.task: asyncio.Task | None = None
+        self.published = 0
+        self.dropped = 0
+        self.failed = 0
+
+    async def start(self) -> None:
+        self.loop = asyncio.get_running_loop()
+        self.wakeup = asyncio.Event()
+        self.task = asyncio.create_task(self._drain())
+
+    async def stop(self) -> None:
+        if self.task:
+            self.task.cancel()
+            self.task = None
+        self.loop = None
+
+    def put(self, hub: PrivateChatSocketHub, key: int, envelope: dict) -> bool:
+        with self.lock:
+            if len(self.items) >= self.capacity:
+                self.dropped += 1
+                return False
+            self.items.append((hub, key, envelope))
+        loop = self.loop
+        if loop is not None:
             try:
-                await websocket.send_json(payload)
-            except Exception:
-                stale.append(websocket)
-        for websocket in stale:
-            self.disconnect(chat_id, websocket)
+                loop.call_soon_threadsafe(self.wakeup.set)
+            except RuntimeError:
+                # Loop already closed during shutdown.
+                pass
+        return True
+
+    async def _drain(self) -> None:
+        while True:
+            await self.wakeup.wait()
+            self.wakeup.clear()
+            while True:
+                with self.lock:
+                    if not self.items:
+                        break
+                    hub, key, envelope = self.items.popleft()
+                try:
+                    await hub.publish_envelope(key, envelope)
+                    self.published += 1
+                except Exception:
+                    self.failed += 1
+
+    def stats(self) -> dict:
+        with self.lock:
+            queued = len(self.items)
+        return {
+            "queued": queued,
+            "capacity": self.capacity,
+            "published": self.published,
+            "dropped": self.dropped,
+            "failed": self.failed,
+        }
+
+
+socket_event_queue = SocketEventQueue()
 
 
-private_chat_socket_hub = PrivateChatSocketHub()
-private_thread_socket_hub = PrivateChatSocketHub()
-assignment_socket_hub = PrivateChatSocketHub()
+def publish_assignment_event(
+    lesson_id: int,
+    event_name: str,
+    managers: dict | None = None,
+    others: dict | None = None,
+    users: dict[int, dict] | None = None,
+) -> None:
+    """Queue an assignment event with per-audience payloads.
+
+    Each variant is merged into ``{"event", "lesson_id"}``. Teachers always
+    get ``managers`` when it is set, even for their own submissions; other
+    sockets get their ``users`` entry, else ``others``, else nothing.
+    """
+    base = {"event": event_name, "lesson_id": lesson_id}
+    envelope = {
+        "managers": {**base, **managers} if managers is not None else None,
+        "others": {**base, **others} if others is not None else None,
+        "users": {str(user_id): {**base, **payload} for user_id, payload in (users or {}).items()},
+    }
+    # Fire-and-forget: the request thread never waits on socket delivery.
+    socket_event_queue.put(assignment_socket_hub, lesson_id, envelope)
 
 
-def publish_assignment_event(lesson_id: int, event_name: str, extra: dict | None = None) -> None:
-    payload = {"event": event_name, "lesson_id": lesson_id}
+def assignment_submission_counts(db: Session, assignment_id: int) -> tuple[int, int]:
+    submission_count, graded_count = (
+        db.query(
+            func.count(AssignmentSubmission.id),
+            func.count(AssignmentSubmission.rating),
+        )
+        .filter(AssignmentSubmission.assignment_id == assignment_id)
+        .one()
+    )
+    return submission_count or 0, graded_count or 0
+
+
+def publish_lesson_message_event(
+    lesson_id: int,
+    event_name: str,
+    watermark: int | None,
+    extra: dict | None = None,
+) -> None:
+    # The watermark lets a client that reconnects catch up through
+    # /lessons/{lesson_id}/messages/changes.
+    payload = {"event": event_name, "lesson_id": lesson_id, "watermark": watermark}
     if extra:
         payload.update(extra)
-    try:
-        from_thread.run(assignment_socket_hub.broadcast, lesson_id, payload)
-    except Exception:
-        # Assignment realtime is best-effort; API response should not fail if socket broadcast fails.
-        pass
+    socket_event_queue.put(lesson_message_socket_hub, lesson_id, {"all": payload})
 
 
 def get_user_by_ws_token(db: Session, token: str | None) -> User | None:
@@ -194,18 +491,150 @@ def is_purchased(db: Session, user: User | None, course_id: str) -> bool:
     )
 
 
-def _rating_stats(value: tuple) -> tuple[float | None, int]:
-    avg, count = value
-    avg_value = float(avg) if avg is not None else None
-    return avg_value, int(count or 0)
+RATING_STARS = (1, 2, 3, 4, 5)
 
 
-def get_course_rating_summary(db: Session, course_id: str, user_id: int | None = None) -> dict:
-    avg_value, count = _rating_stats(
-        db.query(func.avg(CourseRating.rating), func.count(CourseRating.id))
-        .filter(CourseRating.course_id == course_id)
-        .one()
+def _stats_average(stats: CourseRatingStats | TeacherRatingStats | None) -> tuple[float | None, int, int]:
+    if not stats:
+        return None, 0, 0
+    if not stats.rating_count:
+        return None, 0, stats.version
+    return stats.rating_sum / stats.rating_count, int(stats.rating_count), stats.version
+
+
+def apply_rating_to_stats(stats, old_rating: int | None, new_rating: int) -> None:
+    if old_rating is not None:
+        stats.rating_sum -= old_rating
+        stats.rating_count -= 1
+        star_field = f"star_{old_rating}"
+        setattr(stats, star_field, getattr(stats, star_field) - 1)
+    stats.rating_sum += new_rating
+    stats.rating_count += 1
+    star_field = f"star_{new_rating}"
+    setattr(stats, star_field, getattr(stats, star_field) + 1)
+
+
+def _empty_rating_stats(model, **key):
+    return model(
+        **key,
+        rating_sum=0,
+        rating_count=0,
+        **{f"star_{star}": 0 for star in RATING_STARS},
     )
+
+
+def get_course_rating_stats_for_update(db: Session, course_id: str) -> CourseRatingStats:
+    query = db.query(CourseRatingStats).filter(CourseRatingStats.course_id == course_id).with_for_update()
+    stats = query.first()
+    if stats:
+        return stats
+    insert_if_missing(db, CourseRatingStats, course_id=course_id)
+    return query.one()
+
+
+def normalize_teacher_key(name: str | None) -> str:
+    return " ".join((name or "").split()).lower()
+
+
+def get_teacher_rating_stats_for_update(db: Session, teacher_key: str) -> TeacherRatingStats:
+    query = db.query(TeacherRatingStats).filter(TeacherRatingStats.teacher_key == teacher_key).with_for_update()
+    stats = query.first()
+    if stats:
+        return stats
+    insert_if_missing(db, TeacherRatingStats, teacher_key=teacher_key)
+    return query.one()
+
+
+def _add_rating_bucket(stats, rating_value: int, count: int) -> None:
+    stats.rating_sum += rating_value * count
+    stats.rating_count += count
+    if rating_value in RATING_STARS:
+        star_field = f"star_{rating_value}"
+        setattr(stats, star_field, getattr(stats, star_field) + count)
+
+
+def course_sort_rating(course: Course, stats: CourseRatingStats | None) -> float:
+    # Mirrors the "rating" value of course_to_payload so catalog sorting can use an index.
+    avg_value, _, _ = _stats_average(stats)
+    return avg_value or course.rating or 0.0
+
+
+def _rebuild_rating_stats(db: Session, model, key_name: str, rows) -> dict:
+    # Rows are rewritten in place rather than deleted and re-inserted, so their
+    # version counters (and the ETags built from them) keep increasing; rows
+    # whose totals come out unchanged are not updated at all.
+    stats_by_key = {getattr(stats, key_name): stats for stats in db.query(model).all()}
+    for stats in stats_by_key.values():
+        stats.rating_sum = 0
+        stats.rating_count = 0
+        for star in RATING_STARS:
+            setattr(stats, f"star_{star}", 0)
+    for key, rating_value, count in rows:
+        stats = stats_by_key.get(key)
+        if not stats:
+            stats = _empty_rating_stats(model, **{key_name: key})
+            db.add(stats)
+            stats_by_key[key] = stats
+        _add_rating_bucket(stats, rating_value, count)
+    return stats_by_key
+
+
+def rebuild_course_rating_stats(db: Session) -> int:
+    rows = (
+        db.query(CourseRating.course_id, CourseRating.rating, func.count(CourseRating.id))
+        .group_by(CourseRating.course_id, CourseRating.rating)
+        .all()
+    )
+    stats_by_course = _rebuild_rating_stats(db, CourseRatingStats, "course_id", rows)
+    for course in db.query(Course).all():
+        course.sort_rating = course_sort_rating(course, stats_by_course.get(course.id))
+    rated = sum(1 for stats in stats_by_course.values() if stats.rating_count)
+    db.commit()
+    return rated
+
+
+def backfill_teacher_rating_keys(db: Session) -> None:
+    rows = db.query(TeacherRating).filter(TeacherRating.teacher_key.is_(None)).all()
+    for row in rows:
+        row.teacher_key = normalize_teacher_key(row.teacher_name)
+    if rows:
+        db.commit()
+
+
+def dedupe_teacher_ratings(db: Session) -> int:
+    # Before ratings were keyed by teacher_key a user could rate one teacher
+    # under several spellings; keep the newest row for each key.
+    newest = (
+        select(func.max(TeacherRating.id))
+        .group_by(TeacherRating.user_id, TeacherRating.teacher_key)
+        .scalar_subquery()
+    )
+    removed = (
+        db.query(TeacherRating)
+        .filter(TeacherRating.id.not_in(newest))
+        .delete(synchronize_session=False)
+    )
+    db.commit()
+    return removed
+
+
+def rebuild_teacher_rating_stats(db: Session) -> int:
+    backfill_teacher_rating_keys(db)
+    dedupe_teacher_ratings(db)
+    rows = (
+        db.query(TeacherRating.teacher_key, TeacherRating.rating, func.count(TeacherRating.id))
+        .group_by(TeacherRating.teacher_key, TeacherRating.rating)
+        .all()
+    )
+    stats_by_teacher = _rebuild_rating_stats(db, TeacherRatingStats, "teacher_key", rows)
+    rated = sum(1 for stats in stats_by_teacher.values() if stats.rating_count)
+    db.commit()
+    teacher_rating_cache.clear()
+    return rated
+
+
+def get_course_rating_summary(db: Session, course_id: str, user_id: int | None = None) -> dict:
+    avg_value, count, version = _stats_average(db.get(CourseRatingStats, course_id))
     my_rating = None
     if user_id:
         row = (
@@ -215,46 +644,181 @@ def get_course_rating_summary(db: Session, course_id: str, user_id: int | None =
         )
         if row:
             my_rating = row.rating
-    return {"average": avg_value or 0.0, "count": count, "my_rating": my_rating}
+    return {"average": avg_value or 0.0, "count": count, "my_rating": my_rating, "version": version}
+
+
+class TeacherRatingCache:
+    """Process-local cache of teacher rating aggregates keyed by teacher_key.
+
+    Entries written by this process are invalidated on write; the TTL bounds
+    staleness for writes that happen in other workers.
+    """
+
+    def __init__(self, ttl_seconds: float = 30.0) -> None:
+        self.ttl_seconds = ttl_seconds
+        self.entries: dict[str, tuple[float, tuple[float | None, int, int]]] = {}
+
+    def get(self, teacher_key: str) -> tuple[float | None, int, int] | None:
+        entry = self.entries.get(teacher_key)
+        if not entry:
+            return None
+        stored_at, value = entry
+        if time.monotonic() - stored_at > self.ttl_seconds:
+            self.entries.pop(teacher_key, None)
+            return None
+        return value
+
+    def set(self, teacher_key: str, value: tuple[float | None, int, int]) -> None:
+        self.entries[teacher_key] = (time.monotonic(), value)
+
+    def invalidate(self, teacher_key: str) -> None:
+        self.entries.pop(teacher_key, None)
+
+    def clear(self) -> None:
+        self.entries.clear()
+
+
+teacher_rating_cache = TeacherRatingCache()
+
+
+def _teacher_rating_stats(db: Session, teacher_keys: list[str]) -> dict[str, tuple[float | None, int, int]]:
+    results: dict[str, tuple[float | None, int, int]] = {}
+    missing: list[str] = []
+    for teacher_key in teacher_keys:
+        cached = teacher_rating_cache.get(teacher_key)
+        if cached is None:
+            missing.append(teacher_key)
+        else:
+            results[teacher_key] = cached
+    if missing:
+        rows = (
+            db.query(TeacherRatingStats)
+            .filter(TeacherRatingStats.teacher_key.in_(missing))
+            .all()
+        )
+        found = {stats.teacher_key: _stats_average(stats) for stats in rows}
+        for teacher_key in missing:
+            value = found.get(teacher_key, (None, 0, 0))
+            teacher_rating_cache.set(teacher_key, value)
+            results[teacher_key] = value
+    return results
 
 
 def get_teacher_rating_summary(db: Session, teacher_name: str, user_id: int | None = None) -> dict:
-    avg_value, count = _rating_stats(
-        db.query(func.avg(TeacherRating.rating), func.count(TeacherRating.id))
-        .filter(TeacherRating.teacher_name == teacher_name)
-        .one()
-    )
+    teacher_key = normalize_teacher_key(teacher_name)
+    avg_value, count, version = _teacher_rating_stats(db, [teacher_key])[teacher_key]
     my_rating = None
     if user_id:
         row = (
             db.query(TeacherRating)
-            .filter(TeacherRating.teacher_name == teacher_name, TeacherRating.user_id == user_id)
+            .filter(TeacherRating.teacher_key == teacher_key, TeacherRating.user_id == user_id)
             .first()
         )
         if row:
             my_rating = row.rating
-    return {"average": avg_value or 0.0, "count": count, "my_rating": my_rating}
+    return {"average": avg_value or 0.0, "count": count, "my_rating": my_rating, "version": version}
 
 
-def course_to_payload(course: Course, db: Session) -> dict:
-    lessons = sorted(course.lessons, key=lambda item: item.position or 0)
-    lesson_payload = []
-    for idx, lesson in enumerate(lessons, start=1):
-        is_free = idx <= FREE_LESSON_COUNT
-        lesson_payload.append(
-            {
-                "id": lesson.id,
-                "title": lesson.title,
-                "duration": lesson.duration,
-                "type": lesson.type,
-                "video_url": lesson.video_url,
-                "position": lesson.position or idx,
-                "is_free": is_free,
-            }
-        )
+COURSE_PAGE_SORTS = {
+    "newest": (Course.created_at, True),
+    "rating": (Course.sort_rating, True),
+    "price_asc": (Course.price_cents, False),
+    "price_desc": (Course.price_cents, True),
+}
+
+
+def encode_course_cursor(sort: str, course: Course) -> str:
+    column, _ = COURSE_PAGE_SORTS[sort]
+    value = getattr(course, column.key)
+    if isinstance(value, datetime):
+        value = value.isoformat()
+    raw = json.dumps([sort, value, course.id], separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_course_cursor(cursor: str, sort: str) -> tuple:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        cursor_sort, value, course_id = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except Exception as exc:
+        raise HTTPException(status_code=400, detail="Invalid cursor") from exc
+    if cursor_sort != sort or not isinstance(course_id, str):
+        raise HTTPException(status_code=400, detail="Cursor does not match sort")
+    if sort == "newest" and value is not None:
+        try:
+            value = datetime.fromisoformat(value)
+        except (TypeError, ValueError) as exc:
+            raise HTTPException(status_code=400, detail="Invalid cursor") from exc
+    return value, course_id
+
+
+def make_etag(*parts) -> str:
+    digest = hashlib.sha256("|".join(str(part) for part in parts).encode()).hexdigest()
+    return f'"{digest[:32]}"'
+
+
+def etag_matches(request: Request, etag: str) -> bool:
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    candidates = {item.strip().removeprefix("W/") for item in header.split(",")}
+    return etag in candidates
+
+
+def not_modified(etag: str) -> Response:
+    return Response(status_code=304, headers={"ETag": etag})
+
+
+def get_purchased_course_ids(db: Session, user: User | None) -> set[str]:
+    if not user:
+        return set()
+    rows = db.query(CoursePurchase.course_id).filter(CoursePurchase.user_id == user.id).all()
+    return {row[0] for row in rows}
+
+
+def get_course_rating_summaries(db: Session, course_ids: list[str]) -> dict[str, dict]:
+    if not course_ids:
+        return {}
+    rows = (
+        db.query(CourseRatingStats)
+        .filter(CourseRatingStats.course_id.in_(course_ids))
+        .all()
+    )
+    summaries = {}
+    for stats in rows:
+        avg_value, count_value, version = _stats_average(stats)
+        summaries[stats.course_id] = {
+            "average": avg_value or 0.0,
+            "count": count_value,
+            "my_rating": None,
+            "version": version,
+        }
+    return summaries
+
+
+def get_teacher_rating_summaries(db: Session, teacher_names: list[str]) -> dict[str, dict]:
+    if not teacher_names:
+        return {}
+    keys_by_name = {name: normalize_teacher_key(name) for name in teacher_names}
+    stats_by_key = _teacher_rating_stats(db, sorted(set(keys_by_name.values())))
+    summaries = {}
+    for teacher_name, teacher_key in keys_by_name.items():
+        avg_value, count_value, version = stats_by_key[teacher_key]
+        summaries[teacher_name] = {
+            "average": avg_value or 0.0,
+            "count": count_value,
+            "my_rating": None,
+            "version": version,
+        }
+    return summaries
+
+
+EMPTY_RATING_SUMMARY = {"average": 0.0, "count": 0, "my_rating": None, "version": 0}
 
-    rating_summary = get_course_rating_summary(db, course.id)
-    teacher_summary = get_teacher_rating_summary(db, course.instructor)
+
+def course_summary_fields(course: Course, rating_summary: dict, teacher_summary: dict) -> dict:
     return {
         "id": course.id,
         "title": course.title,
@@ -273,13 +837,50 @@ def course_to_payload(course: Course, db: Session) -> dict:
         "teacher_rating_count": teacher_summary["count"],
         "students": course.students,
         "language": course.language,
+    }
+
+
+def course_to_payload(
+    course: Course,
+    db: Session,
+    rating_summary: dict | None = None,
+    teacher_summary: dict | None = None,
+) -> dict:
+    lessons = sorted(course.lessons, key=lambda item: item.position or 0)
+    lesson_payload = []
+    for idx, lesson in enumerate(lessons, start=1):
+        is_free = idx <= FREE_LESSON_COUNT
+        lesson_payload.append(
+            {
+                "id": lesson.id,
+                "title": lesson.title,
+                "duration": lesson.duration,
+                "type": lesson.type,
+                "video_url": lesson.video_url,
+                "position": lesson.position or idx,
+                "is_free": is_free,
+            }
+        )
+
+    if rating_summary is None:
+        rating_summary = get_course_rating_summary(db, course.id)
+    if teacher_summary is None:
+        teacher_summary = get_teacher_rating_summary(db, course.instructor)
+    return {
+        **course_summary_fields(course, rating_summary, teacher_summary),
         "lessons": lesson_payload,
         "code_samples": course.code_samples or [],
     }
 
 
-def apply_locks(course: dict, db: Session, user: User | None) -> dict:
-    purchased = is_purchased(db, user, course["id"])
+def apply_locks(
+    course: dict,
+    db: Session,
+    user: User | None,
+    purchased: bool | None = None,
+) -> dict:
+    if purchased is None:
+        purchased = is_purchased(db, user, course["id"])
     lessons_out = []
     for idx, lesson in enumerate(course.get("lessons", []), start=1):
         is_free = idx <= FREE_LESSON_COUNT
@@ -299,71 +900,356 @@ def apply_locks(course: dict, db: Session, user: User | None) -> dict:
     return course_copy
 
 
+def course_version_key(course: Course, rating_summary: dict, teacher_summary: dict) -> str:
+    lesson_versions = ",".join(
+        f"{lesson.id}.{lesson.version}" for lesson in sorted(course.lessons, key=lambda item: item.id)
+    )
+    return (
+        f"{course.id}:{course.version}:{lesson_versions}:"
+        f"{rating_summary.get('version', 0)}:{teacher_summary.get('version', 0)}:{FREE_LESSON_COUNT}"
+    )
+
+
+def build_course_payloads(db: Session, courses: list[Course]) -> list[tuple[dict, str]]:
+    # Lessons are expected to be eager-loaded by the caller; everything else is
+    # fetched in one grouped query per kind so the query count does not grow
+    # with the catalog size.
+    course_ids = [course.id for course in courses]
+    instructors = sorted({course.instructor for course in courses if course.instructor})
+    rating_summaries = get_course_rating_summaries(db, course_ids)
+    teacher_summaries = get_teacher_rating_summaries(db, instructors)
+    results = []
+    for course in courses:
+        rating_summary = rating_summaries.get(course.id, EMPTY_RATING_SUMMARY)
+        teacher_summary = teacher_summaries.get(course.instructor, EMPTY_RATING_SUMMARY)
+        results.append(
+            (
+                course_to_payload(
+                    course,
+                    db,
+                    rating_summary=rating_summary,
+                    teacher_summary=teacher_summary,
+                ),
+                course_version_key(course, rating_summary, teacher_summary),
+            )
+        )
+    return results
+
+
+def build_course_summaries(db: Session, courses: list[Course], purchased_ids: set[str]) -> list[dict]:
+    rating_summaries = get_course_rating_summaries(db, [course.id for course in courses])
+    teacher_summaries = get_teacher_rating_summaries(
+        db, sorted({course.instructor for course in courses if course.instructor})
+    )
+    return [
+        {
+            **course_summary_fields(
+                course,
+                rating_summaries.get(course.id, EMPTY_RATING_SUMMARY),
+                teacher_summaries.get(course.instructor, EMPTY_RATING_SUMMARY),
+            ),
+            "free_lessons": FREE_LESSON_COUNT,
+            "is_purchased": course.id in purchased_ids,
+        }
+        for course in courses
+    ]
+
+
+class CatalogEntry:
+    __slots__ = ("course_id", "category", "locked", "unlocked", "locked_etag", "unlocked_etag")
+
+    def __init__(self, payload: dict, version_key: str, db: Session) -> None:
+        self.course_id = payload["id"]
+        self.category = payload["category"]
+        self.locked = apply_locks(payload, db, None, purchased=False)
+        self.unlocked = apply_locks(payload, db, None, purchased=True)
+        self.locked_etag = make_etag("course", version_key, "locked")
+        self.unlocked_etag = make_etag("course", version_key, "purchased")
+
+    def for_purchase_state(self, purchased: bool) -> dict:
+        return self.unlocked if purchased else self.locked
+
+    def etag_for_purchase_state(self, purchased: bool) -> str:
+        return self.unlocked_etag if purchased else self.locked_etag
+
+
+class CatalogSnapshot:
+    def __init__(self, entries: list[CatalogEntry]) -> None:
+        self.entries = entries
+        self.by_id = {entry.course_id: entry for entry in entries}
+        self.built_at = time.monotonic()
+
+
+class CatalogSnapshotCache:
+    """Pre-serialized, user-independent catalog shared by all requests.
+
+    Every course is rendered once in its locked and purchased form, so a
+    request only has to pick one of them per course from the caller's
+    purchase set. Course, lesson and rating commits in this process drop the
+    snapshot; the TTL bounds staleness for writes made by other workers.
+    """
+
+    def __init__(self, ttl_seconds: float = 60.0) -> None:
+        self.ttl_seconds = ttl_seconds
+        self.snapshot: CatalogSnapshot | None = None
+        self.generation = 0
+        self.lock = threading.Lock()
+
+    def get(self, db: Session) -> CatalogSnapshot:
+        snapshot = self.snapshot
+        if snapshot and time.monotonic() - snapshot.built_at <= self.ttl_seconds:
+            return snapshot
+        with self.lock:
+            snapshot = self.snapshot
+            if snapshot and time.monotonic() - snapshot.built_at <= self.ttl_seconds:
+                return snapshot
+            generation = self.generation
+            courses = db.query(Course).options(selectinload(Course.lessons)).all()
+            snapshot = CatalogSnapshot(
+                [
+                    CatalogEntry(payload, version_key, db)
+                    for payload, version_key in build_course_payloads(db, courses)
+                ]
+            )
+            # Do not publish a snapshot that raced with an invalidation.
+            if generation == self.generation:
+                self.snapshot = snapshot
+            return snapshot
+
+    def invalidate(self) -> None:
+        self.generation += 1
+        self.snapshot = None
+
+
+catalog_snapshot_cache = CatalogSnapshotCache()
+
+COURSE_SEARCH_FIELDS = {"title": 3.0, "instructor": 2.0, "topics": 1.5, "summary": 1.0}
+
+
+def course_search_fields(course: Course) -> dict[str, str]:
+    return {
+        "title": course.title,
+        "instructor": course.instructor,
+        "topics": " ".join(course.topics or []),
+        "summary": course.summary,
+    }
+
+
+class CourseSearchSync:
+    """Keeps the process-local course search index and suggester in step with the courses table.
+
+    A background thread builds the index, re-indexes course ids marked dirty
+    by commits in this process as soon as they arrive, and every
+    ``full_sync_seconds`` compares the (id, version) pairs of all courses with
+    the index to pick up writes from other workers. Requests only read the
+    index; at most they apply the pending dirty ids (``apply_pending``).
+    """
+
+    def __init__(self, index: SearchIndex, suggester: PrefixSuggester, full_sync_seconds: float = 30.0) -> None:
+        self.index = index
+        self.suggester = suggester
+        self.full_sync_seconds = full_sync_seconds
+        self.last_full_sync: float | None = None
+        self.dirty_ids: set[str] = set()
+        self.lock = threading.Lock()
+        # Serializes re-indexing between the background thread and requests.
+        self.sync_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def mark_dirty(self, course_ids) -> None:
+        with self.lock:
+            self.dirty_ids.update(course_ids)
+        self._wake.set()
+
+    def _take_dirty(self) -> set[str]:
+        with self.lock:
+            changed, self.dirty_ids = self.dirty_ids, set()
+        return changed
+
+    def apply_pending(self, db: Session) -> None:
+        # Never waits: if a sync is running it will pick the ids up.
+        if not self.dirty_ids or not self.sync_lock.acquire(blocking=False):
+            return
+        try:
+            changed = self._take_dirty()
+            if changed:
+                self._reindex(db, sorted(changed))
+        finally:
+            self.sync_lock.release()
+
+    def full_sync(self, db: Session) -> None:
+        with self.sync_lock:
+            # Ids dirtied before the version scan are covered by it.
+            self._take_dirty()
+            indexed = self.index.versions()
+            current = dict(db.query(Course.id, Course.version).all())
+            changed = {
+                course_id
+                for course_id, version in current.items()
+                if indexed.get(course_id) != version
+            }
+            for course_id in indexed.keys() - current.keys():
+                self.index.remove(course_id)
+                self.suggester.remove(course_id)
+            if changed:
+                self._reindex(db, sorted(changed))
+            self.last_full_sync = time.monotonic()
+
+    def start(self) -> None:
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="course-search-sync", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._wake.set()
+        if self._thread:
+            self._thread.join(timeout=10)
+            self._thread = None
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            if self.last_full_sync is not None:
+                self._wake.wait(max(0.0, self.last_full_sync + self.full_sync_seconds - time.monotonic()))
+                self._wake.clear()
+                if self._stop.is_set():
+                    break
+            db = SessionLocal()
+            try:
+                if self.last_full_sync is None or time.monotonic() - self.last_full_sync >= self.full_sync_seconds:
+                    self.full_sync(db)
+                else:
+                    with self.sync_lock:
+                        changed = self._take_dirty()
+                        if changed:
+                            self._reindex(db, sorted(changed))
+            except Exception:  # pragma: no cover - keep syncing after database errors
+                time.sleep(1.0)
+            finally:
+                db.close()
+
+    def _reindex(self, db: Session, course_ids: list[str], chunk_size: int = 500) -> None:
+        suggestions = []
+        for start in range(0, len(course_ids), chunk_size):
+            chunk = course_ids[start:start + chunk_size]
+            courses = (
+                db.query(Course)
+                .options(defer(Course.code_samples))
+                .filter(Course.id.in_(chunk))
+                .all()
+            )
+            found = set()
+            for course in courses:
+                found.add(course.id)
+                self.index.upsert(
+                    course.id,
+                    course_search_fields(course),
+                    {"category": course.category, "level": course.level},
+                    version=course.version,
+                )
+                suggestions.append((course.id, course.title, course.instructor))
+            for course_id in set(chunk) - found:
+                self.index.remove(course_id)
+                self.suggester.remove(course_id)
+        self.suggester.upsert_many(suggestions)
+
+
+course_search_index = SearchIndex(COURSE_SEARCH_FIELDS)
+course_suggester = PrefixSuggester()
+course_search_sync = CourseSearchSync(course_search_index, course_suggester)
+
+CATALOG_MODELS = (Course, CourseLesson, CourseRating, CourseRatingStats, TeacherRating, TeacherRatingStats)
+
+
+@event.listens_for(Session, "after_flush")
+def _track_catalog_writes(session: Session, flush_context) -> None:
+    for instance in (*session.new, *session.dirty, *session.deleted):
+        if isinstance(instance, CATALOG_MODELS):
+            session.info["catalog_dirty"] = True
+        if isinstance(instance, Course):
+            session.info.setdefault("dirty_course_ids", set()).add(instance.id)
+        if isinstance(instance, TeacherRatingStats):
+            session.info.setdefault("dirty_teacher_keys", set()).add(instance.teacher_key)
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_catalog_caches(session: Session) -> None:
+    for teacher_key in session.info.pop("dirty_teacher_keys", ()):
+        teacher_rating_cache.invalidate(teacher_key)
+    if session.info.pop("catalog_dirty", False):
+        catalog_snapshot_cache.invalidate()
+    dirty_course_ids = session.info.pop("dirty_course_ids", None)
+    if dirty_course_ids:
+        course_search_sync.mark_dirty(dirty_course_ids)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_catalog_writes(session: Session) -> None:
+    session.info.pop("dirty_teacher_keys", None)
+    session.info.pop("catalog_dirty", None)
+    session.info.pop("dirty_course_ids", None)
+
+
+def get_catalog_course(db: Session, course_id: str, user: User | None) -> tuple[dict, str] | None:
+    entry = catalog_snapshot_cache.get(db).by_id.get(course_id)
+    if entry:
+        purchased = is_purchased(db, user, course_id)
+        return entry.for_purchase_state(purchased), entry.etag_for_purchase_state(purchased)
+    # The course may have been created by another worker after the snapshot was built.
+    course = db.query(Course).filter(Course.id == course_id).first()
+    if not course:
+        return None
+    (payload, version_key), = build_course_payloads(db, [course])
+    entry = CatalogEntry(payload, version_key, db)
+    purchased = is_purchased(db, user, course_id)
+    return entry.for_purchase_state(purchased), entry.etag_for_purchase_state(purchased)
+
+
 def parse_price_to_cents(value: str | None) -> int:
     if not value:
         return 0
     digits = "".join(ch for ch in value if ch.isdigit() or ch == ".")
     if not digits:
         return 0
-    return int(float(digits) * 100)
+    try:
+        amount = Decimal(digits)
+    except InvalidOperation:
+        return 0
+    return int((amount * 100).quantize(Decimal("1"), rounding=ROUND_HALF_UP))
+
+
+def sync_course_price_cents(course: Course) -> None:
+    if course.old_price is not None and not course.old_price.strip():
+        # A blank old price means there is none; storing NULL keeps the
+        # startup backfill from selecting the row again on every boot.
+        course.old_price = None
+    course.price_cents = parse_price_to_cents(course.price)
+    course.old_price_cents = parse_price_to_cents(course.old_price) if course.old_price else None
 
 
 def _hash_code(code: str) -> str:
     return hmac.new(SECRET_KEY.encode(), code.encode(), hashlib.sha256).hexdigest()
 
 
-def _send_email_code(email: str, code: str) -> None:
-    if RESEND_API_KEY:
-        payload = {
-            "from": RESEND_FROM,
-            "to": [email],
-            "subject": "Tasdiqlash kodi",
-            "text": f"Ro'yxatdan o'tish kodi: {code}\nKod {OTP_EXPIRE_MINUTES} daqiqa amal qiladi.",
-        }
-        try:
-            resp = requests.post(
-                "https://api.resend.com/emails",
-                headers={
-                    "Authorization": f"Bearer {RESEND_API_KEY}",
-                    "Content-Type": "application/json",
-                },
-                json=payload,
-                timeout=10,
-            )
-        except Exception as exc:
-            raise HTTPException(status_code=500, detail=f"Resend error: {exc}") from exc
-        if resp.status_code >= 300:
-            raise HTTPException(status_code=500, detail=f"Resend error: {resp.text}")
-        return
+email_outbox_worker = EmailOutboxWorker(EmailTransport())
 
-    if not SMTP_HOST or not SMTP_FROM:
-        raise HTTPException(status_code=500, detail="SMTP not configured")
-    if not SMTP_USER or not SMTP_PASSWORD:
-        raise HTTPException(status_code=500, detail="SMTP credentials missing")
-    message = EmailMessage()
-    message["From"] = SMTP_FROM
-    message["To"] = email
-    message["Subject"] = "Tasdiqlash kodi"
-    message.set_content(f"Ro'yxatdan o'tish kodi: {code}\nKod {OTP_EXPIRE_MINUTES} daqiqa amal qiladi.")
 
-    try:
-        if SMTP_TLS:
-            with smtplib.SMTP(SMTP_HOST, SMTP_PORT, timeout=10) as server:
-                server.ehlo()
-                server.starttls()
-                server.ehlo()
-                server.login(SMTP_USER, SMTP_PASSWORD)
-                server.send_message(message)
-        else:
-            with smtplib.SMTP(SMTP_HOST, SMTP_PORT, timeout=10) as server:
-                server.ehlo()
-                server.login(SMTP_USER, SMTP_PASSWORD)
-                server.send_message(message)
-    except Exception as exc:
-        raise HTTPException(status_code=500, detail=f"SMTP error: {exc}") from exc
+def _email_code_message(code: str) -> tuple[str, str]:
+    return (
+        "Tasdiqlash kodi",
+        f"Ro'yxatdan o'tish kodi: {code}\nKod {OTP_EXPIRE_MINUTES} daqiqa amal qiladi.",
+    )
 
 
-def _issue_email_code(db: Session, email: str) -> None:
+def _issue_email_code(db: Session, email: str) -> str:
+    try:
+        EmailTransport.check_configured()
+    except EmailConfigurationError as exc:
+        raise HTTPException(status_code=500, detail=str(exc)) from exc
     code = f"{secrets.randbelow(1000000):06d}"
     now = datetime.now(timezone.utc)
     expires_at = now + timedelta(minutes=OTP_EXPIRE_MINUTES)
@@ -380,8 +1266,16 @@ def _issue_email_code(db: Session, email: str) -> None:
             expires_at=expires_at,
         )
         db.add(record)
+    # The code and its delivery commit together; the outbox worker sends it.
+    subject, body = _email_code_message(code)
+    message = enqueue_email(db, email, subject, body)
+    # Returned to the requester instead of the sequential row id, so delivery
+    # status can only be read by whoever asked for the code.
+    delivery_token = secrets.token_urlsafe(24)
+    message.delivery_token_hash = _hash_code(delivery_token)
     db.commit()
-    _send_email_code(email, code)
+    email_outbox_worker.notify()
+    return delivery_token
 
 
 def _verify_email_code(db: Session, email: str, code: str) -> None:
@@ -415,6 +1309,130 @@ def lesson_access(db: Session, user: User | None, lesson: CourseLesson) -> tuple
     return is_free, locked
 
 
+def _lesson_version_rows(db: Session, model, lesson_id: int) -> list[tuple[int, int]]:
+    return [tuple(row) for row in db.query(model.id, model.version).filter(model.lesson_id == lesson_id).all()]
+
+
+def lesson_messages_page(
+    db: Session,
+    lesson_id: int,
+    limit: int = LESSON_MESSAGE_PAGE_SIZE,
+    before_id: int | None = None,
+    after_id: int | None = None,
+) -> list[LessonMessage]:
+    """Return up to ``limit`` messages in chronological order.
+
+    Without a cursor this is the latest page. Cursors are message ids and
+    are resolved to their ``(created_at, id)`` position inside the query, so
+    the walk stays on ``ix_lesson_messages_lesson_created_id``; a cursor
+    that has since been deleted falls back to id order.
+    """
+    query = (
+        db.query(LessonMessage)
+        .options(selectinload(LessonMessage.user), selectinload(LessonMessage.attachment))
+        .filter(LessonMessage.lesson_id == lesson_id)
+    )
+    cursor_id = after_id if after_id is not None else before_id
+    if cursor_id is not None:
+        cursor_message = aliased(LessonMessage)
+        cursor_at = select(cursor_message.created_at).where(cursor_message.id == cursor_id).scalar_subquery()
+        if after_id is not None:
+            query = query.filter(
+                or_(
+                    LessonMessage.created_at > cursor_at,
+                    and_(LessonMessage.created_at == cursor_at, LessonMessage.id > cursor_id),
+                    and_(cursor_at.is_(None), LessonMessage.id > cursor_id),
+                )
+            )
+        else:
+            query = query.filter(
+                or_(
+                    LessonMessage.created_at < cursor_at,
+                    and_(LessonMessage.created_at == cursor_at, LessonMessage.id < cursor_id),
+                    and_(cursor_at.is_(None), LessonMessage.id < cursor_id),
+                )
+            )
+    if after_id is not None:
+        return (
+            query.order_by(LessonMessage.created_at.asc(), LessonMessage.id.asc())
+            .limit(limit)
+            .all()
+        )
+    messages = (
+        query.order_by(LessonMessage.created_at.desc(), LessonMessage.id.desc())
+        .limit(limit)
+        .all()
+    )
+    messages.reverse()
+    return messages
+
+
+def next_lesson_message_seq(db: Session, lesson_id: int) -> int:
+    # The row lock serializes writers per lesson, so sequence numbers become
+    # visible in order and a poller's watermark never skips a change.
+    query = db.query(LessonMessageSequence).filter(LessonMessageSequence.lesson_id == lesson_id).with_for_update()
+    sequence = query.first()
+    if not sequence:
+        insert_if_missing(db, LessonMessageSequence, lesson_id=lesson_id, last_seq=0)
+        sequence = query.one()
+    sequence.last_seq = (sequence.last_seq or 0) + 1
+    return sequence.last_seq
+
+
+def stamp_lesson_message_change(db: Session, message: LessonMessage) -> None:
+    message.change_seq = next_lesson_message_seq(db, message.lesson_id)
+
+
+def record_lesson_message_deletion(db: Session, message: LessonMessage) -> LessonMessageTombstone:
+    tombstone = LessonMessageTombstone(
+        lesson_id=message.lesson_id,
+        message_id=message.id,
+        change_seq=next_lesson_message_seq(db, message.lesson_id),
+    )
+    db.add(tombstone)
+    return tombstone
+
+
+def lesson_message_watermark(db: Session, lesson_id: int) -> int:
+    last_seq = (
+        db.query(LessonMessageSequence.last_seq)
+        .filter(LessonMessageSequence.lesson_id == lesson_id)
+        .scalar()
+    )
+    return last_seq or 0
+
+
+def _latest_message_version_rows(db: Session, lesson_id: int) -> list[tuple[int, int]]:
+    return [
+        tuple(row)
+        for row in db.query(LessonMessage.id, LessonMessage.version)
+        .filter(LessonMessage.lesson_id == lesson_id)
+        .order_by(LessonMessage.created_at.desc(), LessonMessage.id.desc())
+        .limit(LESSON_MESSAGE_PAGE_SIZE)
+        .all()
+    ]
+
+
+def lesson_detail_etag(
+    lesson: CourseLesson,
+    is_free: bool,
+    locked: bool,
+    slides: list[tuple[int, int]],
+    resources: list[tuple[int, int]],
+    messages: list[tuple[int, int]] | None,
+) -> str:
+    return make_etag(
+        "lesson",
+        lesson.id,
+        lesson.version,
+        is_free,
+        locked,
+        sorted(slides),
+        sorted(resources),
+        sorted(messages) if messages is not None else "-",
+    )
+
+
 def normalize_message_content(content: str | None) -> str:
     return (content or "").strip()
 
@@ -582,8 +1600,8 @@ def serialize_assignment_payload(
     }
 
 
-def user_has_role(user: User, role_name: str) -> bool:
-    return any(role.name == role_name for role in user.roles)
+def user_has_role(user: User | AuthUser, role_name: str) -> bool:
+    return has_role(user, role_name)
 
 
 def can_manage_messages(user: User) -> bool:
@@ -858,7 +1876,7 @@ def ensure_teacher(db: Session) -> None:
     user = User(
         email=TEACHER_EMAIL,
         username=TEACHER_USERNAME,
-        hashed_password=get_password_hash(TEACHER_PASSWORD),
+        hashed_password=password_hasher.hash_sync(TEACHER_PASSWORD),
     )
     user.roles = [get_or_create_role(db, name) for name in role_names] or [teacher_role]
     db.add(user)
@@ -875,7 +1893,7 @@ def ensure_admin(db: Session) -> None:
     user = User(
         email=ADMIN_EMAIL,
         username=ADMIN_USERNAME,
-        hashed_password=get_password_hash(ADMIN_PASSWORD),
+        hashed_password=password_hasher.hash_sync(ADMIN_PASSWORD),
     )
     role_names = [r.strip() for r in ADMIN_ROLES.split(",") if r.strip()]
     user.roles = [get_or_create_role(db, name) for name in role_names] or [
@@ -905,7 +1923,9 @@ def ensure_courses(db: Session) -> None:
                 students=raw.get("students"),
                 language=raw.get("language"),
                 code_samples=raw.get("code_samples", []),
+                sort_rating=raw.get("rating") or 0.0,
             )
+            sync_course_price_cents(course)
             lessons = []
             for idx, lesson in enumerate(raw.get("lessons", []), start=1):
                 lessons.append(
@@ -985,6 +2005,69 @@ def ensure_courses(db: Session) -> None:
     db.commit()
 
 
+def ensure_course_columns(db: Session) -> None:
+    # Backfill numeric price and listing sort columns for courses created before they existed.
+    courses = (
+        db.query(Course)
+        .filter(
+            Course.price_cents.is_(None)
+            | (Course.old_price.isnot(None) & Course.old_price_cents.is_(None))
+            | Course.sort_rating.is_(None)
+            | Course.created_at.is_(None)
+        )
+        .all()
+    )
+    if not courses:
+        return
+    now = datetime.now(timezone.utc)
+    for course in courses:
+        if course.price_cents is None or (course.old_price and course.old_price_cents is None):
+            sync_course_price_cents(course)
+        if course.sort_rating is None:
+            course.sort_rating = course_sort_rating(course, db.get(CourseRatingStats, course.id))
+        if course.created_at is None:
+            course.created_at = now
+    db.commit()
+
+
+def ensure_lesson_message_seqs(db: Session) -> None:
+    # Messages from before change tracking get their id as change_seq, which is
+    # already increasing within a lesson; counters then continue from the max.
+    if db.query(LessonMessage.id).filter(LessonMessage.change_seq.is_(None)).first() is None:
+        return
+    db.query(LessonMessage).filter(LessonMessage.change_seq.is_(None)).update(
+        {LessonMessage.change_seq: LessonMessage.id},
+        synchronize_session=False,
+    )
+    rows = (
+        db.query(LessonMessage.lesson_id, func.max(LessonMessage.change_seq))
+        .group_by(LessonMessage.lesson_id)
+        .all()
+    )
+    for lesson_id, max_seq in rows:
+        sequence = db.get(LessonMessageSequence, lesson_id)
+        if not sequence:
+            db.add(LessonMessageSequence(lesson_id=lesson_id, last_seq=max_seq))
+        elif (sequence.last_seq or 0) < max_seq:
+            sequence.last_seq = max_seq
+    db.commit()
+
+
+def ensure_rating_stats(db: Session) -> None:
+    # Backfill aggregates for databases that have ratings from before the stats table existed.
+    if db.query(CourseRatingStats).first() is None and db.query(CourseRating).first() is not None:
+        rebuild_course_rating_stats(db)
+    needs_rebuild = db.query(TeacherRatingStats).first() is None and db.query(TeacherRating).first() is not None
+    if db.query(TeacherRating).filter(TeacherRating.teacher_key.is_(None)).first() is not None:
+        backfill_teacher_rating_keys(db)
+        needs_rebuild = True
+    if dedupe_teacher_ratings(db):
+        needs_rebuild = True
+    create_missing_indexes(TeacherRating.__table__)
+    if needs_rebuild:
+        rebuild_teacher_rating_stats(db)
+
+
 @app.on_event("startup")
 def startup_seed():
     db = next(get_db())
@@ -992,17 +2075,86 @@ def startup_seed():
         ensure_admin(db)
         ensure_teacher(db)
         ensure_courses(db)
+        ensure_rating_stats(db)
+        ensure_course_columns(db)
+        ensure_lesson_message_seqs(db)
     finally:
         db.close()
 
 
+@app.on_event("startup")
+def start_course_search_sync():
+    # The initial build runs here so no request pays for it; the thread then
+    # keeps the index current.
+    db = SessionLocal()
+    try:
+        course_search_sync.full_sync(db)
+    finally:
+        db.close()
+    course_search_sync.start()
+
+
+@app.on_event("startup")
+def prefetch_firebase_keys():
+    start_firebase_key_prefetch()
+
+
+@app.on_event("startup")
+def start_email_outbox():
+    email_outbox_worker.start()
+
+
+@app.on_event("startup")
+async def start_realtime_bus():
+    await realtime_bus.start()
+    await socket_event_queue.start()
+
+
+@app.on_event("shutdown")
+async def stop_realtime_bus():
+    await socket_event_queue.stop()
+    await realtime_bus.stop()
+
+
+@app.on_event("shutdown")
+def shutdown_password_hasher():
+    password_hasher.shutdown()
+
+
+@app.on_event("shutdown")
+def stop_email_outbox():
+    email_outbox_worker.stop()
+
+
+@app.on_event("shutdown")
+def stop_course_search_sync():
+    course_search_sync.stop()
+
+
 @app.get("/")
 def root():
     return {"status": "ok"}
 @app.post("/auth/email-code/request")
 def request_email_code(payload: EmailCodeRequest, db: Session = Depends(get_db)):
-    _issue_email_code(db, payload.email.strip().lower())
-    return {"status": "ok", "message": "Code sent"}
+    delivery_token = _issue_email_code(db, payload.email.strip().lower())
+    return {"status": "ok", "message": "Code sent", "delivery_token": delivery_token}
+
+
+@app.get("/auth/email-code/deliveries/{delivery_token}", response_model=EmailDeliveryOut)
+def get_email_code_delivery(delivery_token: str, db: Session = Depends(get_db)):
+    message = (
+        db.query(EmailOutbox)
+        .filter(EmailOutbox.delivery_token_hash == _hash_code(delivery_token))
+        .first()
+    )
+    if not message:
+        raise HTTPException(status_code=404, detail="Delivery not found")
+    # Provider errors can contain addresses and SMTP replies; they stay server-side.
+    return EmailDeliveryOut(
+        status=message.status,
+        attempts=message.attempts,
+        sent_at=message.sent_at,
+    )
 
 
 @app.post("/auth/email-code/verify")
@@ -1014,8 +2166,7 @@ def verify_email_code(payload: EmailCodeVerify, db: Session = Depends(get_db)):
     )
     return {"status": "ok", "message": "Email verified"}
 
-@app.post("/auth/register", response_model=UserOut)
-def register(payload: UserCreate, db: Session = Depends(get_db)):
+def _prepare_registration(db: Session, payload: UserCreate) -> tuple[str, str]:
     email = payload.email.strip().lower()
     raw_username = payload.username.strip()
     username = raw_username or email.split("@")[0]
@@ -1029,22 +2180,27 @@ def register(payload: UserCreate, db: Session = Depends(get_db)):
     require_email_code = FIREBASE_REQUIRE_EMAIL_CODE or bool(payload.require_email_code)
     if require_email_code and not _email_code_verified(db, email):
         raise HTTPException(status_code=400, detail="Email code required")
+    return email, username
 
-    candidate = username
-    counter = 1
-    while db.query(User).filter(User.username == candidate).first():
-        candidate = f"{username}{counter}"
-        counter += 1
-    username = candidate
 
+def _create_registered_user(
+    db: Session,
+    payload: UserCreate,
+    email: str,
+    username: str,
+    hashed_password: str,
+) -> UserOut:
     user = User(
         email=email,
-        username=username,
-        hashed_password=get_password_hash(payload.password),
+        hashed_password=hashed_password,
     )
+    try:
+        add_user_with_unique_username(db, user, username)
+    except IntegrityError:
+        # Same email registered concurrently since _prepare_registration checked.
+        raise HTTPException(status_code=400, detail="User already exists") from None
     role_names = payload.roles or ["user"]
     user.roles = [get_or_create_role(db, name) for name in role_names]
-    db.add(user)
     db.commit()
     db.refresh(user)
     return UserOut(
@@ -1055,23 +2211,49 @@ def register(payload: UserCreate, db: Session = Depends(get_db)):
     )
 
 
+@app.post("/auth/register", response_model=UserOut)
+async def register(payload: UserCreate, db: Session = Depends(get_db)):
+    # Database work stays on the threadpool; only PBKDF2 goes to the hasher pool.
+    email, username = await run_in_threadpool(_prepare_registration, db, payload)
+    hashed_password = await hash_password_async(payload.password)
+    return await run_in_threadpool(_create_registered_user, db, payload, email, username, hashed_password)
+
+
+def _issue_login_tokens(db: Session, user: User) -> dict:
+    # Building the access token reads user.roles, so it runs on the threadpool
+    # together with the refresh token insert rather than on the event loop.
+    return {
+        "access_token": create_user_access_token(user),
+        "token_type": "bearer",
+        "refresh_token": issue_refresh_token(db, user.id),
+    }
+
+
 @app.post("/auth/login", response_model=Token)
-def login(payload: UserLogin, db: Session = Depends(get_db)):
-    user = authenticate_user(db, payload.username, payload.password)
+async def login(payload: UserLogin, db: Session = Depends(get_db)):
+    user = await authenticate_user_async(db, payload.username, payload.password)
     if not user:
         raise HTTPException(status_code=401, detail="Invalid credentials")
 
-    token = create_access_token({"sub": str(user.id)})
-    return {"access_token": token, "token_type": "bearer"}
+    return await run_in_threadpool(_issue_login_tokens, db, user)
 
 
 @app.post("/auth/token", response_model=Token)
-def token(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
-    user = authenticate_user(db, form_data.username, form_data.password)
+async def token(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
+    user = await authenticate_user_async(db, form_data.username, form_data.password)
     if not user:
         raise HTTPException(status_code=401, detail="Invalid credentials")
-    token_value = create_access_token({"sub": str(user.id)})
-    return {"access_token": token_value, "token_type": "bearer"}
+    return await run_in_threadpool(_issue_login_tokens, db, user)
+
+
+@app.post("/auth/refresh", response_model=Token)
+def refresh(payload: RefreshTokenRequest, db: Session = Depends(get_db)):
+    user, refresh_token = rotate_refresh_token(db, payload.refresh_token)
+    return {
+        "access_token": create_user_access_token(user),
+        "token_type": "bearer",
+        "refresh_token": refresh_token,
+    }
 
 
 @app.get("/auth/me", response_model=UserOut | None)
@@ -1082,7 +2264,7 @@ def me(current_user: User | None = Depends(get_optional_user)):
         id=current_user.id,
         email=current_user.email,
         username=current_user.username,
-        roles=[role.name for role in current_user.roles],
+        roles=sorted(user_role_names(current_user)),
     )
 
 
@@ -1102,34 +2284,175 @@ def list_course_categories(db: Session = Depends(get_db)):
 
 @app.get("/courses", response_model=list[CourseOut])
 def list_courses(
+    request: Request,
+    response: Response,
+    category: str | None = Query(default=None),
+    current_user: User | None = Depends(get_optional_user),
+    db: Session = Depends(get_db),
+):
+    snapshot = catalog_snapshot_cache.get(db)
+    purchased_ids = get_purchased_course_ids(db, current_user)
+    entries = [
+        entry for entry in snapshot.entries if not category or entry.category == category
+    ]
+    etag = make_etag(
+        "courses",
+        *(entry.etag_for_purchase_state(entry.course_id in purchased_ids) for entry in entries),
+    )
+    if etag_matches(request, etag):
+        return not_modified(etag)
+    response.headers["ETag"] = etag
+    return [entry.for_purchase_state(entry.course_id in purchased_ids) for entry in entries]
+
+
+@app.get("/courses/browse", response_model=CoursePage)
+def browse_courses(
     category: str | None = Query(default=None),
+    level: str | None = Query(default=None),
+    language: str | None = Query(default=None),
+    min_price_cents: int | None = Query(default=None, ge=0),
+    max_price_cents: int | None = Query(default=None, ge=0),
+    sort: str = Query(default="newest"),
+    cursor: str | None = Query(default=None),
+    limit: int = Query(default=20, ge=1, le=100),
+    projection: str = Query(default="summary"),
     current_user: User | None = Depends(get_optional_user),
     db: Session = Depends(get_db),
 ):
-    query = db.query(Course)
+    if sort not in COURSE_PAGE_SORTS:
+        raise HTTPException(status_code=400, detail=f"Invalid sort. Use one of: {', '.join(COURSE_PAGE_SORTS)}")
+    if projection not in {"summary", "full"}:
+        raise HTTPException(status_code=400, detail="Invalid projection. Use summary or full")
+    sort_column, descending = COURSE_PAGE_SORTS[sort]
+
+    query = db.query(Course).options(defer(Course.code_samples))
     if category:
         query = query.filter(Course.category == category)
-    courses = query.all()
-    return [apply_locks(course_to_payload(course, db), db, current_user) for course in courses]
+    if level:
+        query = query.filter(Course.level == level)
+    if language:
+        query = query.filter(Course.language == language)
+    if min_price_cents is not None:
+        query = query.filter(Course.price_cents >= min_price_cents)
+    if max_price_cents is not None:
+        query = query.filter(Course.price_cents <= max_price_cents)
+    if cursor:
+        # Row-value comparison keeps the keyset predicate on the (sort column, id) index.
+        value, last_id = decode_course_cursor(cursor, sort)
+        position = tuple_(sort_column, Course.id)
+        query = query.filter(position < (value, last_id) if descending else position > (value, last_id))
+    if descending:
+        query = query.order_by(sort_column.desc(), Course.id.desc())
+    else:
+        query = query.order_by(sort_column.asc(), Course.id.asc())
+    courses = query.limit(limit + 1).all()
+
+    next_cursor = None
+    if len(courses) > limit:
+        courses = courses[:limit]
+        next_cursor = encode_course_cursor(sort, courses[-1])
+
+    purchased_ids = get_purchased_course_ids(db, current_user)
+    if projection == "full":
+        snapshot = catalog_snapshot_cache.get(db)
+        items = []
+        for course in courses:
+            entry = snapshot.by_id.get(course.id)
+            if entry:
+                items.append(entry.for_purchase_state(course.id in purchased_ids))
+            else:
+                items.append(apply_locks(course_to_payload(course, db), db, current_user))
+        return {"items": items, "next_cursor": next_cursor}
+
+    return {"items": build_course_summaries(db, courses, purchased_ids), "next_cursor": next_cursor}
+
+
+@app.get("/courses/search", response_model=CourseSearchOut)
+def search_courses(
+    q: str = Query(min_length=1, max_length=200),
+    category: str | None = Query(default=None),
+    level: str | None = Query(default=None),
+    limit: int = Query(default=20, ge=1, le=100),
+    offset: int = Query(default=0, ge=0),
+    current_user: User | None = Depends(get_optional_user),
+    db: Session = Depends(get_db),
+):
+    course_search_sync.apply_pending(db)
+    hits, total, facets = course_search_index.search(
+        q,
+        filters={"category": category, "level": level},
+        limit=limit,
+        offset=offset,
+    )
+    course_ids = [course_id for course_id, _ in hits]
+    courses = []
+    if course_ids:
+        rows = (
+            db.query(Course)
+            .options(defer(Course.code_samples))
+            .filter(Course.id.in_(course_ids))
+            .all()
+        )
+        courses_by_id = {course.id: course for course in rows}
+        courses = [courses_by_id[course_id] for course_id in course_ids if course_id in courses_by_id]
+    purchased_ids = get_purchased_course_ids(db, current_user)
+    return {
+        "items": build_course_summaries(db, courses, purchased_ids),
+        "total": total,
+        "facets": facets,
+    }
+
+
+@app.get("/courses/suggest", response_model=list[CourseSuggestionOut])
+def suggest_courses(
+    q: str = Query(min_length=1, max_length=100),
+    limit: int = Query(default=10, ge=1, le=25),
+):
+    # Served from memory only; the background sync keeps the suggester current.
+    return course_suggester.suggest(q, limit=limit)
 
 
 @app.get("/courses/{course_id}", response_model=CourseOut)
-def get_course(course_id: str, current_user: User | None = Depends(get_optional_user), db: Session = Depends(get_db)):
-    course = db.query(Course).filter(Course.id == course_id).first()
-    if not course:
+def get_course(
+    course_id: str,
+    request: Request,
+    response: Response,
+    current_user: User | None = Depends(get_optional_user),
+    db: Session = Depends(get_db),
+):
+    result = get_catalog_course(db, course_id, current_user)
+    if not result:
         raise HTTPException(status_code=404, detail="Course not found")
-    return apply_locks(course_to_payload(course, db), db, current_user)
+    payload, etag = result
+    if etag_matches(request, etag):
+        return not_modified(etag)
+    response.headers["ETag"] = etag
+    return payload
 
 
 @app.get("/courses/{course_id}/ratings", response_model=RatingSummary)
 def get_course_rating(
     course_id: str,
+    request: Request,
+    response: Response,
     current_user: User | None = Depends(get_optional_user),
     db: Session = Depends(get_db),
 ):
     course = db.query(Course).filter(Course.id == course_id).first()
     if not course:
         raise HTTPException(status_code=404, detail="Course not found")
+    # Any change to a user's own rating also changes the aggregate row, so the
+    # aggregate version plus the caller id identifies the response.
+    stats = db.get(CourseRatingStats, course_id)
+    etag = make_etag(
+        "course-rating",
+        course_id,
+        stats.version if stats else 0,
+        current_user.id if current_user else "",
+    )
+    if etag_matches(request, etag):
+        return not_modified(etag)
+    response.headers["ETag"] = etag
     return get_course_rating_summary(db, course_id, current_user.id if current_user else None)
 
 
@@ -1146,15 +2469,18 @@ def set_course_rating(
     rating_value = int(payload.rating)
     if rating_value < 1 or rating_value > 5:
         raise HTTPException(status_code=400, detail="Rating must be between 1 and 5")
+    stats = get_course_rating_stats_for_update(db, course_id)
     row = (
         db.query(CourseRating)
         .filter(CourseRating.course_id == course_id, CourseRating.user_id == current_user.id)
         .first()
     )
     if row:
+        apply_rating_to_stats(stats, row.rating, rating_value)
         row.rating = rating_value
         row.review = payload.review
     else:
+        apply_rating_to_stats(stats, None, rating_value)
         row = CourseRating(
             course_id=course_id,
             user_id=current_user.id,
@@ -1162,6 +2488,7 @@ def set_course_rating(
             review=payload.review,
         )
         db.add(row)
+    course.sort_rating = course_sort_rating(course, stats)
     db.commit()
     return get_course_rating_summary(db, course_id, current_user.id)
 
@@ -1169,12 +2496,20 @@ def set_course_rating(
 @app.get("/teachers/{teacher_name}/ratings", response_model=RatingSummary)
 def get_teacher_rating(
     teacher_name: str,
+    request: Request,
+    response: Response,
     current_user: User | None = Depends(get_optional_user),
     db: Session = Depends(get_db),
 ):
     name = teacher_name.strip()
     if not name:
         raise HTTPException(status_code=400, detail="Teacher name required")
+    teacher_key = normalize_teacher_key(name)
+    _, _, version = _teacher_rating_stats(db, [teacher_key])[teacher_key]
+    etag = make_etag("teacher-rating", teacher_key, version, current_user.id if current_user else "")
+    if etag_matches(request, etag):
+        return not_modified(etag)
+    response.headers["ETag"] = etag
     return get_teacher_rating_summary(db, name, current_user.id if current_user else None)
 
 
@@ -1191,17 +2526,22 @@ def set_teacher_rating(
     rating_value = int(payload.rating)
     if rating_value < 1 or rating_value > 5:
         raise HTTPException(status_code=400, detail="Rating must be between 1 and 5")
+    teacher_key = normalize_teacher_key(name)
+    stats = get_teacher_rating_stats_for_update(db, teacher_key)
     row = (
         db.query(TeacherRating)
-        .filter(TeacherRating.teacher_name == name, TeacherRating.user_id == current_user.id)
+        .filter(TeacherRating.teacher_key == teacher_key, TeacherRating.user_id == current_user.id)
         .first()
     )
     if row:
+        apply_rating_to_stats(stats, row.rating, rating_value)
         row.rating = rating_value
         row.review = payload.review
     else:
+        apply_rating_to_stats(stats, None, rating_value)
         row = TeacherRating(
             teacher_name=name,
+            teacher_key=teacher_key,
             user_id=current_user.id,
             rating=rating_value,
             review=payload.review,
@@ -1214,6 +2554,8 @@ def set_teacher_rating(
 @app.get("/lessons/{lesson_id}", response_model=LessonDetailOut)
 def get_lesson_detail(
     lesson_id: int,
+    request: Request,
+    response: Response,
     current_user: User | None = Depends(get_optional_user),
     db: Session = Depends(get_db),
 ):
@@ -1223,6 +2565,10 @@ def get_lesson_detail(
 
     is_free, locked = lesson_access(db, current_user, lesson)
     if locked:
+        etag = lesson_detail_etag(lesson, is_free, True, [], [], None)
+        if etag_matches(request, etag):
+            return not_modified(etag)
+        response.headers["ETag"] = etag
         return {
             "id": lesson.id,
             "title": lesson.title,
@@ -1237,6 +2583,20 @@ def get_lesson_detail(
             "messages": [],
         }
 
+    etag = None
+    if request.headers.get("if-none-match"):
+        # Compare against version counters only, before loading and serializing rows.
+        etag = lesson_detail_etag(
+            lesson,
+            is_free,
+            False,
+            _lesson_version_rows(db, LessonSlide, lesson.id),
+            _lesson_version_rows(db, LessonResource, lesson.id),
+            _latest_message_version_rows(db, lesson.id) if current_user else None,
+        )
+        if etag_matches(request, etag):
+            return not_modified(etag)
+
     slides = (
         db.query(LessonSlide)
         .filter(LessonSlide.lesson_id == lesson.id)
@@ -1250,13 +2610,18 @@ def get_lesson_detail(
     )
     messages = []
     if current_user:
-        messages = (
-            db.query(LessonMessage)
-            .filter(LessonMessage.lesson_id == lesson.id)
-            .order_by(LessonMessage.created_at.asc())
-            .all()
+        messages = lesson_messages_page(db, lesson.id)
+
+    if etag is None:
+        etag = lesson_detail_etag(
+            lesson,
+            is_free,
+            False,
+            [(item.id, item.version) for item in slides],
+            [(item.id, item.version) for item in resources],
+            [(item.id, item.version) for item in messages] if current_user else None,
         )
-
+    response.headers["ETag"] = etag
     return {
         "id": lesson.id,
         "title": lesson.title,
@@ -1290,38 +2655,43 @@ def list_lesson_assignments(
         .order_by(LessonAssignment.id.asc())
         .all()
     )
+    assignment_ids = [assignment.id for assignment in assignments]
+    submissions: dict[int, AssignmentSubmission] = {}
+    counts: dict[int, tuple[int, int]] | None = None
+    if current_user and assignment_ids:
+        submissions = {
+            submission.assignment_id: submission
+            for submission in db.query(AssignmentSubmission)
+            .options(
+                selectinload(AssignmentSubmission.student),
+                selectinload(AssignmentSubmission.grader),
+            )
+            .filter(
+                AssignmentSubmission.assignment_id.in_(assignment_ids),
+                AssignmentSubmission.student_id == current_user.id,
+            )
+        }
+        if can_manage_messages(current_user):
+            counts = {
+                assignment_id: (submission_count, graded_count)
+                for assignment_id, submission_count, graded_count in db.query(
+                    AssignmentSubmission.assignment_id,
+                    func.count(AssignmentSubmission.id),
+                    func.count(AssignmentSubmission.rating),
+                )
+                .filter(AssignmentSubmission.assignment_id.in_(assignment_ids))
+                .group_by(AssignmentSubmission.assignment_id)
+            }
     results = []
     for assignment in assignments:
-        submission = None
-        if current_user:
-            submission = (
-                db.query(AssignmentSubmission)
-                .filter(
-                    AssignmentSubmission.assignment_id == assignment.id,
-                    AssignmentSubmission.student_id == current_user.id,
-                )
-                .first()
-            )
         submission_count = None
         graded_count = None
-        if current_user and can_manage_messages(current_user):
-            submission_count = (
-                db.query(AssignmentSubmission)
-                .filter(AssignmentSubmission.assignment_id == assignment.id)
-                .count()
-            )
-            graded_count = (
-                db.query(AssignmentSubmission)
-                .filter(
-                    AssignmentSubmission.assignment_id == assignment.id,
-                    AssignmentSubmission.rating.isnot(None),
-                )
-                .count()
-            )
+        if counts is not None:
+            submission_count, graded_count = counts.get(assignment.id, (0, 0))
         results.append(
             serialize_assignment_payload(
                 assignment,
-                submission=submission,
+                submission=submissions.get(assignment.id),
                 submission_count=submission_count,
                 graded_count=graded_count,
             )
@@ -1362,7 +2732,14 @@ def create_lesson_assignment(
     publish_assignment_event(
         lesson.id,
         "assignment_created",
-        {"assignment_id": assignment.id},
+        managers={
+            "assignment_id": assignment.id,
+            "assignment": serialize_assignment_payload(assignment, submission_count=0, graded_count=0),
+        },
+        others={
+            "assignment_id": assignment.id,
+            "assignment": serialize_assignment_payload(assignment),
+        },
     )
     return serialize_assignment_payload(assignment)
 
@@ -1412,12 +2789,22 @@ def create_lesson_assignments_bulk(
     db.commit()
     for assignment in created:
         db.refresh(assignment)
+    assignment_ids = [assignment.id for assignment in created]
     publish_assignment_event(
         lesson.id,
         "assignment_bulk_created",
-        {
-            "assignment_ids": [assignment.id for assignment in created],
+        managers={
+            "assignment_ids": assignment_ids,
             "count": len(created),
+            "assignments": [
+                serialize_assignment_payload(assignment, submission_count=0, graded_count=0)
+                for assignment in created
+            ],
+        },
+        others={
+            "assignment_ids": assignment_ids,
+            "count": len(created),
+            "assignments": [serialize_assignment_payload(assignment) for assignment in created],
         },
     )
     return [serialize_assignment_payload(assignment) for assignment in created]
@@ -1499,13 +2886,26 @@ def submit_assignment(
         db.add(submission)
     db.commit()
     db.refresh(submission)
+    submission_payload = serialize_submission(submission)
+    submission_count, graded_count = assignment_submission_counts(db, assignment.id)
     publish_assignment_event(
         lesson.id,
         "submission_updated",
-        {
+        managers={
             "assignment_id": assignment.id,
             "submission_id": submission.id,
             "student_id": current_user.id,
+            "submission": submission_payload,
+            "submission_count": submission_count,
+            "graded_count": graded_count,
+        },
+        users={
+            current_user.id: {
+                "assignment_id": assignment.id,
+                "submission_id": submission.id,
+                "student_id": current_user.id,
+                "submission": submission_payload,
+            },
         },
     )
     return serialize_submission(submission)
@@ -1565,17 +2965,31 @@ def grade_submission(
     submission.graded_at = datetime.now(timezone.utc)
     db.commit()
     db.refresh(submission)
+    submission_payload = serialize_submission(submission)
+    submission_count, graded_count = assignment_submission_counts(db, assignment.id)
     publish_assignment_event(
         assignment.lesson_id,
         "grade_updated",
-        {
+        managers={
             "assignment_id": assignment.id,
             "submission_id": submission.id,
             "student_id": submission.student_id,
             "rating": submission.rating,
+            "submission": submission_payload,
+            "submission_count": submission_count,
+            "graded_count": graded_count,
+        },
+        users={
+            submission.student_id: {
+                "assignment_id": assignment.id,
+                "submission_id": submission.id,
+                "student_id": submission.student_id,
+                "rating": submission.rating,
+                "submission": submission_payload,
+            },
         },
     )
-    return serialize_submission(submission)
+    return submission_payload
 
 
 @app.post("/lessons/{lesson_id}/messages/upload")
@@ -1600,22 +3014,83 @@ async def upload_lesson_message_file(
 @app.get("/lessons/{lesson_id}/messages", response_model=list[LessonMessageOut])
 def list_lesson_messages(
     lesson_id: int,
+    response: Response,
+    limit: int = Query(LESSON_MESSAGE_PAGE_SIZE, ge=1, le=LESSON_MESSAGE_PAGE_MAX),
+    before_id: int | None = Query(None),
+    after_id: int | None = Query(None),
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db),
 ):
+    if before_id is not None and after_id is not None:
+        raise HTTPException(status_code=400, detail="Use either before_id or after_id")
     lesson = db.query(CourseLesson).filter(CourseLesson.id == lesson_id).first()
     if not lesson:
         raise HTTPException(status_code=404, detail="Lesson not found")
     _, locked = lesson_access(db, current_user, lesson)
     if locked:
         raise HTTPException(status_code=403, detail="Lesson locked")
+    # Read before the page so the watermark never runs ahead of what was sent.
+    response.headers["X-Message-Watermark"] = str(lesson_message_watermark(db, lesson.id))
+    messages = lesson_messages_page(db, lesson.id, limit, before_id, after_id)
+    return [serialize_message(message) for message in messages]
+
+
+@app.get("/lessons/{lesson_id}/messages/changes", response_model=LessonMessageChangesOut)
+def list_lesson_message_changes(
+    lesson_id: int,
+    since: int = Query(0, ge=0),
+    limit: int = Query(LESSON_MESSAGE_PAGE_MAX, ge=1, le=LESSON_MESSAGE_PAGE_MAX),
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db),
+):
+    lesson = db.query(CourseLesson).filter(CourseLesson.id == lesson_id).first()
+    if not lesson:
+        raise HTTPException(status_code=404, detail="Lesson not found")
+    _, locked = lesson_access(db, current_user, lesson)
+    if locked:
+        raise HTTPException(status_code=403, detail="Lesson locked")
+    watermark = lesson_message_watermark(db, lesson.id)
+    if watermark <= since:
+        return {"messages": [], "deleted_ids": [], "watermark": max(watermark, since), "has_more": False}
+
     messages = (
         db.query(LessonMessage)
-        .filter(LessonMessage.lesson_id == lesson.id)
-        .order_by(LessonMessage.created_at.asc())
+        .options(selectinload(LessonMessage.user), selectinload(LessonMessage.attachment))
+        .filter(
+            LessonMessage.lesson_id == lesson.id,
+            LessonMessage.change_seq > since,
+            LessonMessage.change_seq <= watermark,
+        )
+        .order_by(LessonMessage.change_seq.asc())
+        .limit(limit + 1)
         .all()
     )
-    return [serialize_message(message) for message in messages]
+    tombstones = (
+        db.query(LessonMessageTombstone.message_id, LessonMessageTombstone.change_seq)
+        .filter(
+            LessonMessageTombstone.lesson_id == lesson.id,
+            LessonMessageTombstone.change_seq > since,
+            LessonMessageTombstone.change_seq <= watermark,
+        )
+        .order_by(LessonMessageTombstone.change_seq.asc())
+        .limit(limit + 1)
+        .all()
+    )
+    changes = sorted(
+        [(message.change_seq, message) for message in messages]
+        + [(change_seq, message_id) for message_id, change_seq in tombstones],
+        key=lambda item: item[0],
+    )
+    has_more = len(changes) > limit
+    if has_more:
+        changes = changes[:limit]
+        watermark = changes[-1][0]
+    return {
+        "messages": [serialize_message(item) for _, item in changes if isinstance(item, LessonMessage)],
+        "deleted_ids": [item for _, item in changes if not isinstance(item, LessonMessage)],
+        "watermark": watermark,
+        "has_more": has_more,
+    }
 
 
 @app.post("/lessons/{lesson_id}/messages", response_model=LessonMessageOut)
@@ -1643,6 +3118,7 @@ def send_lesson_message(
         sender="user",
         content=content,
     )
+    stamp_lesson_message_change(db, message)
     db.add(message)
     db.flush()
     upsert_message_attachment(db, message, payload)
@@ -1673,7 +3149,9 @@ def send_lesson_message(
             )
         )
     db.commit()
-    return serialize_message(message)
+    payload = serialize_message(message)
+    publish_lesson_message_event(lesson.id, "message_created", message.change_seq, {"message": payload})
+    return payload
 
 @app.post("/lessons/{lesson_id}/teacher/messages", response_model=LessonMessageOut)
 def send_teacher_message(
@@ -1699,12 +3177,15 @@ def send_teacher_message(
         sender="teacher",
         content=content,
     )
+    stamp_lesson_message_change(db, message)
     db.add(message)
     db.flush()
     upsert_message_attachment(db, message, payload)
     db.commit()
     db.refresh(message)
-    return serialize_message(message)
+    payload = serialize_message(message)
+    publish_lesson_message_event(lesson.id, "message_created", message.change_seq, {"message": payload})
+    return payload
 
 
 @app.put("/lessons/{lesson_id}/messages/{message_id}", response_model=LessonMessageOut)
@@ -1731,9 +3212,12 @@ def update_lesson_message(
     if not can_manage_messages(current_user) and message.user_id != current_user.id:
         raise HTTPException(status_code=403, detail="No permission to edit")
     message.content = payload.content
+    stamp_lesson_message_change(db, message)
     db.commit()
     db.refresh(message)
-    return serialize_message(message)
+    payload = serialize_message(message)
+    publish_lesson_message_event(lesson.id, "message_updated", message.change_seq, {"message": payload})
+    return payload
 
 
 @app.delete("/lessons/{lesson_id}/messages/{message_id}")
@@ -1758,8 +3242,15 @@ def delete_lesson_message(
         raise HTTPException(status_code=404, detail="Message not found")
     if not can_manage_messages(current_user) and message.user_id != current_user.id:
         raise HTTPException(status_code=403, detail="No permission to delete")
+    tombstone = record_lesson_message_deletion(db, message)
     db.delete(message)
     db.commit()
+    publish_lesson_message_event(
+        lesson.id,
+        "message_deleted",
+        tombstone.change_seq,
+        {"message_id": message_id},
+    )
     return {"status": "ok"}
 
 
@@ -1950,6 +3441,20 @@ async def upload_private_chat_file(
     return await store_chat_upload(file, request)
 
 
+@app.get("/admin/realtime/stats")
+def realtime_stats(current_user: User = Depends(get_current_user)):
+    if not user_has_role(current_user, "admin"):
+        raise HTTPException(status_code=403, detail="Admin only")
+    return {
+        "private_chats": private_chat_socket_hub.stats(),
+        "private_threads": private_thread_socket_hub.stats(),
+        "assignments": assignment_socket_hub.stats(),
+        "lesson_messages": lesson_message_socket_hub.stats(),
+        "event_queue": socket_event_queue.stats(),
+        "event_bus": realtime_bus.stats(),
+    }
+
+
 @app.websocket("/ws/lessons/{lesson_id}/assignments")
 async def assignments_socket(
     websocket: WebSocket,
@@ -1975,13 +3480,18 @@ async def assignments_socket(
             return
 
         connected_lesson_id = lesson.id
-        await assignment_socket_hub.connect(lesson.id, websocket)
-        await websocket.send_json({"event": "connected", "lesson_id": lesson.id})
+        await assignment_socket_hub.connect(
+            lesson.id,
+            websocket,
+            user_id=user.id,
+            is_manager=can_manage_messages(user),
+        )
+        await assignment_socket_hub.send(lesson.id, websocket, {"event": "connected", "lesson_id": lesson.id})
 
         while True:
             payload = await websocket.receive_text()
             if payload.strip().lower() == "ping":
-                await websocket.send_json({"event": "pong"})
+                await assignment_socket_hub.send(lesson.id, websocket, {"event": "pong"})
     except WebSocketDisconnect:
         pass
     except Exception:
@@ -1994,6 +3504,58 @@ async def assignments_socket(
         db.close()
 
 
+@app.websocket("/ws/lessons/{lesson_id}/messages")
+async def lesson_messages_socket(
+    websocket: WebSocket,
+    lesson_id: int,
+    token: str = Query(default=""),
+):
+    db = SessionLocal()
+    connected_lesson_id = lesson_id
+    try:
+        user = get_user_by_ws_token(db, token)
+        if not user:
+            await websocket.close(code=4401)
+            return
+
+        lesson = db.query(CourseLesson).filter(CourseLesson.id == lesson_id).first()
+        if not lesson:
+            await websocket.close(code=4404)
+            return
+
+        _, locked = lesson_access(db, user, lesson)
+        if locked and not can_manage_messages(user):
+            await websocket.close(code=4403)
+            return
+
+        connected_lesson_id = lesson.id
+        watermark = lesson_message_watermark(db, lesson.id)
+        # Group chat sockets live long and are numerous; do not hold a pooled
+        # connection for the lifetime of each one.
+        db.close()
+        await lesson_message_socket_hub.connect(lesson.id, websocket)
+        await lesson_message_socket_hub.send(
+            lesson.id,
+            websocket,
+            {"event": "connected", "lesson_id": lesson.id, "watermark": watermark},
+        )
+
+        while True:
+            payload = await websocket.receive_text()
+            if payload.strip().lower() == "ping":
+                await lesson_message_socket_hub.send(lesson.id, websocket, {"event": "pong"})
+    except WebSocketDisconnect:
+        pass
+    except Exception:
+        try:
+            await websocket.close(code=1011)
+        except Exception:
+            pass
+    finally:
+        lesson_message_socket_hub.disconnect(connected_lesson_id, websocket)
+        db.close()
+
+
 @app.websocket("/ws/lessons/{lesson_id}/private-threads")
 async def private_thread_socket(
     websocket: WebSocket,
@@ -2018,12 +3580,12 @@ async def private_thread_socket(
 
         connected_lesson_id = lesson.id
         await private_thread_socket_hub.connect(lesson.id, websocket)
-        await websocket.send_json({"event": "connected", "lesson_id": lesson.id})
+        await private_thread_socket_hub.send(lesson.id, websocket, {"event": "connected", "lesson_id": lesson.id})
 
         while True:
             payload = await websocket.receive_text()
             if payload.strip().lower() == "ping":
-                await websocket.send_json({"event": "pong"})
+                await private_thread_socket_hub.send(lesson.id, websocket, {"event": "pong"})
     except WebSocketDisconnect:
         pass
     except Exception:
@@ -2060,12 +3622,12 @@ async def private_chat_socket(
 
         connected_chat_id = chat.id
         await private_chat_socket_hub.connect(chat.id, websocket)
-        await websocket.send_json({"event": "connected", "chat_id": chat.id})
+        await private_chat_socket_hub.send(chat.id, websocket, {"event": "connected", "chat_id": chat.id})
 
         while True:
             payload = await websocket.receive_text()
             if payload.strip().lower() == "ping":
-                await websocket.send_json({"event": "pong"})
+                await private_chat_socket_hub.send(chat.id, websocket, {"event": "pong"})
     except WebSocketDisconnect:
         pass
     except Exception:
@@ -2295,7 +3857,7 @@ def checkout_course(
     order = PaymentOrder(
         user_id=current_user.id,
         course_id=course_id,
-        amount_cents=parse_price_to_cents(course.price),
+        amount_cents=course.price_cents if course.price_cents is not None else parse_price_to_cents(course.price),
         currency="USD",
         provider="mock",
         status="paid",
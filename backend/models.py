@@ -1,10 +1,18 @@
-from sqlalchemy import Column, Integer, String, DateTime, Boolean, func, Table, ForeignKey, UniqueConstraint, Text, Float
+from datetime import datetime, timezone
+
+from sqlalchemy import Column, Integer, String, DateTime, Boolean, func, Table, ForeignKey, UniqueConstraint, Text, Float, Index, literal_column
 from sqlalchemy.orm import relationship
 from sqlalchemy.types import JSON
 
 from database import Base
 
 
+def version_column():
+    # Incremented in SQL by every UPDATE of the row; read into ETags only, so
+    # concurrent writers are not rejected the way version_id_col would.
+    return Column(Integer, nullable=False, default=1, onupdate=literal_column("version + 1"))
+
+
 user_roles = Table(
     "user_roles",
     Base.metadata,
@@ -21,10 +29,17 @@ class User(Base):
     username = Column(String(255), unique=True, index=True, nullable=False)
     hashed_password = Column(String(255), nullable=False)
     is_active = Column(Boolean, default=True)
+    role_version = Column(Integer, nullable=False, default=0)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     roles = relationship("Role", secondary=user_roles, back_populates="users")
     course_purchases = relationship("CoursePurchase", back_populates="user")
 
+    # Login and instructor resolution match case-insensitively.
+    __table_args__ = (
+        Index("ix_users_username_lower", func.lower(username)),
+        Index("ix_users_email_lower", func.lower(email)),
+    )
+
 
 class Role(Base):
     __tablename__ = "roles"
@@ -67,9 +82,24 @@ class Course(Base):
     students = Column(String(64), nullable=True)
     language = Column(String(64), nullable=True)
     code_samples = Column(JSON, default=list)
+    price_cents = Column(Integer, nullable=True)
+    old_price_cents = Column(Integer, nullable=True)
+    sort_rating = Column(Float, nullable=True)
+    # Set client-side so keyset cursors round-trip the exact stored value on every backend.
+    created_at = Column(DateTime(timezone=True), default=lambda: datetime.now(timezone.utc))
+    version = version_column()
 
     lessons = relationship("CourseLesson", back_populates="course", cascade="all, delete-orphan")
 
+    __table_args__ = (
+        Index("ix_courses_category", "category"),
+        Index("ix_courses_level", "level"),
+        Index("ix_courses_language", "language"),
+        Index("ix_courses_sort_rating_id", "sort_rating", "id"),
+        Index("ix_courses_price_cents_id", "price_cents", "id"),
+        Index("ix_courses_created_at_id", "created_at", "id"),
+    )
+
 
 class CourseRating(Base):
     __tablename__ = "course_ratings"
@@ -89,11 +119,27 @@ class CourseRating(Base):
     )
 
 
+class CourseRatingStats(Base):
+    __tablename__ = "course_rating_stats"
+
+    course_id = Column(String(255), ForeignKey("courses.id"), primary_key=True)
+    rating_sum = Column(Integer, nullable=False, default=0)
+    rating_count = Column(Integer, nullable=False, default=0)
+    star_1 = Column(Integer, nullable=False, default=0)
+    star_2 = Column(Integer, nullable=False, default=0)
+    star_3 = Column(Integer, nullable=False, default=0)
+    star_4 = Column(Integer, nullable=False, default=0)
+    star_5 = Column(Integer, nullable=False, default=0)
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+    version = version_column()
+
+
 class TeacherRating(Base):
     __tablename__ = "teacher_ratings"
 
     id = Column(Integer, primary_key=True, index=True)
     teacher_name = Column(String(255), nullable=False)
+    teacher_key = Column(String(255), nullable=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
     rating = Column(Integer, nullable=False)
     review = Column(Text, nullable=True)
@@ -101,11 +147,28 @@ class TeacherRating(Base):
 
     user = relationship("User")
 
+    # One vote per user and teacher however the name was spelled; created at
+    # startup for existing databases once duplicates are merged.
     __table_args__ = (
-        UniqueConstraint("user_id", "teacher_name", name="uq_teacher_rating"),
+        Index("uq_teacher_ratings_user_teacher_key", "user_id", "teacher_key", unique=True),
     )
 
 
+class TeacherRatingStats(Base):
+    __tablename__ = "teacher_rating_stats"
+
+    teacher_key = Column(String(255), primary_key=True)
+    rating_sum = Column(Integer, nullable=False, default=0)
+    rating_count = Column(Integer, nullable=False, default=0)
+    star_1 = Column(Integer, nullable=False, default=0)
+    star_2 = Column(Integer, nullable=False, default=0)
+    star_3 = Column(Integer, nullable=False, default=0)
+    star_4 = Column(Integer, nullable=False, default=0)
+    star_5 = Column(Integer, nullable=False, default=0)
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+    version = version_column()
+
+
 class CourseLesson(Base):
     __tablename__ = "course_lessons"
 
@@ -117,6 +180,7 @@ class CourseLesson(Base):
     video_url = Column(String(1024), nullable=True)
     position = Column(Integer, nullable=False, default=0)
     is_free = Column(Boolean, default=False)
+    version = version_column()
 
     course = relationship("Course", back_populates="lessons")
 
@@ -130,6 +194,7 @@ class LessonSlide(Base):
     image_url = Column(String(1024), nullable=True)
     content = Column(Text, nullable=True)
     position = Column(Integer, default=0)
+    version = version_column()
 
     lesson = relationship("CourseLesson")
 
@@ -142,6 +207,7 @@ class LessonResource(Base):
     title = Column(String(255), nullable=False)
     url = Column(String(1024), nullable=False)
     kind = Column(String(64), nullable=False)
+    version = version_column()
 
     lesson = relationship("CourseLesson")
 
@@ -190,6 +256,9 @@ class LessonMessage(Base):
     sender = Column(String(32), default="user")
     content = Column(Text, nullable=False)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
+    version = version_column()
+    # Per-lesson change counter stamped on create and edit; see LessonMessageSequence.
+    change_seq = Column(Integer, nullable=True)
 
     lesson = relationship("CourseLesson")
     user = relationship("User")
@@ -200,6 +269,32 @@ class LessonMessage(Base):
         cascade="all, delete-orphan",
     )
 
+    __table_args__ = (
+        Index("ix_lesson_messages_lesson_created_id", "lesson_id", "created_at", "id"),
+        Index("ix_lesson_messages_lesson_change_seq", "lesson_id", "change_seq"),
+    )
+
+
+class LessonMessageSequence(Base):
+    __tablename__ = "lesson_message_sequences"
+
+    lesson_id = Column(Integer, ForeignKey("course_lessons.id", ondelete="CASCADE"), primary_key=True)
+    last_seq = Column(Integer, nullable=False, default=0)
+
+
+class LessonMessageTombstone(Base):
+    __tablename__ = "lesson_message_tombstones"
+
+    id = Column(Integer, primary_key=True, index=True)
+    lesson_id = Column(Integer, ForeignKey("course_lessons.id", ondelete="CASCADE"), nullable=False)
+    message_id = Column(Integer, nullable=False)
+    change_seq = Column(Integer, nullable=False)
+    deleted_at = Column(DateTime(timezone=True), server_default=func.now())
+
+    __table_args__ = (
+        Index("ix_lesson_message_tombstones_lesson_change_seq", "lesson_id", "change_seq"),
+    )
+
 
 class LessonMessageAttachment(Base):
     __tablename__ = "lesson_message_attachments"
@@ -321,6 +416,47 @@ class EmailOTP(Base):
     created_at = Column(DateTime(timezone=True), server_default=func.now())
 
 
+class EmailOutbox(Base):
+    __tablename__ = "email_outbox"
+
+    id = Column(Integer, primary_key=True, index=True)
+    recipient = Column(String(255), nullable=False)
+    subject = Column(String(255), nullable=False)
+    body = Column(Text, nullable=True)
+    status = Column(String(20), nullable=False, default="pending")
+    attempts = Column(Integer, nullable=False, default=0)
+    next_attempt_at = Column(DateTime(timezone=True), nullable=False)
+    last_error = Column(Text, nullable=True)
+    sent_at = Column(DateTime(timezone=True), nullable=True)
+    # HMAC of the random token handed to the requester for status polling.
+    delivery_token_hash = Column(String(64), unique=True, index=True, nullable=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+    __table_args__ = (
+        Index("ix_email_outbox_status_next_attempt", "status", "next_attempt_at"),
+    )
+
+
+class RealtimeEventPayload(Base):
+    __tablename__ = "realtime_event_payloads"
+
+    id = Column(Integer, primary_key=True, index=True)
+    payload = Column(Text, nullable=False)
+    created_at = Column(DateTime(timezone=True), server_default=func.now(), index=True)
+
+
+class RefreshToken(Base):
+    __tablename__ = "refresh_tokens"
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False, index=True)
+    token_hash = Column(String(64), unique=True, index=True, nullable=False)
+    family_id = Column(String(32), index=True, nullable=False)
+    expires_at = Column(DateTime(timezone=True), nullable=False)
+    revoked_at = Column(DateTime(timezone=True), nullable=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+
 class PaymentOrder(Base):
     __tablename__ = "payment_orders"
 
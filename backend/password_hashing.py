@@ -0,0 +1,113 @@
+import asyncio
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from passlib.context import CryptContext
+
+pwd_context = CryptContext(schemes=["pbkdf2_sha256"], deprecated="auto")
+
+
+def _hash_password(password: str) -> str:
+    return pwd_context.hash(password)
+
+
+def _verify_password(plain_password: str, hashed_password: str) -> bool:
+    return pwd_context.verify(plain_password, hashed_password)
+
+
+class PasswordHasherBusy(Exception):
+    def __init__(self, retry_after: int) -> None:
+        super().__init__("Password hashing queue is full")
+        self.retry_after = retry_after
+
+
+class PasswordHasher:
+    """Runs PBKDF2 hashing on a dedicated process pool with a bounded queue.
+
+    At most ``workers + queue_size`` jobs are admitted at a time; further
+    calls raise ``PasswordHasherBusy`` immediately instead of waiting, so a
+    login burst cannot pile up behind the pool. Workers are started with
+    ``spawn`` on first use and only import this module.
+    """
+
+    def __init__(self, workers: int, queue_size: int, retry_after: int = 1) -> None:
+        self.workers = max(1, workers)
+        self.capacity = self.workers + max(0, queue_size)
+        self.retry_after = retry_after
+        self.pending = 0
+        self._executor: ProcessPoolExecutor | None = None
+        self._lock = threading.Lock()
+
+    def _submit(self, fn, *args):
+        with self._lock:
+            if self.pending >= self.capacity:
+                raise PasswordHasherBusy(self.retry_after)
+            self.pending += 1
+        for attempt in range(2):
+            executor = self._get_executor()
+            try:
+                future = executor.submit(fn, *args)
+            except BrokenProcessPool:
+                # A worker died since the last job; replace the pool once.
+                self._reset(executor)
+                if attempt:
+                    self._release(None)
+                    raise PasswordHasherBusy(self.retry_after) from None
+                continue
+            except BaseException:
+                self._release(None)
+                raise
+            future.add_done_callback(self._release)
+            return future, executor
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                )
+            return self._executor
+
+    def _reset(self, executor: ProcessPoolExecutor) -> None:
+        # A broken pool rejects every later job, so it is dropped and the
+        # next call starts a fresh one.
+        with self._lock:
+            if self._executor is not executor:
+                return
+            self._executor = None
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    def _release(self, future) -> None:
+        with self._lock:
+            self.pending -= 1
+
+    async def _run(self, fn, *args):
+        future, executor = self._submit(fn, *args)
+        try:
+            return await asyncio.wrap_future(future)
+        except BrokenProcessPool:
+            self._reset(executor)
+            raise PasswordHasherBusy(self.retry_after) from None
+
+    async def hash(self, password: str) -> str:
+        return await self._run(_hash_password, password)
+
+    async def verify(self, plain_password: str, hashed_password: str) -> bool:
+        return await self._run(_verify_password, plain_password, hashed_password)
+
+    def hash_sync(self, password: str) -> str:
+        future, executor = self._submit(_hash_password, password)
+        try:
+            return future.result()
+        except BrokenProcessPool:
+            self._reset(executor)
+            raise PasswordHasherBusy(self.retry_after) from None
+
+    def shutdown(self) -> None:
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True, cancel_futures=True)
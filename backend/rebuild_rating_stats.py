@@ -0,0 +1,22 @@
+"""Recompute rating aggregate tables from the raw rating rows.
+
+Run from the backend directory: ``python rebuild_rating_stats.py``.
+"""
+
+from database import SessionLocal
+from main import rebuild_course_rating_stats, rebuild_teacher_rating_stats
+
+
+def main() -> None:
+    db = SessionLocal()
+    try:
+        course_count = rebuild_course_rating_stats(db)
+        teacher_count = rebuild_teacher_rating_stats(db)
+    finally:
+        db.close()
+    print(f"course_rating_stats: {course_count} rows")
+    print(f"teacher_rating_stats: {teacher_count} rows")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,6 @@
 from datetime import datetime
 from pydantic import BaseModel, EmailStr
-from typing import List, Optional
+from typing import Dict, List, Optional
 
 
 class UserCreate(BaseModel):
@@ -19,6 +19,17 @@ class UserLogin(BaseModel):
 class Token(BaseModel):
     access_token: str
     token_type: str = "bearer"
+    refresh_token: Optional[str] = None
+
+
+class RefreshTokenRequest(BaseModel):
+    refresh_token: str
+
+
+class EmailDeliveryOut(BaseModel):
+    status: str
+    attempts: int
+    sent_at: Optional[datetime] = None
 
 
 class UserOut(BaseModel):
@@ -72,6 +83,23 @@ class CourseOut(BaseModel):
     is_purchased: Optional[bool] = None
 
 
+class CoursePage(BaseModel):
+    items: List[CourseOut]
+    next_cursor: Optional[str] = None
+
+
+class CourseSearchOut(BaseModel):
+    items: List[CourseOut]
+    total: int
+    facets: Dict[str, Dict[str, int]] = {}
+
+
+class CourseSuggestionOut(BaseModel):
+    text: str
+    kind: str
+    course_id: Optional[str] = None
+
+
 class PaymentOut(BaseModel):
     id: int
     course_id: str
@@ -159,6 +187,13 @@ class LessonMessageOut(BaseModel):
         from_attributes = True
 
 
+class LessonMessageChangesOut(BaseModel):
+    messages: list[LessonMessageOut] = []
+    deleted_ids: list[int] = []
+    watermark: int
+    has_more: bool = False
+
+
 class PrivateChatThreadOut(BaseModel):
     id: int
     lesson_id: int
@@ -0,0 +1,275 @@
+import math
+import re
+import threading
+from bisect import bisect_left, insort
+from collections import Counter
+
+TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+
+def tokenize(text: str | None) -> list[str]:
+    if not text:
+        return []
+    return TOKEN_RE.findall(text.lower())
+
+
+class SearchDocument:
+    __slots__ = ("doc_id", "version", "length", "terms", "facets")
+
+    def __init__(self, doc_id: str, version: int, length: float, terms: dict[str, float], facets: dict[str, str]):
+        self.doc_id = doc_id
+        self.version = version
+        self.length = length
+        self.terms = terms
+        self.facets = facets
+
+
+class SearchIndex:
+    """In-memory inverted index with BM25 ranking, prefix matching and facet counts.
+
+    Fields are weighted by multiplying their term frequencies (a simplified
+    BM25F), so a title hit counts more than a summary hit. Every query term
+    also matches indexed terms that start with it; those expansions score at
+    ``prefix_weight`` of an exact match.
+    """
+
+    def __init__(
+        self,
+        field_weights: dict[str, float],
+        k1: float = 1.2,
+        b: float = 0.75,
+        prefix_weight: float = 0.5,
+        max_prefix_expansions: int = 50,
+    ) -> None:
+        self.field_weights = field_weights
+        self.k1 = k1
+        self.b = b
+        self.prefix_weight = prefix_weight
+        self.max_prefix_expansions = max_prefix_expansions
+        self.documents: dict[str, SearchDocument] = {}
+        self.postings: dict[str, dict[str, float]] = {}
+        self.total_length = 0.0
+        self._sorted_terms: list[str] | None = []
+        self._lock = threading.RLock()
+
+    def __len__(self) -> int:
+        return len(self.documents)
+
+    def versions(self) -> dict[str, int]:
+        with self._lock:
+            return {doc_id: doc.version for doc_id, doc in self.documents.items()}
+
+    def upsert(self, doc_id: str, fields: dict[str, str], facets: dict[str, str], version: int = 0) -> None:
+        terms: Counter = Counter()
+        length = 0.0
+        for field, weight in self.field_weights.items():
+            for token in tokenize(fields.get(field)):
+                terms[token] += weight
+                length += weight
+        document = SearchDocument(doc_id, version, length, dict(terms), facets)
+        with self._lock:
+            self._remove_locked(doc_id)
+            self.documents[doc_id] = document
+            self.total_length += length
+            for term, frequency in document.terms.items():
+                posting = self.postings.get(term)
+                if posting is None:
+                    posting = self.postings[term] = {}
+                    self._sorted_terms = None
+                posting[doc_id] = frequency
+
+    def remove(self, doc_id: str) -> None:
+        with self._lock:
+            self._remove_locked(doc_id)
+
+    def _remove_locked(self, doc_id: str) -> None:
+        document = self.documents.pop(doc_id, None)
+        if not document:
+            return
+        self.total_length -= document.length
+        for term in document.terms:
+            posting = self.postings.get(term)
+            if posting is None:
+                continue
+            posting.pop(doc_id, None)
+            if not posting:
+                del self.postings[term]
+                self._sorted_terms = None
+
+    def _expand(self, token: str) -> list[tuple[str, float]]:
+        if self._sorted_terms is None:
+            self._sorted_terms = sorted(self.postings)
+        expansions = []
+        if token in self.postings:
+            expansions.append((token, 1.0))
+        start = bisect_left(self._sorted_terms, token)
+        for term in self._sorted_terms[start:]:
+            if not term.startswith(token) or len(expansions) >= self.max_prefix_expansions:
+                break
+            if term != token:
+                expansions.append((term, self.prefix_weight))
+        return expansions
+
+    def search(
+        self,
+        query: str,
+        filters: dict[str, str | None] | None = None,
+        limit: int = 20,
+        offset: int = 0,
+    ) -> tuple[list[tuple[str, float]], int, dict[str, dict[str, int]]]:
+        """Return ``(page of (doc_id, score), total matches, facet counts)``.
+
+        Facet counts are taken over all documents matching the query before
+        facet filters are applied, so clients can show alternative values.
+        Every query term has to match (AND semantics).
+        """
+        tokens = list(dict.fromkeys(tokenize(query)))
+        active_filters = {key: value for key, value in (filters or {}).items() if value}
+        with self._lock:
+            if not tokens or not self.documents:
+                return [], 0, {}
+            doc_count = len(self.documents)
+            avg_length = self.total_length / doc_count or 1.0
+            scores: dict[str, float] | None = None
+            for token in tokens:
+                token_scores: dict[str, float] = {}
+                for term, weight in self._expand(token):
+                    posting = self.postings[term]
+                    idf = math.log(1 + (doc_count - len(posting) + 0.5) / (len(posting) + 0.5))
+                    for doc_id, frequency in posting.items():
+                        length = self.documents[doc_id].length
+                        norm = frequency + self.k1 * (1 - self.b + self.b * length / avg_length)
+                        score = weight * idf * frequency * (self.k1 + 1) / norm
+                        if score > token_scores.get(doc_id, 0.0):
+                            token_scores[doc_id] = score
+                if scores is None:
+                    scores = token_scores
+                else:
+                    scores = {
+                        doc_id: score + token_scores[doc_id]
+                        for doc_id, score in scores.items()
+                        if doc_id in token_scores
+                    }
+                if not scores:
+                    return [], 0, {}
+
+            facets: dict[str, dict[str, int]] = {}
+            matches = []
+            for doc_id, score in scores.items():
+                document_facets = self.documents[doc_id].facets
+                for name, value in document_facets.items():
+                    if value:
+                        bucket = facets.setdefault(name, {})
+                        bucket[value] = bucket.get(value, 0) + 1
+                if all(document_facets.get(name) == value for name, value in active_filters.items()):
+                    matches.append((doc_id, score))
+
+        matches.sort(key=lambda item: (-item[1], item[0]))
+        return matches[offset:offset + limit], len(matches), facets
+
+
+class PrefixSuggester:
+    """Sorted-array autocomplete over course titles and instructor names.
+
+    Each title is indexed from the start of each of its first
+    ``max_word_starts`` words, so typing any leading word of a title
+    matches. Keys are truncated to ``max_key_length`` characters and
+    instructor names are stored once however many courses share them,
+    which keeps memory linear in the number of courses. Small updates are
+    applied with ``insort``; large batches re-sort the array once.
+    """
+
+    def __init__(self, max_key_length: int = 64, max_word_starts: int = 6, bulk_threshold: int = 256) -> None:
+        self.max_key_length = max_key_length
+        self.max_word_starts = max_word_starts
+        self.bulk_threshold = bulk_threshold
+        self.entries: list[tuple[str, str, str, str | None]] = []
+        self.doc_entries: dict[str, list[tuple[str, str, str, str | None]]] = {}
+        self.instructor_refs: dict[tuple[str, str, str, str | None], int] = {}
+        self._lock = threading.RLock()
+
+    def _key(self, text: str | None) -> str:
+        return " ".join(tokenize(text))[: self.max_key_length]
+
+    def _build_entries(self, doc_id: str, title: str, instructor: str | None) -> list[tuple[str, str, str, str | None]]:
+        words = tokenize(title)
+        entries = []
+        for start in range(min(len(words), self.max_word_starts)):
+            key = " ".join(words[start:])[: self.max_key_length]
+            entries.append((key, "course", title, doc_id))
+        instructor_key = self._key(instructor)
+        if instructor_key:
+            entries.append((instructor_key, "instructor", instructor.strip(), None))
+        return entries
+
+    def _insert(self, entry: tuple[str, str, str, str | None], apply: bool) -> None:
+        if entry[1] == "instructor":
+            refs = self.instructor_refs.get(entry, 0)
+            self.instructor_refs[entry] = refs + 1
+            if refs:
+                return
+        if apply:
+            insort(self.entries, entry)
+
+    def _discard(self, entry: tuple[str, str, str, str | None], apply: bool) -> None:
+        if entry[1] == "instructor":
+            refs = self.instructor_refs.get(entry, 0) - 1
+            if refs > 0:
+                self.instructor_refs[entry] = refs
+                return
+            self.instructor_refs.pop(entry, None)
+        if apply:
+            position = bisect_left(self.entries, entry)
+            if position < len(self.entries) and self.entries[position] == entry:
+                del self.entries[position]
+
+    def upsert_many(self, documents: list[tuple[str, str, str | None]]) -> None:
+        with self._lock:
+            apply = len(documents) < self.bulk_threshold
+            for doc_id, title, instructor in documents:
+                for entry in self.doc_entries.pop(doc_id, []):
+                    self._discard(entry, apply)
+                entries = self._build_entries(doc_id, title, instructor)
+                for entry in entries:
+                    self._insert(entry, apply)
+                self.doc_entries[doc_id] = entries
+            if not apply:
+                self._rebuild_locked()
+
+    def upsert(self, doc_id: str, title: str, instructor: str | None) -> None:
+        self.upsert_many([(doc_id, title, instructor)])
+
+    def remove(self, doc_id: str) -> None:
+        with self._lock:
+            for entry in self.doc_entries.pop(doc_id, []):
+                self._discard(entry, True)
+
+    def _rebuild_locked(self) -> None:
+        entries = [
+            entry
+            for doc_entries in self.doc_entries.values()
+            for entry in doc_entries
+            if entry[1] == "course"
+        ]
+        entries.extend(self.instructor_refs)
+        entries.sort()
+        self.entries = entries
+
+    def suggest(self, prefix: str, limit: int = 10) -> list[dict]:
+        key = self._key(prefix)
+        if not key:
+            return []
+        results = []
+        seen = set()
+        with self._lock:
+            position = bisect_left(self.entries, (key,))
+            while position < len(self.entries) and len(results) < limit:
+                entry_key, kind, text, doc_id = self.entries[position]
+                position += 1
+                if not entry_key.startswith(key):
+                    break
+                if (kind, doc_id, text) in seen:
+                    continue
+                seen.add((kind, doc_id, text))
+                results.append({"text": text, "kind": kind, "course_id": doc_id})
+        return results
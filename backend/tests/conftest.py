@@ -0,0 +1,47 @@
+import os
+import sys
+from pathlib import Path
+
+import pytest
+
+BACKEND_DIR = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(BACKEND_DIR))
+os.environ["DATABASE_URL"] = "sqlite://"
+
+import config  # noqa: E402
+
+if config.DATABASE_URL != "sqlite://":
+    pytest.exit("backend/.env overrides DATABASE_URL; refusing to run tests against it", returncode=2)
+
+
+@pytest.fixture(scope="session")
+def app_main():
+    import main
+
+    return main
+
+
+@pytest.fixture(scope="session")
+def client(app_main):
+    from fastapi.testclient import TestClient
+
+    with TestClient(app_main.app) as test_client:
+        # Background threads share the in-memory connection and would add
+        # their own statements to query counts.
+        app_main.email_outbox_worker.stop()
+        app_main.course_search_sync.stop()
+        yield test_client
+
+
+@pytest.fixture
+def count_queries(app_main):
+    from sqlalchemy import event
+
+    statements: list[str] = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(app_main.engine, "before_cursor_execute", before_cursor_execute)
+    yield statements
+    event.remove(app_main.engine, "before_cursor_execute", before_cursor_execute)
@@ -0,0 +1,48 @@
+import asyncio
+
+from event_bus import InProcessEventBus
+
+
+class FakeSocket:
+    def __init__(self) -> None:
+        self.sent: list[str] = []
+
+    async def accept(self) -> None:
+        pass
+
+    async def send_text(self, text: str) -> None:
+        self.sent.append(text)
+
+
+def _deliver_submission_event(app_main) -> dict[str, list[str]]:
+    hub = app_main.PrivateChatSocketHub("assignments", InProcessEventBus())
+    sockets = {name: FakeSocket() for name in ("submitting_teacher", "other_teacher", "student", "bystander")}
+
+    async def scenario() -> None:
+        await hub.connect(7, sockets["submitting_teacher"], user_id=1, is_manager=True)
+        await hub.connect(7, sockets["other_teacher"], user_id=2, is_manager=True)
+        await hub.connect(7, sockets["student"], user_id=3)
+        await hub.connect(7, sockets["bystander"], user_id=4)
+        submission = {"assignment_id": 9, "student_id": 1}
+        envelope = {
+            "managers": {"event": "submission_updated", **submission, "submission_count": 1},
+            "others": None,
+            "users": {"1": {"event": "submission_updated", **submission}},
+        }
+        await hub.bus.publish(hub.channel(7), app_main.encode_socket_payload(envelope))
+        await asyncio.sleep(0)
+        for socket in list(hub.connections[7]):
+            hub.disconnect(7, socket)
+        await asyncio.sleep(0)
+
+    asyncio.run(scenario())
+    return {name: socket.sent for name, socket in sockets.items()}
+
+
+def test_teacher_who_submits_still_gets_manager_counts(app_main):
+    sent = _deliver_submission_event(app_main)
+    assert len(sent["submitting_teacher"]) == 1
+    assert '"submission_count":1' in sent["submitting_teacher"][0]
+    assert sent["submitting_teacher"] == sent["other_teacher"]
+    assert sent["student"] == []
+    assert sent["bystander"] == []
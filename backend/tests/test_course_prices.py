@@ -0,0 +1,41 @@
+from database import SessionLocal
+from models import Course
+
+
+def test_price_backfill_processes_each_row_once(app_main, client, count_queries):
+    db = SessionLocal()
+    try:
+        for course_id, price, old_price in (
+            ("price-blank-old", "$12.50", ""),
+            ("price-unparseable", "Free", "n/a"),
+            ("price-regular", "$80", "$120"),
+        ):
+            db.add(
+                Course(
+                    id=course_id,
+                    title=course_id,
+                    image="/img.png",
+                    category="Testing",
+                    duration="1h",
+                    price=price,
+                    old_price=old_price,
+                    instructor="Price Tester",
+                    summary="Backfill test course.",
+                    topics=[],
+                    code_samples=[],
+                )
+            )
+        db.commit()
+
+        app_main.ensure_course_columns(db)
+        rows = {course.id: course for course in db.query(Course).filter(Course.id.like("price-%"))}
+        assert (rows["price-blank-old"].price_cents, rows["price-blank-old"].old_price) == (1250, None)
+        assert rows["price-blank-old"].old_price_cents is None
+        assert (rows["price-unparseable"].price_cents, rows["price-unparseable"].old_price_cents) == (0, 0)
+        assert (rows["price-regular"].price_cents, rows["price-regular"].old_price_cents) == (8000, 12000)
+
+        count_queries.clear()
+        app_main.ensure_course_columns(db)
+        assert not [statement for statement in count_queries if statement.lstrip().upper().startswith("UPDATE")]
+    finally:
+        db.close()
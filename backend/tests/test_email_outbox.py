@@ -0,0 +1,268 @@
+import os
+import socketserver
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import sessionmaker
+
+import email_outbox
+from database import SessionLocal
+from email_outbox import (
+    OUTBOX_PENDING,
+    OUTBOX_SENDING,
+    OUTBOX_SENT,
+    EmailOutboxWorker,
+    EmailTransport,
+    enqueue_email,
+)
+from models import EmailOutbox
+
+
+class StubSMTPHandler(socketserver.StreamRequestHandler):
+    def reply(self, line: str) -> None:
+        self.wfile.write(f"{line}\r\n".encode())
+
+    def handle(self) -> None:
+        server = self.server
+        with server.lock:
+            server.connections += 1
+        self.reply("220 stub ESMTP")
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line.decode().strip().upper()
+            if command.startswith("EHLO"):
+                self.reply("250-stub")
+                self.reply("250 AUTH PLAIN")
+            elif command.startswith("AUTH"):
+                self.reply("235 Authentication successful")
+            elif command.startswith(("MAIL", "RCPT", "RSET", "NOOP")):
+                self.reply("250 OK")
+            elif command == "DATA":
+                self.reply("354 End data with <CR><LF>.<CR><LF>")
+                lines = []
+                while True:
+                    data_line = self.rfile.readline()
+                    if data_line in (b".\r\n", b""):
+                        break
+                    lines.append(data_line)
+                if server.delay:
+                    time.sleep(server.delay)
+                with server.lock:
+                    failing = server.failures > 0
+                    if failing:
+                        server.failures -= 1
+                    else:
+                        server.messages.append(b"".join(lines).decode())
+                self.reply("451 Try again later" if failing else "250 Queued")
+            elif command == "QUIT":
+                self.reply("221 Bye")
+                return
+            else:
+                self.reply("502 Command not implemented")
+
+
+class StubSMTPServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self) -> None:
+        super().__init__(("127.0.0.1", 0), StubSMTPHandler)
+        self.lock = threading.Lock()
+        self.connections = 0
+        self.messages: list[str] = []
+        self.failures = 0
+        self.delay = 0.0
+
+    def recipients(self) -> list[str]:
+        return [line[4:] for message in self.messages for line in message.splitlines() if line.startswith("To: ")]
+
+
+@pytest.fixture
+def smtp_stub(monkeypatch):
+    server = StubSMTPServer()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    for name, value in {
+        "SMTP_HOST": "127.0.0.1",
+        "SMTP_PORT": server.server_address[1],
+        "SMTP_TLS": False,
+        "SMTP_FROM": "noreply@example.com",
+        "SMTP_USER": "user",
+        "SMTP_PASSWORD": "password",
+        "RESEND_API_KEY": None,
+    }.items():
+        monkeypatch.setattr(email_outbox, name, value)
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def outbox(client):
+    db = SessionLocal()
+    try:
+        db.query(EmailOutbox).delete()
+        db.commit()
+        yield db
+    finally:
+        db.close()
+
+
+def _worker(**options) -> EmailOutboxWorker:
+    return EmailOutboxWorker(EmailTransport(timeout=5), **options)
+
+
+def _enqueue(db, *recipients: str) -> list[int]:
+    messages = [enqueue_email(db, recipient, "Code", "123456") for recipient in recipients]
+    db.commit()
+    return [message.id for message in messages]
+
+
+def _aware(value: datetime) -> datetime:
+    # SQLite hands timezone-aware columns back naive.
+    return value if value.tzinfo else value.replace(tzinfo=timezone.utc)
+
+
+def test_failed_send_is_retried_with_backoff(smtp_stub, outbox):
+    smtp_stub.failures = 2
+    worker = _worker(backoff_seconds=30)
+    (message_id,) = _enqueue(outbox, "retry@example.com")
+    try:
+        delays = []
+        for _ in range(2):
+            started = datetime.now(timezone.utc)
+            assert worker.run_once() == 1
+            message = outbox.get(EmailOutbox, message_id)
+            outbox.refresh(message)
+            assert message.status == OUTBOX_PENDING
+            delays.append((_aware(message.next_attempt_at) - started).total_seconds())
+            # Nothing is due until the backoff has passed.
+            assert worker.run_once() == 0
+            message.next_attempt_at = datetime.now(timezone.utc)
+            outbox.commit()
+        assert worker.run_once() == 1
+    finally:
+        worker.transport.close()
+
+    outbox.refresh(message)
+    assert 29 <= delays[0] <= 31
+    assert 59 <= delays[1] <= 61
+    assert (message.status, message.attempts, message.body) == (OUTBOX_SENT, 3, None)
+    assert smtp_stub.recipients() == ["retry@example.com"]
+
+
+def test_batch_reuses_one_smtp_connection(smtp_stub, outbox):
+    recipients = [f"batch{index}@example.com" for index in range(5)]
+    _enqueue(outbox, *recipients)
+    worker = _worker()
+    try:
+        assert worker.run_once() == 5
+        _enqueue(outbox, "later@example.com")
+        assert worker.run_once() == 1
+    finally:
+        worker.transport.close()
+
+    assert smtp_stub.connections == 1
+    assert smtp_stub.recipients() == [*recipients, "later@example.com"]
+
+
+def test_leased_messages_are_not_sent_twice(smtp_stub, outbox):
+    first_ids = _enqueue(outbox, "lease1@example.com", "lease2@example.com")
+    first, second = _worker(), _worker()
+    try:
+        claimed = first._claim(outbox, datetime.now(timezone.utc))
+        assert [message.id for message in claimed] == first_ids
+        assert all(message.status == OUTBOX_SENDING for message in claimed)
+
+        # The second worker sees only leased rows and sends nothing.
+        assert second.run_once() == 0
+        for message in claimed:
+            first._deliver(outbox, message)
+        assert second.run_once() == 0
+
+        # A lapsed lease (worker died mid-send) is picked up exactly once.
+        (orphan_id,) = _enqueue(outbox, "orphan@example.com")
+        first._claim(outbox, datetime.now(timezone.utc))
+        orphan = outbox.get(EmailOutbox, orphan_id)
+        orphan.next_attempt_at = datetime.now(timezone.utc) - timedelta(seconds=1)
+        outbox.commit()
+        assert second.run_once() == 1
+        assert first.run_once() == 0
+    finally:
+        first.transport.close()
+        second.transport.close()
+
+    assert sorted(smtp_stub.recipients()) == ["lease1@example.com", "lease2@example.com", "orphan@example.com"]
+
+
+@pytest.mark.skipif(not os.getenv("TEST_POSTGRES_URL"), reason="TEST_POSTGRES_URL not set")
+def test_concurrent_workers_skip_locked_rows_on_postgresql(smtp_stub, monkeypatch):
+    admin_engine = create_engine(os.environ["TEST_POSTGRES_URL"])
+    with admin_engine.begin() as connection:
+        connection.execute(text("DROP SCHEMA IF EXISTS outbox_test CASCADE"))
+        connection.execute(text("CREATE SCHEMA outbox_test"))
+    pg_engine = create_engine(
+        os.environ["TEST_POSTGRES_URL"],
+        connect_args={"options": "-csearch_path=outbox_test"},
+    )
+    try:
+        EmailOutbox.__table__.create(pg_engine)
+        pg_session = sessionmaker(bind=pg_engine, expire_on_commit=False)
+        monkeypatch.setattr(email_outbox, "engine", pg_engine)
+        monkeypatch.setattr(email_outbox, "SessionLocal", pg_session)
+        with pg_session() as db:
+            recipients = [f"pg{index}@example.com" for index in range(40)]
+            _enqueue(db, *recipients)
+
+        smtp_stub.delay = 0.01
+        workers = [_worker(batch_size=5) for _ in range(4)]
+        barrier = threading.Barrier(len(workers))
+
+        def drain(worker: EmailOutboxWorker) -> None:
+            barrier.wait()
+            while worker.run_once():
+                pass
+            worker.transport.close()
+
+        threads = [threading.Thread(target=drain, args=(worker,)) for worker in workers]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(timeout=60)
+    finally:
+        pg_engine.dispose()
+        with admin_engine.begin() as connection:
+            connection.execute(text("DROP SCHEMA IF EXISTS outbox_test CASCADE"))
+        admin_engine.dispose()
+
+    assert sorted(smtp_stub.recipients()) == sorted(recipients)
+
+
+def test_delivery_status_requires_the_issued_token(smtp_stub, outbox, client):
+    response = client.post("/auth/email-code/request", json={"email": "Status@Example.com"})
+    assert response.status_code == 200
+    delivery_token = response.json()["delivery_token"]
+
+    pending = client.get(f"/auth/email-code/deliveries/{delivery_token}")
+    assert pending.status_code == 200
+    assert pending.json() == {"status": OUTBOX_PENDING, "attempts": 0, "sent_at": None}
+
+    worker = _worker()
+    try:
+        assert worker.run_once() == 1
+    finally:
+        worker.transport.close()
+
+    sent = client.get(f"/auth/email-code/deliveries/{delivery_token}").json()
+    assert (sent["status"], sent["attempts"]) == (OUTBOX_SENT, 1)
+    assert sent["sent_at"] is not None
+    assert set(sent) == {"status", "attempts", "sent_at"}
+
+    message_id = outbox.query(EmailOutbox.id).filter(EmailOutbox.recipient == "status@example.com").scalar()
+    for guess in (str(message_id), delivery_token[:-1] + ("A" if delivery_token[-1] != "A" else "B"), "x" * 32):
+        assert client.get(f"/auth/email-code/deliveries/{guess}").status_code == 404
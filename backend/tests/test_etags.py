@@ -0,0 +1,49 @@
+import pytest
+
+from test_query_counts import _auth, _create_user
+from database import SessionLocal
+
+
+@pytest.fixture
+def rater(client):
+    db = SessionLocal()
+    try:
+        user = _create_user(db, "etag")
+        db.commit()
+        return _auth(user)
+    finally:
+        db.close()
+
+
+def _paths(client, headers) -> list[str]:
+    course = client.get("/courses", headers=headers).json()[0]
+    return [
+        "/courses",
+        f"/courses/{course['id']}",
+        f"/courses/{course['id']}/ratings",
+        f"/teachers/{course['instructor']}/ratings",
+        f"/lessons/{course['lessons'][0]['id']}",
+    ]
+
+
+def test_matching_etag_returns_empty_304(client, rater):
+    for path in _paths(client, rater):
+        first = client.get(path, headers=rater)
+        assert first.status_code == 200, path
+        etag = first.headers["etag"]
+        cached = client.get(path, headers={**rater, "If-None-Match": etag})
+        assert (cached.status_code, cached.content, cached.headers["etag"]) == (304, b"", etag), path
+
+
+def test_rating_changes_the_rating_etags(client, rater):
+    course = client.get("/courses", headers=rater).json()[0]
+    paths = [f"/courses/{course['id']}/ratings", f"/teachers/{course['instructor']}/ratings"]
+    before = {path: client.get(path, headers=rater).headers["etag"] for path in paths}
+
+    client.post(f"/courses/{course['id']}/ratings", json={"rating": 3}, headers=rater)
+    client.post(f"/teachers/{course['instructor']}/ratings", json={"rating": 3}, headers=rater)
+
+    for path in paths:
+        response = client.get(path, headers={**rater, "If-None-Match": before[path]})
+        assert response.status_code == 200, path
+        assert response.headers["etag"] != before[path]
@@ -0,0 +1,227 @@
+import asyncio
+import socket
+import sqlite3
+import threading
+import time
+
+import pytest
+from sqlalchemy import create_engine, event
+from sqlalchemy.pool import StaticPool
+
+from event_bus import NOTIFY_PAYLOAD_LIMIT, OVERFLOW_PREFIX, PostgresEventBus
+from models import RealtimeEventPayload
+
+
+class Notify:
+    def __init__(self, channel: str, payload: str) -> None:
+        self.channel = channel
+        self.payload = payload
+
+
+class BrokerConnection:
+    """Listening connection with the psycopg2 surface the bus uses."""
+
+    def __init__(self, broker: "FakeBroker") -> None:
+        self.broker = broker
+        self.client, self.server = socket.socketpair()
+        self.autocommit = False
+        self.closed = False
+        self.channels: set[str] = set()
+        self.pending: list[Notify] = []
+        self.notifies: list[Notify] = []
+
+    def fileno(self) -> int:
+        return self.client.fileno()
+
+    def cursor(self) -> "BrokerCursor":
+        return BrokerCursor(self)
+
+    def poll(self) -> None:
+        if not self.client.recv(4096):
+            raise sqlite3.OperationalError("server closed the connection unexpectedly")
+        with self.broker.lock:
+            self.notifies.extend(self.pending)
+            self.pending.clear()
+
+    def close(self) -> None:
+        self.closed = True
+        self.client.close()
+
+
+class BrokerCursor:
+    def __init__(self, connection: BrokerConnection) -> None:
+        self.connection = connection
+
+    def __enter__(self) -> "BrokerCursor":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        pass
+
+    def execute(self, statement: str) -> None:
+        connection = self.connection
+        if connection.closed or connection.server.fileno() == -1:
+            raise sqlite3.OperationalError("connection already closed")
+        command, channel = statement.split(" ", 1)
+        channel = channel.strip('"')
+        with connection.broker.lock:
+            connection.broker.statements.append((connection, statement))
+            if command == "LISTEN":
+                connection.channels.add(channel)
+            else:
+                connection.channels.discard(channel)
+
+
+class FakeBroker:
+    """Stand-in for the PostgreSQL LISTEN/NOTIFY server."""
+
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.connections: list[BrokerConnection] = []
+        self.statements: list[tuple[BrokerConnection, str]] = []
+        self.notified: list[tuple[str, str]] = []
+        self.refuse_connections = 0
+
+    def connect(self) -> BrokerConnection:
+        with self.lock:
+            if self.refuse_connections:
+                self.refuse_connections -= 1
+                raise sqlite3.OperationalError("connection refused")
+        connection = BrokerConnection(self)
+        self.connections.append(connection)
+        return connection
+
+    def notify(self, channel: str, payload: str) -> None:
+        with self.lock:
+            self.notified.append((channel, payload))
+            listeners = [
+                connection
+                for connection in self.connections
+                if channel in connection.channels and not connection.closed
+            ]
+            for connection in listeners:
+                connection.pending.append(Notify(channel, payload))
+        for connection in listeners:
+            connection.server.send(b"!")
+
+    def drop(self, connection: BrokerConnection) -> None:
+        connection.server.close()
+
+    def statements_for(self, connection: BrokerConnection) -> list[str]:
+        return [statement for owner, statement in self.statements if owner is connection]
+
+
+class BrokerEventBus(PostgresEventBus):
+    def __init__(self, engine, broker: FakeBroker, **options) -> None:
+        super().__init__(engine, **options)
+        self.broker = broker
+
+    def _connect(self):
+        return self.broker.connect()
+
+
+@pytest.fixture
+def broker():
+    return FakeBroker()
+
+
+@pytest.fixture
+def bus(broker):
+    # NOTIFY and the overflow table go through a SQLite engine whose
+    # pg_notify() forwards to the fake broker.
+    engine = create_engine("sqlite://", poolclass=StaticPool, connect_args={"check_same_thread": False})
+
+    @event.listens_for(engine, "connect")
+    def register_pg_notify(dbapi_connection, connection_record):
+        dbapi_connection.create_function("pg_notify", 2, broker.notify)
+
+    RealtimeEventPayload.__table__.create(engine)
+    event_bus = BrokerEventBus(engine, broker, reconnect_delay=0.01)
+    # Overflow cleanup uses PostgreSQL interval syntax.
+    event_bus._last_cleanup = time.monotonic()
+    yield event_bus
+    engine.dispose()
+
+
+async def _wait_for(condition, timeout: float = 2.0) -> None:
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError("condition not met in time")
+        await asyncio.sleep(0.01)
+
+
+def _collector(received: list):
+    async def handler(channel: str, payload: str) -> None:
+        received.append((channel, payload))
+
+    return handler
+
+
+def test_each_channel_is_listened_once(bus, broker):
+    async def scenario() -> None:
+        await bus.start()
+        handler = _collector([])
+        for _ in range(3):
+            await bus.subscribe("lesson_1", handler)
+        await bus.subscribe("lesson_2", handler)
+        await bus.unsubscribe("lesson_1")
+        await bus.unsubscribe("lesson_1")
+        await bus.subscribe("lesson_1", handler)
+        await bus.stop()
+
+    asyncio.run(scenario())
+    assert broker.statements_for(broker.connections[0]) == [
+        'LISTEN "lesson_1"',
+        'LISTEN "lesson_2"',
+        'UNLISTEN "lesson_1"',
+        'LISTEN "lesson_1"',
+    ]
+
+
+def test_large_payload_goes_through_overflow_table(bus, broker):
+    received = []
+    small = '{"event":"ping"}'
+    large = '{"event":"bulk","data":"' + "x" * (NOTIFY_PAYLOAD_LIMIT + 100) + '"}'
+
+    async def scenario() -> None:
+        await bus.start()
+        await bus.subscribe("lesson_1", _collector(received))
+        await bus.publish("lesson_1", small)
+        await bus.publish("lesson_1", large)
+        await _wait_for(lambda: len(received) == 2)
+        await bus.stop()
+
+    asyncio.run(scenario())
+    (_, inline), (_, announced) = broker.notified
+    assert inline == small
+    assert announced.startswith(OVERFLOW_PREFIX)
+    assert len(announced.encode()) < NOTIFY_PAYLOAD_LIMIT
+    assert received == [("lesson_1", small), ("lesson_1", large)]
+
+
+def test_dropped_connection_is_reopened_and_listens_again(bus, broker):
+    received = []
+
+    async def scenario() -> None:
+        await bus.start()
+        handler = _collector(received)
+        await bus.subscribe("lesson_1", handler)
+        await bus.subscribe("lesson_2", handler)
+
+        broker.refuse_connections = 1
+        broker.drop(broker.connections[0])
+        await _wait_for(lambda: bus.stats()["reconnects"] == 1)
+
+        await bus.publish("lesson_2", "after-reconnect")
+        await _wait_for(lambda: received)
+        await bus.stop()
+
+    asyncio.run(scenario())
+    first, second = broker.connections
+    assert first.closed
+    assert sorted(broker.statements_for(second)) == ['LISTEN "lesson_1"', 'LISTEN "lesson_2"']
+    assert received == [("lesson_2", "after-reconnect")]
+    stats = bus.stats()
+    assert (stats["connected"], stats["reconnects"]) == (False, 1)
+    assert stats["last_error"] == "connection refused"
@@ -0,0 +1,131 @@
+import time
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import auth
+from database import SessionLocal
+from models import EmailOTP, User
+
+
+class FakeFirebaseAuth:
+    def __init__(self) -> None:
+        self.tokens: dict[str, dict] = {}
+        self.verified: list[str] = []
+
+    def verify_id_token(self, token: str, app=None) -> dict:
+        self.verified.append(token)
+        if token not in self.tokens:
+            raise ValueError("invalid token")
+        return self.tokens[token]
+
+
+class FakeClock:
+    def __init__(self) -> None:
+        self.offset = 0.0
+
+    def time(self) -> float:
+        return time.time() + self.offset
+
+    def monotonic(self) -> float:
+        return time.monotonic() + self.offset
+
+
+@pytest.fixture
+def firebase(monkeypatch, client):
+    fake = FakeFirebaseAuth()
+    monkeypatch.setattr(auth, "fb_auth", fake)
+    monkeypatch.setattr(auth, "firebase_app", object())
+    auth.firebase_token_cache.clear()
+    auth.user_identity_cache.clear()
+    yield fake
+    auth.firebase_token_cache.clear()
+    auth.user_identity_cache.clear()
+
+
+@pytest.fixture
+def firebase_user(firebase):
+    email = f"fb{time.monotonic_ns()}@example.com"
+    db = SessionLocal()
+    try:
+        user = User(email=email, username=email.split("@")[0], hashed_password="x")
+        otp = EmailOTP(
+            email=email,
+            code_hash="x",
+            expires_at=datetime.now(timezone.utc) + timedelta(minutes=10),
+            verified_at=datetime.now(timezone.utc),
+        )
+        db.add_all([user, otp])
+        db.commit()
+        user_id = user.id
+    finally:
+        db.close()
+    token = f"firebase-id-token-{user_id}"
+    firebase.tokens[token] = {"email": email, "email_verified": True, "exp": time.time() + 3600}
+    return token, user_id, email
+
+
+def _authenticate(token: str):
+    db = SessionLocal()
+    try:
+        return auth.get_current_user(token, db)
+    finally:
+        db.close()
+
+
+def test_repeat_request_skips_verification_and_database(firebase, firebase_user, count_queries):
+    token, user_id, _email = firebase_user
+
+    assert _authenticate(token).id == user_id
+    count_queries.clear()
+    for _ in range(3):
+        assert _authenticate(token).id == user_id
+
+    assert firebase.verified == [token]
+    assert count_queries == []
+
+
+def test_expired_cache_entry_is_verified_again(monkeypatch, firebase, firebase_user):
+    token, user_id, _email = firebase_user
+    _authenticate(token)
+
+    clock = FakeClock()
+    monkeypatch.setattr(auth, "time", clock)
+    clock.offset = 3601
+    firebase.tokens[token]["exp"] = clock.time() + 3600
+
+    assert _authenticate(token).id == user_id
+    assert firebase.verified == [token, token]
+
+
+def test_email_code_change_invalidates_cached_token(firebase, firebase_user):
+    token, _user_id, email = firebase_user
+    _authenticate(token)
+
+    db = SessionLocal()
+    try:
+        otp = db.query(EmailOTP).filter(EmailOTP.email == email).one()
+        otp.verified_at = None
+        db.commit()
+    finally:
+        db.close()
+
+    with pytest.raises(auth.HTTPException) as exc_info:
+        _authenticate(token)
+    assert exc_info.value.status_code == 403
+    assert firebase.verified == [token, token]
+
+
+def test_user_change_invalidates_cached_token(firebase, firebase_user):
+    token, user_id, _email = firebase_user
+    _authenticate(token)
+
+    db = SessionLocal()
+    try:
+        db.get(User, user_id).is_active = False
+        db.commit()
+    finally:
+        db.close()
+
+    assert _authenticate(token).is_active is False
+    assert firebase.verified == [token, token]
@@ -0,0 +1,35 @@
+from auth import create_user_access_token
+from database import SessionLocal
+from models import CourseLesson, User
+
+
+def test_pushing_messages_to_sockets_adds_no_queries(app_main, client, count_queries):
+    db = SessionLocal()
+    try:
+        teacher = db.query(User).filter(User.username == app_main.TEACHER_USERNAME).one()
+        token = create_user_access_token(teacher)
+        lesson_id = db.query(CourseLesson.id).order_by(CourseLesson.id).first()[0]
+    finally:
+        db.close()
+    headers = {"Authorization": f"Bearer {token}"}
+    url = f"/lessons/{lesson_id}/messages"
+
+    client.post(url, json={"content": "warm up"}, headers=headers)
+    count_queries.clear()
+    client.post(url, json={"content": "nobody listening"}, headers=headers)
+    without_sockets = len(count_queries)
+
+    socket_url = f"/ws/lessons/{lesson_id}/messages?token={token}"
+    with client.websocket_connect(socket_url) as first, client.websocket_connect(socket_url) as second:
+        for socket in (first, second):
+            assert socket.receive_json()["event"] == "connected"
+        count_queries.clear()
+        response = client.post(url, json={"content": "hello sockets"}, headers=headers)
+        with_sockets = len(count_queries)
+        events = [socket.receive_json() for socket in (first, second)]
+
+    assert with_sockets == without_sockets
+    for pushed in events:
+        assert pushed["event"] == "message_created"
+        assert pushed["message"] == response.json()
+        assert pushed["watermark"] is not None
@@ -0,0 +1,144 @@
+from itertools import count
+
+import pytest
+
+from auth import create_user_access_token
+from database import SessionLocal
+from models import (
+    AssignmentSubmission,
+    Course,
+    CourseLesson,
+    CoursePurchase,
+    CourseRating,
+    LessonAssignment,
+    TeacherRating,
+    User,
+)
+
+COURSE_LIST_QUERY_BUDGET = 6
+ASSIGNMENT_LIST_QUERY_BUDGET = 6
+
+_ids = count(1)
+
+
+def _create_user(db, prefix: str) -> User:
+    n = next(_ids)
+    user = User(email=f"{prefix}{n}@example.com", username=f"{prefix}{n}", hashed_password="x")
+    db.add(user)
+    db.flush()
+    return user
+
+
+def _auth(user: User) -> dict:
+    return {"Authorization": f"Bearer {create_user_access_token(user)}"}
+
+
+def _add_courses(app_main, db, buyer: User, raters: list[User], total: int) -> None:
+    for _ in range(total):
+        n = next(_ids)
+        course = Course(
+            id=f"qc-course-{n}",
+            title=f"Query budget course {n}",
+            image="/img.png",
+            category="Testing",
+            duration="1h",
+            price="$10",
+            instructor=f"Instructor {n % 7}",
+            summary="Catalog entry used by query-count tests.",
+            topics=[],
+            code_samples=[],
+        )
+        db.add(course)
+        for position in range(3):
+            db.add(CourseLesson(course=course, title=f"Lesson {position}", duration="5m", position=position))
+        for rater in raters:
+            db.add(CourseRating(course_id=course.id, user_id=rater.id, rating=1 + n % 5))
+        db.add(CoursePurchase(user_id=buyer.id, course_id=course.id))
+    for rater in raters:
+        for teacher in range(7):
+            name = f"Instructor {teacher}"
+            exists = (
+                db.query(TeacherRating)
+                .filter(TeacherRating.user_id == rater.id, TeacherRating.teacher_key == name.lower())
+                .first()
+            )
+            if not exists:
+                db.add(TeacherRating(teacher_name=name, teacher_key=name.lower(), user_id=rater.id, rating=4))
+    db.commit()
+    app_main.rebuild_course_rating_stats(db)
+    app_main.rebuild_teacher_rating_stats(db)
+
+
+def _course_list_queries(app_main, client, count_queries, headers: dict) -> tuple[int, int]:
+    app_main.catalog_snapshot_cache.invalidate()
+    client.get("/auth/me", headers=headers)
+    count_queries.clear()
+    response = client.get("/courses", headers=headers)
+    assert response.status_code == 200
+    return len(count_queries), len(response.json())
+
+
+def test_course_list_query_count_does_not_grow_with_catalog(app_main, client, count_queries):
+    db = SessionLocal()
+    try:
+        buyer = _create_user(db, "buyer")
+        raters = [_create_user(db, "rater") for _ in range(3)]
+        db.commit()
+        headers = _auth(buyer)
+
+        _add_courses(app_main, db, buyer, raters, 10)
+        small_queries, small_courses = _course_list_queries(app_main, client, count_queries, headers)
+        _add_courses(app_main, db, buyer, raters, 40)
+        large_queries, large_courses = _course_list_queries(app_main, client, count_queries, headers)
+    finally:
+        db.close()
+
+    assert large_courses == small_courses + 40
+    assert large_queries == small_queries
+    assert large_queries <= COURSE_LIST_QUERY_BUDGET
+
+
+def _add_assignments(db, lesson_id: int, student: User, teacher: User, total: int) -> None:
+    for index in range(total):
+        assignment = LessonAssignment(lesson_id=lesson_id, title=f"Assignment {next(_ids)}", max_rating=5)
+        db.add(assignment)
+        db.flush()
+        db.add(
+            AssignmentSubmission(
+                assignment_id=assignment.id,
+                student_id=student.id,
+                content="answer",
+                rating=4 if index % 2 else None,
+                graded_by=teacher.id if index % 2 else None,
+            )
+        )
+    db.commit()
+
+
+@pytest.mark.parametrize("caller", ["teacher", "student"])
+def test_lesson_assignment_list_query_count_does_not_grow(app_main, client, count_queries, caller):
+    db = SessionLocal()
+    try:
+        teacher = db.query(User).filter(User.username == app_main.TEACHER_USERNAME).one()
+        student = _create_user(db, "student")
+        lesson = db.query(CourseLesson).order_by(CourseLesson.id).first()
+        db.add(CoursePurchase(user_id=student.id, course_id=lesson.course_id))
+        db.commit()
+        lesson_id = lesson.id
+        headers = _auth(teacher if caller == "teacher" else student)
+
+        sizes = []
+        for total in (5, 25):
+            _add_assignments(db, lesson_id, student, teacher, total)
+            client.get("/auth/me", headers=headers)
+            count_queries.clear()
+            response = client.get(f"/lessons/{lesson_id}/assignments", headers=headers)
+            assert response.status_code == 200
+            sizes.append((len(count_queries), len(response.json())))
+    finally:
+        db.close()
+
+    (small_queries, small_items), (large_queries, large_items) = sizes
+    assert large_items == small_items + 25
+    assert large_queries == small_queries
+    assert large_queries <= ASSIGNMENT_LIST_QUERY_BUDGET
@@ -0,0 +1,47 @@
+import auth
+from auth import create_user_access_token
+from database import SessionLocal
+from models import CourseLesson, User
+
+
+def _teacher_request_statements(app_main, client, count_queries, token: str) -> list[str]:
+    db = SessionLocal()
+    try:
+        lesson_id = db.query(CourseLesson.id).order_by(CourseLesson.id).first()[0]
+    finally:
+        db.close()
+    auth.user_identity_cache.clear()
+    count_queries.clear()
+    response = client.get(f"/lessons/{lesson_id}/assignments", headers={"Authorization": f"Bearer {token}"})
+    assert response.status_code == 200
+    return list(count_queries)
+
+
+def _loads_roles(statements: list[str]) -> bool:
+    return any("user_roles" in statement for statement in statements)
+
+
+def test_current_role_claims_skip_role_loading(app_main, client, count_queries):
+    db = SessionLocal()
+    try:
+        teacher = db.query(User).filter(User.username == app_main.TEACHER_USERNAME).one()
+        token = create_user_access_token(teacher)
+    finally:
+        db.close()
+
+    assert not _loads_roles(_teacher_request_statements(app_main, client, count_queries, token))
+
+
+def test_stale_role_version_falls_back_to_loading_roles(app_main, client, count_queries):
+    db = SessionLocal()
+    try:
+        teacher = db.query(User).filter(User.username == app_main.TEACHER_USERNAME).one()
+        stale_token = create_user_access_token(teacher)
+        teacher.role_version = (teacher.role_version or 0) + 1
+        db.commit()
+        current_token = create_user_access_token(teacher)
+    finally:
+        db.close()
+
+    assert _loads_roles(_teacher_request_statements(app_main, client, count_queries, stale_token))
+    assert not _loads_roles(_teacher_request_statements(app_main, client, count_queries, current_token))
@@ -0,0 +1,45 @@
+import asyncio
+
+from event_bus import InProcessEventBus
+
+
+class FakeSocket:
+    def __init__(self, stalled: bool = False) -> None:
+        self.stalled = stalled
+        self.received: list[str] = []
+        self.close_code: int | None = None
+
+    async def accept(self) -> None:
+        pass
+
+    async def send_text(self, text: str) -> None:
+        if self.stalled:
+            await asyncio.Event().wait()
+        self.received.append(text)
+
+    async def close(self, code: int = 1000) -> None:
+        self.close_code = code
+
+
+def test_stalled_sockets_are_dropped_without_delaying_others(app_main):
+    hub = app_main.PrivateChatSocketHub("lesson_messages", InProcessEventBus(), queue_size=8)
+    healthy = [FakeSocket() for _ in range(200)]
+    stalled = [FakeSocket(stalled=True) for _ in range(3)]
+
+    async def scenario() -> None:
+        for socket in [*healthy, *stalled]:
+            await hub.connect(1, socket)
+        for index in range(20):
+            await hub.broadcast(1, {"event": "message_created", "id": index})
+            await asyncio.sleep(0)
+        for _ in range(10):
+            await asyncio.sleep(0)
+        for socket in healthy:
+            hub.disconnect(1, socket)
+        await asyncio.sleep(0)
+
+    asyncio.run(scenario())
+    assert all(len(socket.received) == 20 for socket in healthy)
+    assert healthy[0].received[-1] == '{"event":"message_created","id":19}'
+    assert [socket.close_code for socket in stalled] == [1013, 1013, 1013]
+    assert hub.slow_disconnects == 3
@@ -0,0 +1,87 @@
+import os
+
+import pytest
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.orm import Session
+
+from auth import get_user_by_username_or_email
+from database import SessionLocal, engine
+from models import User
+from password_hashing import pwd_context
+
+
+def _lookup_statement(bind_engine, db, login: str) -> tuple[str, object]:
+    captured = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        captured.append((statement, parameters))
+
+    event.listen(bind_engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        get_user_by_username_or_email(db, login)
+    finally:
+        event.remove(bind_engine, "before_cursor_execute", before_cursor_execute)
+    return captured[0]
+
+
+def test_login_lookup_probes_indexes_on_sqlite(client):
+    db = SessionLocal()
+    try:
+        statement, parameters = _lookup_statement(engine, db, "Somebody@Example.com")
+        rows = db.connection().exec_driver_sql(f"EXPLAIN QUERY PLAN {statement}", parameters)
+        plan = " ".join(row[-1] for row in rows)
+    finally:
+        db.close()
+    assert "ix_users_username_lower" in plan
+    assert "ix_users_email_lower" in plan
+    assert "SCAN users" not in plan
+
+
+@pytest.mark.skipif(not os.getenv("TEST_POSTGRES_URL"), reason="TEST_POSTGRES_URL not set")
+def test_login_lookup_probes_indexes_on_postgresql():
+    pg_engine = create_engine(os.environ["TEST_POSTGRES_URL"])
+    with pg_engine.connect() as connection:
+        transaction = connection.begin()
+        try:
+            # Everything happens in a throwaway schema inside a rolled-back transaction.
+            connection.execute(text("CREATE SCHEMA user_lookup_test"))
+            connection.execute(text("SET LOCAL search_path TO user_lookup_test"))
+            User.__table__.create(connection)
+            connection.execute(text("SET LOCAL enable_seqscan = off"))
+            db = Session(bind=connection)
+            statement, parameters = _lookup_statement(pg_engine, db, "Somebody@Example.com")
+            plan = " ".join(row[0] for row in connection.exec_driver_sql(f"EXPLAIN {statement}", parameters))
+        finally:
+            transaction.rollback()
+    pg_engine.dispose()
+    assert "ix_users_username_lower" in plan
+    assert "ix_users_email_lower" in plan
+    assert "Seq Scan" not in plan
+
+
+def test_login_with_exact_non_ascii_username(client):
+    db = SessionLocal()
+    try:
+        db.add(User(email="dilshod@example.com", username="Дилшод", hashed_password=pwd_context.hash("secret-pass")))
+        db.commit()
+    finally:
+        db.close()
+
+    by_name = client.post("/auth/login", json={"username": "Дилшод", "password": "secret-pass"})
+    by_email = client.post("/auth/login", json={"username": "dilshod@example.com", "password": "secret-pass"})
+    assert by_name.status_code == 200
+    assert by_email.status_code == 200
+
+
+def test_case_variants_prefer_exact_then_oldest(client):
+    db = SessionLocal()
+    try:
+        older = User(email="casey1@example.com", username="Casey", hashed_password="x")
+        newer = User(email="casey2@example.com", username="casey", hashed_password="x")
+        db.add_all([older, newer])
+        db.commit()
+        assert get_user_by_username_or_email(db, "casey").id == newer.id
+        assert get_user_by_username_or_email(db, "Casey").id == older.id
+        assert get_user_by_username_or_email(db, "CASEY").id == older.id
+    finally:
+        db.close()
@@ -0,0 +1,29 @@
+from auth import allocate_username
+from database import SessionLocal
+from models import User
+
+
+def test_shared_base_name_is_allocated_in_one_query(client, count_queries):
+    db = SessionLocal()
+    try:
+        db.add_all(
+            User(email=f"shared{index}@example.com", username=f"shared{index}" if index else "shared", hashed_password="x")
+            for index in range(300)
+            if index != 150
+        )
+        # Names that only look like suffixes must not count as taken.
+        db.add_all(
+            [
+                User(email="shared-x@example.com", username="sharedx", hashed_password="x"),
+                User(email="shared-0@example.com", username="shared0150", hashed_password="x"),
+            ]
+        )
+        db.commit()
+
+        count_queries.clear()
+        assert allocate_username(db, "shared") == "shared150"
+        assert len(count_queries) == 1
+        assert allocate_username(db, "shared", exclude={"shared150"}) == "shared300"
+        assert allocate_username(db, "fresh") == "fresh"
+    finally:
+        db.close()